@@ -0,0 +1,204 @@
+#!/usr/bin/env python3.5
+
+""" analytics: implied probabilities, overround and fair odds for each
+fixture, and summaries by team and season, computed over NumPy arrays and
+kept in tables beside the odds table. The store marks each fixture it
+changes, and refresh computes the markets of those alone, and recomputes
+the summaries of each season they are in.
+"""
+
+# third-party modules
+import numpy as np
+
+# package modules
+import store
+from definitions import DB_SUB_PATH
+
+# CONSTANTS
+OUTCOMES = 'HDA' # home, draw and away, in the order of the odds columns
+BUCKETS = 10 # calibration buckets of equal width in probability
+SEASON_START = 7 # seasons start in July
+# the season of a fixture, given its date as 'YYYY-MM-DD'
+SEASON = ('(CAST(substr(date, 1, 4) AS INTEGER) - '
+          '(CAST(substr(date, 6, 2) AS INTEGER) < {}))'.format(SEASON_START))
+FIXTURES = ('SELECT uid, home, away, ' + SEASON + ', home_odds, draw_odds, '
+            'away_odds, result FROM odds')
+CHANGED = FIXTURES + ' WHERE uid IN (SELECT uid FROM analytics_dirty)'
+IN_SEASON = FIXTURES + ' WHERE date >= ? AND date < ?'
+
+# FUNCTIONS
+
+
+def _arrays(rows):
+    """ Convert rows of (uid, home, away, season, home odds, draw odds, away
+    odds, result) into arrays. Odds are an (n, 3) array with NaN where
+    missing, and results are 0, 1 and 2 for home, draw and away, or -1.
+    """
+    codes = {outcome: num for num, outcome in enumerate(OUTCOMES)}
+    return {
+        'uid': [row[0] for row in rows],
+        'home': np.array([row[1] for row in rows], dtype=str),
+        'away': np.array([row[2] for row in rows], dtype=str),
+        'season': np.array([row[3] for row in rows], dtype=np.int32),
+        'odds': np.array([row[4:7] for row in rows],
+                         dtype=np.float64).reshape(-1, 3),
+        'result': np.array([codes.get(row[7], -1) for row in rows],
+                           dtype=np.int8)
+        }
+
+
+def implied(odds):
+    """ Compute the market for an (n, 3) array of fractional odds as
+    decimals, as stored in the odds table. Returns (probabilities,
+    overround, fair probabilities, fair odds), where the implied
+    probabilities of each fixture sum to one plus the overround, and fair
+    probabilities are scaled to sum to one.
+    """
+    probabilities = 1.0 / (odds + 1.0)
+    total = probabilities.sum(axis=1)
+    fair = probabilities / total[:, None]
+    return probabilities, total - 1.0, fair, 1.0/fair - 1.0
+
+
+def _market_rows(a):
+    priced = ~np.isnan(a['odds']).any(axis=1)
+    probabilities, overround, fair, fair_odds = implied(a['odds'][priced])
+    favourite = np.argmin(a['odds'][priced], axis=1)
+    uids = [uid for uid, p in zip(a['uid'], priced) if p]
+    return [(uid, int(season)) + tuple(p.tolist()) + (float(o),) +
+            tuple(f.tolist()) + (OUTCOMES[fav],)
+            for uid, season, p, o, f, fav in
+            zip(uids, a['season'][priced], probabilities, overround,
+                fair_odds, favourite)]
+
+
+def _team_rows(a, season):
+    """ Count results, and how often the favourite won, for each team in a
+    season of settled fixtures.
+    """
+    teams, index = np.unique(np.concatenate([a['home'], a['away']]),
+                             return_inverse=True)
+    n = len(a['home'])
+    home, away = index[:n], index[n:]
+    result = a['result']
+    favourite = np.argmin(a['odds'], axis=1)
+    size = len(teams)
+
+    def count(mask_home, mask_away):
+        return (np.bincount(home[mask_home], minlength=size) +
+                np.bincount(away[mask_away], minlength=size))
+
+    everything = np.ones(n, dtype=bool)
+    played = count(everything, everything)
+    wins = count(result == 0, result == 2)
+    draws = count(result == 1, result == 1)
+    favoured = count(favourite == 0, favourite == 2)
+    favoured_wins = count((favourite == 0) & (result == 0),
+                          (favourite == 2) & (result == 2))
+    return [(str(team), season, int(p), int(w), int(d), int(p - w - d),
+             int(f), int(fw)) for team, p, w, d, f, fw in
+            zip(teams, played, wins, draws, favoured, favoured_wins)]
+
+
+def _calibration_rows(a, season):
+    """ Compare the fair probability of every outcome with how often
+    outcomes of that probability happened, in buckets of probability.
+    """
+    probabilities, overround, fair, fair_odds = implied(a['odds'])
+    happened = a['result'][:, None] == np.arange(3)[None, :]
+    fair, happened = fair.ravel(), happened.ravel()
+    bucket = np.minimum((fair * BUCKETS).astype(int), BUCKETS - 1)
+    predictions = np.bincount(bucket, minlength=BUCKETS)
+    expected = np.bincount(bucket, weights=fair, minlength=BUCKETS)
+    observed = np.bincount(bucket, weights=happened, minlength=BUCKETS)
+    return [(season, b, int(predictions[b]), float(expected[b]),
+             int(observed[b])) for b in range(BUCKETS) if predictions[b]]
+
+
+def _season_dates(season):
+    return ('{0}-{1:02d}-01'.format(season, SEASON_START),
+            '{0}-{1:02d}-01'.format(season + 1, SEASON_START))
+
+
+def refresh(database=DB_SUB_PATH):
+    """ Bring the market, team_summary and calibration tables up to date
+    with the fixtures changed since the last refresh. Markets are computed
+    for the changed fixtures only; the summaries of each season they are in
+    are recomputed in full, over arrays of that season's fixtures. The
+    changed fixtures are read and cleared in one immediate transaction, so
+    a fixture marked again by another writer is never cleared unseen.
+    Returns the number of fixtures refreshed.
+    """
+    connection, c = store._connect(database)
+    connection.isolation_level = None # transactions managed here
+    try:
+        c.execute('BEGIN IMMEDIATE') # other writers wait until the commit
+        changed = _arrays(c.execute(CHANGED).fetchall())
+        if not len(changed['uid']):
+            c.execute('COMMIT')
+            return 0
+        c.executemany('INSERT OR REPLACE INTO market VALUES '
+                      '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', _market_rows(changed))
+        for season in sorted(set(changed['season'].tolist())):
+            a = _arrays(c.execute(IN_SEASON,
+                                  _season_dates(season)).fetchall())
+            settled = (a['result'] >= 0) & ~np.isnan(a['odds']).any(axis=1)
+            a = {name: np.asarray(values)[settled]
+                 for name, values in a.items()}
+            c.execute('DELETE FROM team_summary WHERE season = ?', (season,))
+            c.execute('DELETE FROM calibration WHERE season = ?', (season,))
+            if settled.any():
+                c.executemany('INSERT INTO team_summary VALUES '
+                              '(?, ?, ?, ?, ?, ?, ?, ?)',
+                              _team_rows(a, season))
+                c.executemany('INSERT INTO calibration VALUES '
+                              '(?, ?, ?, ?, ?)', _calibration_rows(a, season))
+        c.executemany('DELETE FROM analytics_dirty WHERE uid = ?',
+                      [(uid,) for uid in changed['uid']])
+        c.execute('COMMIT')
+        return len(changed['uid'])
+    finally:
+        if connection.in_transaction:
+            connection.rollback()
+        connection.close()
+
+
+def rebuild(database=DB_SUB_PATH):
+    """ Mark every fixture as changed and refresh, for a database written
+    before the analytics tables existed.
+    """
+    connection, c = store._connect(database)
+    try:
+        c.execute('INSERT OR IGNORE INTO analytics_dirty SELECT uid FROM odds')
+        connection.commit()
+    finally:
+        connection.close()
+    return refresh(database)
+
+
+def load_market(database=DB_SUB_PATH, season=None):
+    """ Load the market table, optionally for one season, as arrays: uid,
+    season, probabilities and fair odds as (n, 3) arrays, overround, and
+    the favourite as 0, 1 or 2 for home, draw or away.
+    """
+    connection, c = store._connect(database)
+    try:
+        query = 'SELECT * FROM market'
+        parameters = ()
+        if season is not None:
+            query += ' WHERE season = ?'
+            parameters = (season,)
+        rows = c.execute(query, parameters).fetchall()
+    finally:
+        connection.close()
+    values = np.array([row[2:9] for row in rows],
+                      dtype=np.float64).reshape(-1, 7)
+    return {
+        'uid': [row[0] for row in rows],
+        'season': np.array([row[1] for row in rows], dtype=np.int32),
+        'probabilities': values[:, 0:3],
+        'overround': values[:, 3],
+        'fair_odds': values[:, 4:7],
+        'favourite': np.array([OUTCOMES.index(row[9]) for row in rows],
+                              dtype=np.int8)
+        }
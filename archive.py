@@ -0,0 +1,255 @@
+#!/usr/bin/env python3.5
+
+""" archive: every page downloaded, kept for parsing again when the parsers
+change. Pages are stored once each by the hash of their body, compressed one
+by one so any page can be read back alone, with an index of when each was
+fetched and what from. reparse runs the parsers over the archive in a pool
+of processes and loads what they find into the database.
+"""
+
+# built in modules
+import os
+import os.path
+import gzip
+import hashlib
+import logging
+import sqlite3
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+# package modules
+import store
+import retrieve
+from fixture import FixtureBatch, MISSING
+from definitions import ARCHIVE_SUB_DIR, DB_SUB_PATH
+
+# CONSTANTS
+INDEX = 'index.sqlite'
+OBJECTS = 'objects'
+PAGES = ('CREATE TABLE IF NOT EXISTS pages (id INTEGER PRIMARY KEY, '
+         'digest TEXT NOT NULL, url TEXT, source TEXT NOT NULL, '
+         'competition TEXT, fetched_at TEXT NOT NULL)')
+PAGES_INDEX = ('CREATE INDEX IF NOT EXISTS pages_source ON pages '
+               '(source, fetched_at)')
+BLOBS = ('CREATE TABLE IF NOT EXISTS objects (digest TEXT PRIMARY KEY, '
+         'size INTEGER, stored INTEGER) WITHOUT ROWID')
+LEVEL = 6 # gzip compression level
+SOURCES = ('fixtures', 'odds', 'results') # in the order they are loaded
+CHUNK = 8 # pages sent to a worker at a time
+WINDOW = 14 # days of fixtures priced on an odds page, from when fetched
+
+log = logging.getLogger(__name__)
+
+# CLASSES
+
+
+class Archive:
+
+    def __init__(self, folder=ARCHIVE_SUB_DIR):
+        """ An archive of pages under folder. Each distinct body is saved
+        once, gzipped, under objects/ by its SHA-256; the index records
+        every time a page was fetched, with its URL, source and
+        competition.
+        """
+        self.folder = folder
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.connection = sqlite3.connect(os.path.join(folder, INDEX))
+        for statement in (PAGES, PAGES_INDEX, BLOBS):
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def add(self, url, body, source, competition=None, fetched_at=None):
+        """ Archive a page fetched at a time, by default now, and return
+        the hash of its body. A body already in the archive is not saved
+        again.
+        """
+        digest = hashlib.sha256(body).hexdigest()
+        if fetched_at is None:
+            fetched_at = datetime.datetime.now().replace(microsecond=0)
+        known = self.connection.execute(
+            'SELECT 1 FROM objects WHERE digest = ?', (digest,)).fetchone()
+        stored = None
+        if known is None:
+            path = _path(self.folder, digest)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            data = gzip.compress(body, LEVEL)
+            with open(path + '.part', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.part', path)
+            stored = len(data)
+        with self.connection:
+            if stored is not None:
+                self.connection.execute(
+                    'INSERT OR IGNORE INTO objects VALUES (?, ?, ?)',
+                    (digest, len(body), stored))
+            self.connection.execute(
+                'INSERT INTO pages (digest, url, source, competition, '
+                'fetched_at) VALUES (?, ?, ?, ?, ?)',
+                (digest, url, source, competition, str(fetched_at)))
+        return digest
+
+    def open(self, digest):
+        """ Return a file from which a page can be read as it is
+        decompressed.
+        """
+        return gzip.open(_path(self.folder, digest), 'rb')
+
+    def read(self, digest):
+        with self.open(digest) as f:
+            return f.read()
+
+    def entries(self, sources=None, competition=None, since=None,
+                until=None):
+        """ Return the index of pages fetched, optionally only from some
+        sources and a competition, between two times given as text, as a
+        list of (id, digest, url, source, competition, fetched_at) in the
+        order they were fetched.
+        """
+        conditions, parameters = [], []
+        if sources is not None:
+            sources = list(sources)
+            conditions.append('source IN ({})'.format(
+                ', '.join('?'*len(sources))))
+            parameters.extend(sources)
+        if competition is not None:
+            conditions.append('competition = ?')
+            parameters.append(competition)
+        if since is not None:
+            conditions.append('fetched_at >= ?')
+            parameters.append(str(since))
+        if until is not None:
+            conditions.append('fetched_at <= ?')
+            parameters.append(str(until))
+        query = 'SELECT * FROM pages'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        return self.connection.execute(query + ' ORDER BY fetched_at, id',
+                                       parameters).fetchall()
+
+    def pages(self, *args, **kwargs):
+        """ Yield (entry, body) for each page chosen as for entries, one
+        page at a time.
+        """
+        for entry in self.entries(*args, **kwargs):
+            yield entry, self.read(entry[1])
+
+    def stats(self):
+        """ Return the number of pages fetched, the number stored, and the
+        bytes they take before and after compression.
+        """
+        fetched = self.connection.execute(
+            'SELECT count(*) FROM pages').fetchone()[0]
+        stored, size, compressed = self.connection.execute(
+            'SELECT count(*), coalesce(sum(size), 0), '
+            'coalesce(sum(stored), 0) FROM objects').fetchone()
+        return {'pages': fetched, 'objects': stored, 'bytes': size,
+                'stored': compressed}
+
+    def close(self):
+        self.connection.close()
+
+# FUNCTIONS
+
+
+def _path(folder, digest):
+    return os.path.join(folder, OBJECTS, digest[:2], digest[2:] + '.gz')
+
+
+def _parse(task):
+    """ Parse one archived page in a worker. Fixtures and results pages give
+    a FixtureBatch, stamped with the day they were first fetched; odds pages
+    give the lists of teams and odds read from them. Returns (digest,
+    parsed, error).
+    """
+    folder, digest, source, stamp = task
+    try:
+        with gzip.open(_path(folder, digest), 'rb') as f:
+            body = f.read()
+        if source == 'odds':
+            return digest, retrieve.read_odds(body), None
+        if source == 'fixtures':
+            found = retrieve.get_fixtures(body=body)
+        else:
+            found = retrieve.get_results(body=body)
+        for new in found:
+            new.stamp = stamp
+        return digest, FixtureBatch.from_fixtures(found), None
+    except Exception as e:
+        return digest, None, '{0}: {1}'.format(type(e).__name__, e)
+
+
+def _load(w, entry, parsed, totals):
+    """ Load what was parsed from one page through a store.Writer. Odds are
+    matched against the fixtures due within WINDOW days of when the page was
+    fetched, whether or not they have since been played, and added to their
+    history without replacing newer prices.
+    """
+    source, fetched_at = entry[3], entry[5]
+    if source == 'fixtures':
+        summary = w.enter_fixtures(parsed)
+    elif source == 'results':
+        summary = w.update_results(parsed)
+    else:
+        teams, odds = parsed
+        day = datetime.datetime.strptime(fetched_at[:10], '%Y-%m-%d').date()
+        last = day + datetime.timedelta(days=WINDOW)
+        rows = w.c.execute('SELECT * FROM odds WHERE date >= ? AND '
+                           'date <= ?', (str(day), str(last))).fetchall()
+        fixtures = list(FixtureBatch.from_rows(rows))
+        for f in fixtures: # priced only by this page
+            f.home_odds = f.draw_odds = f.away_odds = MISSING
+        retrieve.match_odds(fixtures, teams, odds, day)
+        summary = w.record_odds(fixtures, fetched_at)
+    for key, n in summary.items():
+        counts = totals.setdefault(source, {})
+        counts[key] = counts.get(key, 0) + n
+
+
+def reparse(archive=None, path=DB_SUB_PATH, sources=SOURCES, since=None,
+            until=None, processes=None):
+    """ Parse the archived pages from sources, fetched between since and
+    until, across a pool of processes, and load them into the database in
+    the order they were fetched, in one transaction. Each distinct page is
+    parsed once however often it was fetched. processes=1 parses them
+    here instead. Returns the rows written by source, and the number of
+    pages parsed and failed.
+    """
+    archive = Archive() if archive is None else archive
+    entries = archive.entries(sources, since=since, until=until)
+    tasks, seen = [], set()
+    for entry in entries:
+        if entry[1] not in seen:
+            seen.add(entry[1])
+            tasks.append((archive.folder, entry[1], entry[3],
+                          entry[5][:10]))
+    if processes == 1:
+        results = [_parse(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_parse, tasks, chunksize=CHUNK))
+    parsed = {}
+    failed = 0
+    for digest, found, error in results:
+        if error is not None:
+            failed += 1
+            log.warning('Could not parse archived page %s. Error: %s',
+                        digest, error, extra={'digest': digest})
+        else:
+            parsed[digest] = found
+    totals = {}
+    # pages fetched at the same time are loaded fixtures first
+    order = sorted(entries, key=lambda e: (e[5], SOURCES.index(e[3]), e[0]))
+    with store.Writer(path) as w:
+        for entry in order:
+            if entry[1] in parsed:
+                _load(w, entry, parsed[entry[1]], totals)
+    totals['pages'] = {'parsed': len(parsed), 'failed': failed}
+    return totals
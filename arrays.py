@@ -0,0 +1,148 @@
+#!/usr/bin/env python3.5
+
+""" arrays: a columnar copy of the odds database, saved as NumPy .npz files
+for analysis. Each export adds a part holding only the rows changed since the
+last one; load joins the parts back into one array per column.
+"""
+
+# built in modules
+import os
+import os.path
+import glob
+import json
+import datetime
+
+# third-party modules
+import numpy as np
+
+# package modules
+import store
+from fixture import FixtureBatch, NO_SCORE
+from definitions import ARRAYS_SUB_DIR, DB_SUB_PATH
+
+# CONSTANTS
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+NO_DATE = -1 # missing dates, as days since 1970
+RESULTS = 'HDA' # results are stored as their position in this string
+STATE = 'state.json'
+PART = 'part-{:06d}.npz'
+MAX_PARTS = 50 # parts are merged into one when there are more than this
+CHANGED = 'SELECT * FROM odds WHERE modified > ? ORDER BY modified, id'
+
+# FUNCTIONS
+
+
+def _state(folder):
+    try:
+        with open(os.path.join(folder, STATE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'version': -1, 'parts': 0}
+
+
+def _save_state(folder, state):
+    with open(os.path.join(folder, STATE), 'w') as f:
+        json.dump(state, f)
+
+
+def _columns(rows):
+    """ Convert rows of the odds table into typed arrays, one per column.
+    """
+    batch = FixtureBatch.from_rows(rows)
+    dates = np.frombuffer(batch.dates, dtype=np.int32)
+    home_score = np.frombuffer(batch.home_score, dtype=np.int16)
+    away_score = np.frombuffer(batch.away_score, dtype=np.int16)
+    result = np.sign(away_score - home_score).astype(np.int8) + 1
+    result[(home_score == NO_SCORE) | (away_score == NO_SCORE)] = -1
+    return {
+        'uid': np.array(batch.uids, dtype=str),
+        'teams': np.array(batch.teams, dtype=str),
+        'home': np.frombuffer(batch.home, dtype=np.int16),
+        'away': np.frombuffer(batch.away, dtype=np.int16),
+        'date': np.where(dates == NO_SCORE, NO_DATE,
+                         dates - EPOCH).astype(np.int32),
+        'time': np.frombuffer(batch.times, dtype=np.int16),
+        'home_odds': np.frombuffer(batch.home_odds, dtype=np.float64),
+        'draw_odds': np.frombuffer(batch.draw_odds, dtype=np.float64),
+        'away_odds': np.frombuffer(batch.away_odds, dtype=np.float64),
+        'home_score': home_score,
+        'away_score': away_score,
+        'result': result,
+        'modified': np.array([row[13] for row in rows], dtype=np.int64)
+        }
+
+
+def export_arrays(folder=ARRAYS_SUB_DIR, database=DB_SUB_PATH):
+    """ Save the rows of the odds database changed since the last export as
+    a new part under folder, and return the number of rows saved. Team names
+    are saved once per part, with home and away as indices into them; dates
+    are days since 1970 and times are minutes past midnight. Missing odds
+    are NaN, and missing scores, results, dates and times are -1. Results
+    are 0, 1 and 2 for home, draw and away.
+    """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    state = _state(folder)
+    connection, c = store._connect(database)
+    try:
+        rows = c.execute(CHANGED, (state['version'],)).fetchall()
+    finally:
+        connection.close()
+    if not rows:
+        return 0
+    columns = _columns(rows)
+    state['parts'] += 1
+    np.savez(os.path.join(folder, PART.format(state['parts'])), **columns)
+    state['version'] = int(columns['modified'].max())
+    _save_state(folder, state)
+    if len(glob.glob(os.path.join(folder, 'part-*.npz'))) > MAX_PARTS:
+        compact(folder)
+    return len(rows)
+
+
+def load_arrays(folder=ARRAYS_SUB_DIR):
+    """ Load every part under folder into one array per column, holding the
+    latest copy of each fixture. Returns a dictionary of arrays, in which
+    home and away index into the array of names under 'teams'.
+    """
+    parts = sorted(glob.glob(os.path.join(folder, 'part-*.npz')))
+    teams, index = [], {}
+    columns = {}
+    for part in parts:
+        with np.load(part) as data:
+            codes = np.array([index.setdefault(str(name), len(index))
+                              for name in data['teams']], dtype=np.int16)
+            for name in data.files:
+                if name == 'teams':
+                    continue
+                values = data[name]
+                if name in ('home', 'away') and len(values):
+                    values = codes[values]
+                columns.setdefault(name, []).append(values)
+    teams = sorted(index, key=index.get)
+    if not columns:
+        empty = _columns([])
+        empty['teams'] = np.array(teams, dtype=str)
+        return empty
+    columns = {name: np.concatenate(values)
+               for name, values in columns.items()}
+    # keep the last copy of each fixture, which is the most recent
+    uids = columns['uid'][::-1]
+    _, first = np.unique(uids, return_index=True)
+    keep = np.sort(len(uids) - 1 - first)
+    columns = {name: values[keep] for name, values in columns.items()}
+    columns['teams'] = np.array(teams, dtype=str)
+    return columns
+
+
+def compact(folder=ARRAYS_SUB_DIR):
+    """ Merge all of the parts under folder into one.
+    """
+    columns = load_arrays(folder)
+    parts = glob.glob(os.path.join(folder, 'part-*.npz'))
+    state = _state(folder)
+    state['parts'] += 1
+    np.savez(os.path.join(folder, PART.format(state['parts'])), **columns)
+    for part in parts:
+        os.remove(part)
+    _save_state(folder, state)
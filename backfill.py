@@ -0,0 +1,226 @@
+#!/usr/bin/env python3.5
+
+""" backfill: load past seasons into the database from the BBC's pages of
+fixtures and results for each month. Pages are downloaded at the same time
+within a rate limit, parsed in a pool of processes and loaded many months
+to a transaction, one window of months after another. Each finished month
+loaded is recorded with its fixtures, so a backfill which stops part way
+carries on from the months still to load, while this month and those to
+come, whose pages still change, are loaded again on every run.
+"""
+
+# built in modules
+import logging
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# package modules
+import store
+import metrics
+import retrieve
+import competitions
+from fixture import FixtureBatch
+from definitions import DB_SUB_PATH
+
+# CONSTANTS
+PROGRESS = ('CREATE TABLE IF NOT EXISTS backfill (competition TEXT NOT NULL, '
+            'month TEXT NOT NULL, pages INTEGER, fixtures INTEGER, '
+            'loaded_at TEXT, PRIMARY KEY (competition, month)) WITHOUT ROWID')
+LOADED = ('INSERT OR REPLACE INTO backfill (competition, month, pages, '
+          'fixtures, loaded_at) VALUES (?, ?, ?, ?, ?)')
+RATE = 2.0 # pages requested a second, from all hosts
+BATCH = 12 # months loaded in each transaction
+SOURCES = ('fixtures', 'results') # in the order they are loaded
+
+log = logging.getLogger(__name__)
+
+# FUNCTIONS
+
+
+def _month(value):
+    """ Return (year, month) from a date or text given as YYYY-MM.
+    """
+    if isinstance(value, str):
+        try:
+            year, month = value.split('-')[:2]
+            value = datetime.date(int(year), int(month), 1)
+        except ValueError:
+            raise ValueError('Not a month ({})'.format(value))
+    return value.year, value.month
+
+
+def months(start, end):
+    """ Yield (year, month) for each month from start to end, inclusive,
+    given as dates or text.
+    """
+    year, month = _month(start)
+    last = _month(end)
+    while (year, month) <= last:
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _pages(chosen, window, done, this):
+    """ Return the pages of each month in window, a list of (year, month),
+    which is not done, as a dictionary of address to (competition, month,
+    source). Months before this, the (year, month) of today, have results,
+    later months have fixtures, and this month has both.
+    """
+    pages = {}
+    for competition in chosen:
+        for year, month in window:
+            text = '{0:04d}-{1:02d}'.format(year, month)
+            if (competition.key, text) in done:
+                continue
+            sources = [s for s in SOURCES
+                       if (s == 'results' and (year, month) <= this)
+                       or (s == 'fixtures' and (year, month) >= this)]
+            for source in sources:
+                url = competition.month_url(source, year, month)
+                pages[url] = (competition.key, text, source)
+    return pages
+
+
+def _parse(task):
+    """ Parse one page in a worker. Returns (parsed, error), where parsed is
+    a FixtureBatch.
+    """
+    source, body = task
+    try:
+        if source == 'fixtures':
+            found = retrieve.get_fixtures(body=body)
+        else:
+            found = retrieve.get_results(body=body)
+        return FixtureBatch.from_fixtures(found), None
+    except Exception as e:
+        return None, '{0}: {1}'.format(type(e).__name__, e)
+
+
+def _add(totals, kind, summary):
+    counts = totals.setdefault(kind, {})
+    for key, n in summary.items():
+        counts[key] = counts.get(key, 0) + n
+
+
+def _load(w, parsed, totals):
+    """ Load the pages of one month through a store.Writer, fixtures first.
+    Results add the fixtures not yet in the database, without moving those
+    which are, as they have no kick-off time, and then set their scores.
+    """
+    for source, batch in sorted(parsed, key=lambda p: SOURCES.index(p[0])):
+        if source == 'fixtures':
+            _add(totals, 'fixtures', w.enter_fixtures(batch))
+        else:
+            _add(totals, 'fixtures', w.enter_fixtures(batch, reschedule=False))
+            _add(totals, 'results', w.update_results(batch))
+
+
+def completed(path=DB_SUB_PATH):
+    """ Return the set of (competition, month) already loaded.
+    """
+    connection, c = store._connect(path)
+    try:
+        c.execute(PROGRESS)
+        return set(c.execute('SELECT competition, month FROM backfill'))
+    finally:
+        connection.close()
+
+
+def _fetch(pages, pool, session, limit, archive):
+    """ Download pages at once, parsing each in the pool, or here if pool
+    is None, as it arrives. Returns what was parsed, as a list of (source,
+    FixtureBatch) by (competition, month), and the set of months any of
+    whose pages could not be downloaded or parsed.
+    """
+    m = metrics.current()
+    found, failed, futures = {}, set(), {}
+    for url, body, error in retrieve.fetch_all(pages, session, limit=limit):
+        key, month, source = pages[url]
+        if error is not None:
+            log.warning('Could not download %s. Error: %s', url, error,
+                        extra={'url': url, 'month': month})
+            failed.add((key, month))
+            continue
+        m.count('pages', source=source)
+        if archive is not None:
+            archive.add(url, body, source, key)
+        if pool is None:
+            futures[url] = _parse((source, body))
+        else:
+            futures[pool.submit(_parse, (source, body))] = url
+    results = futures.items() if pool is None else \
+        ((futures[f], f.result()) for f in as_completed(futures))
+    for url, (parsed, error) in results:
+        key, month, source = pages[url]
+        if error is not None:
+            log.warning('Could not parse %s. Error: %s', url, error,
+                        extra={'url': url, 'month': month})
+            failed.add((key, month))
+        else:
+            found.setdefault((key, month), []).append((source, parsed))
+    return found, failed
+
+
+def backfill(start, end, chosen=None, path=DB_SUB_PATH, rate=RATE,
+             processes=None, batch=BATCH, session=None, archive=None,
+             today=None):
+    """ Load the fixtures and results of every month from start to end,
+    given as dates or as text YYYY-MM, for the chosen competitions, by
+    default all of them. Finished months already loaded are skipped. The
+    range is worked through batch months at a time: the pages of each
+    window are downloaded no faster than rate a second and parsed across a
+    pool of processes, or here if processes is 1, and then loaded in one
+    transaction, with a record of each month before today's, before the
+    next window is started. This month and later ones are loaded again on
+    every run, as their pages still change. A month any of whose pages
+    could not be downloaded or parsed is left to the next run. Pages are
+    also kept in an Archive, if given. Returns the rows written, and the
+    number of months loaded, failed and skipped.
+    """
+    chosen = list(competitions.REGISTRY.values()) if chosen is None \
+        else chosen
+    today = datetime.date.today() if today is None else today
+    this = '{0:04d}-{1:02d}'.format(today.year, today.month)
+    done = completed(path)
+    wanted = list(months(start, end))
+    limit = retrieve.RateLimit(rate)
+    m = metrics.current()
+    totals = {}
+    loaded, failed = 0, 0
+    pool = None if processes == 1 else ProcessPoolExecutor(processes)
+    try:
+        with store.Writer(path) as w:
+            for first in range(0, len(wanted), batch):
+                window = wanted[first:first+batch]
+                pages = _pages(chosen, window, done, _month(this))
+                if not pages:
+                    continue
+                found, missed = _fetch(pages, pool, session, limit, archive)
+                ready = sorted(set(found) - missed,
+                               key=lambda k: (k[1], k[0]))
+                with m.stage('store'):
+                    for key, month in ready:
+                        parsed = found[key, month]
+                        _load(w, parsed, totals)
+                        if month >= this:
+                            continue # still changing, so loaded every run
+                        loaded_at = datetime.datetime.now().replace(
+                            microsecond=0)
+                        w.c.execute(LOADED, (key, month, len(parsed),
+                                             sum(len(p[1]) for p in parsed),
+                                             str(loaded_at)))
+                    w.commit()
+                loaded += len(ready)
+                failed += len(missed)
+                log.info('Backfilled %d months to %04d-%02d', len(ready),
+                         *window[-1], extra={'loaded': len(ready)})
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    totals['months'] = {
+        'loaded': loaded, 'failed': failed,
+        'skipped': sum((c.key, '{0:04d}-{1:02d}'.format(*n)) in done
+                       for c in chosen for n in wanted)}
+    m.count('backfill_months', loaded, status='loaded')
+    m.count('backfill_months', failed, status='failed')
+    return totals
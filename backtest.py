@@ -0,0 +1,140 @@
+#!/usr/bin/env python3.5
+
+""" backtest: evaluate betting strategies against the odds and results in
+the database. A strategy is a function of the fixture arrays and some
+parameters, returning the outcome to back in each fixture; sweep runs many
+sets of parameters across a pool of processes.
+"""
+
+# built in modules
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+# third-party modules
+import numpy as np
+
+# package modules
+import store
+import analytics
+from definitions import DB_SUB_PATH
+
+# CONSTANTS
+NO_BET = -1
+SETTLED = (analytics.FIXTURES + ' WHERE result IS NOT NULL AND home_odds IS '
+           'NOT NULL AND draw_odds IS NOT NULL AND away_odds IS NOT NULL '
+           'ORDER BY date, time, id')
+CHUNK = 64 # parameter sets sent to a worker at a time
+
+_fixtures = None # arrays held by each worker process; see _start
+
+# FUNCTIONS
+
+
+def load(database=DB_SUB_PATH, seasons=None):
+    """ Load every settled fixture with odds, in date order, as arrays:
+    odds as an (n, 3) array of home, draw and away, result as 0, 1 or 2,
+    season, and the names of the home and away teams.
+    """
+    connection, c = store._connect(database)
+    try:
+        rows = c.execute(SETTLED).fetchall()
+    finally:
+        connection.close()
+    fixtures = analytics._arrays(rows)
+    if seasons is not None:
+        keep = np.isin(fixtures['season'], list(seasons))
+        fixtures = {name: np.asarray(values)[keep]
+                    for name, values in fixtures.items()}
+    return fixtures
+
+
+def evaluate(fixtures, selection):
+    """ Work out the returns from backing, with a stake of one, the outcome
+    chosen for each fixture in selection (0, 1 or 2 for home, draw or away,
+    or NO_BET). Returns a dictionary with the number of bets, profit and
+    loss, return on investment, hit rate and largest drawdown.
+    """
+    selection = np.asarray(selection)
+    bet = selection != NO_BET
+    rows = np.arange(len(selection))
+    price = fixtures['odds'][rows, np.where(bet, selection, 0)]
+    won = bet & (fixtures['result'] == selection)
+    pnl = np.where(won, price, -1.0) * bet
+    balance = np.concatenate([[0.0], np.cumsum(pnl)])
+    drawdown = np.maximum.accumulate(balance) - balance
+    bets = int(bet.sum())
+    total = float(pnl.sum())
+    return {
+        'bets': bets,
+        'pnl': total,
+        'roi': total / bets if bets else 0.0,
+        'hit_rate': float(won.sum()) / bets if bets else 0.0,
+        'max_drawdown': float(drawdown.max())
+        }
+
+
+def grid(**parameters):
+    """ Return every combination of the values given for each parameter, as
+    a list of dictionaries.
+    """
+    names = sorted(parameters)
+    return [dict(zip(names, values)) for values in
+            itertools.product(*[parameters[name] for name in names])]
+
+
+def _start(fixtures):
+    """ Keep the fixtures in a worker, so they are sent to it only once.
+    """
+    global _fixtures
+    _fixtures = fixtures
+
+
+def _run(strategy, parameters):
+    return evaluate(_fixtures, strategy(_fixtures, **parameters))
+
+
+def sweep(strategy, configurations, fixtures, processes=None):
+    """ Evaluate a strategy for each dictionary of parameters in
+    configurations, across a pool of processes; processes=1 runs them here
+    instead. The strategy must be a module-level function. Returns a list
+    of (parameters, results) in the order given.
+    """
+    configurations = list(configurations)
+    if processes == 1:
+        results = [evaluate(fixtures, strategy(fixtures, **parameters))
+                   for parameters in configurations]
+    else:
+        with ProcessPoolExecutor(processes, initializer=_start,
+                                 initargs=(fixtures,)) as pool:
+            results = list(pool.map(_run,
+                                    itertools.repeat(strategy),
+                                    configurations, chunksize=CHUNK))
+    return list(zip(configurations, results))
+
+# STRATEGIES
+
+
+def favourites(fixtures, max_odds=1.0):
+    """ Back the favourite when its odds are no longer than max_odds.
+    """
+    odds = fixtures['odds']
+    favourite = np.argmin(odds, axis=1)
+    price = odds[np.arange(len(odds)), favourite]
+    return np.where(price <= max_odds, favourite, NO_BET)
+
+
+def draws(fixtures, min_odds=0.0, max_odds=float('inf')):
+    """ Back the draw when its odds are between min_odds and max_odds.
+    """
+    price = fixtures['odds'][:, 1]
+    return np.where((price >= min_odds) & (price <= max_odds), 1, NO_BET)
+
+
+def outsiders(fixtures, min_odds=3.0):
+    """ Back the outcome with the longest odds when they are at least
+    min_odds.
+    """
+    odds = fixtures['odds']
+    outsider = np.argmax(odds, axis=1)
+    price = odds[np.arange(len(odds)), outsider]
+    return np.where(price >= min_odds, outsider, NO_BET)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3.5
+
+""" benchmark: timings for the slower parts of the package, run against the
+sample pages saved under pages/. The suite times parsing, extraction, Fixture
+construction, each write to the database and a whole update, on the pages
+as recorded and repeated to 10 and 100 times their size, and saves the
+timings as JSON for comparing one run with another.
+"""
+
+# built in modules
+import os.path
+import sys
+import json
+import time
+import timeit
+import argparse
+import datetime
+import platform
+import tempfile
+import importlib.util
+
+# package modules
+import main
+import store
+import parser
+import retrieve
+import standin
+from fixture import Fixture
+
+# CONSTANTS
+PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+SUPERSEDED = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'superseded')
+REPEAT = 5
+SCALES = (1, 10, 100) # sizes of the pages, as multiples of those recorded
+RESULTS = 'benchmark.json'
+TOLERANCE = 0.25 # slowdown, as a fraction, reported as a regression
+
+# FUNCTIONS
+
+
+def _load(name, path):
+    """ Import a module from a path, for modules kept under superseded/.
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _page(name):
+    with open(os.path.join(PAGES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def _best(function, number):
+    """ Return the quickest time, in seconds, for one call of a function.
+    """
+    times = timeit.repeat(function, number=number, repeat=REPEAT)
+    return min(times) / number
+
+
+def bench_parser(number=20):
+    """ Time the BBC parsers against the parser they replaced, on the sample
+    fixtures page: BBCParser, on the standard library's tokeniser, and
+    LxmlBBCParser, on lxml's, which iter_matches uses where lxml is
+    installed. Returns a dictionary of timings in seconds, and the speedup
+    of the parser in use.
+    """
+    old = _load('parser_v0', os.path.join(SUPERSEDED, 'parser v0.py'))
+    page = _page('bbc-fixtures.html')
+
+    def run(module):
+        p = module.BBCParser()
+        p.feed(page)
+        p.close()
+        return list(p.matches)
+
+    def stream(cls):
+        return list(parser.iter_matches([page], cls))
+
+    expected = run(old)
+    if run(parser) != expected or stream(parser.PARSER) != expected:
+        raise RuntimeError('Parsers disagree on the sample page')
+    timings = {'parser_v0': _best(lambda: run(old), number),
+               'parser': _best(lambda: run(parser), number)}
+    if parser.etree is not None:
+        timings['parser_lxml'] = _best(
+            lambda: stream(parser.LxmlBBCParser), number)
+    timings['speedup'] = timings['parser_v0'] / timings[
+        'parser_lxml' if parser.PARSER is parser.LxmlBBCParser else 'parser']
+    return timings
+
+
+def _best_of(run, setup=None, repeat=REPEAT):
+    """ Return the quickest time, in seconds, for one call of run, calling
+    setup, untimed, before each call for the arguments to give it.
+    """
+    best = None
+    for num in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        run(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _fixtures(pages, odds):
+    """ Parse the fixtures and results on pages, giving every fixture odds
+    from the odds page in turn.
+    """
+    fixtures = retrieve.get_fixtures(body=pages['/fixtures'])
+    results = retrieve.get_results(body=pages['/results'])
+    for num, f in enumerate(fixtures):
+        f.set_odds(*odds[num % len(odds)].odds_info())
+    return fixtures, results
+
+
+def bench_scale(scale, folder, repeat=REPEAT):
+    """ Time each part of an update on the recorded pages repeated scale
+    times, with databases under folder. Returns a dictionary of timings in
+    seconds.
+    """
+    pages = standin.recorded(scale)
+    odds = retrieve.get_odds(body=standin.recorded()['/odds'])
+    matches = list(parser.iter_matches([pages['/fixtures']]))
+    fixtures, results = _fixtures(pages, odds)
+    databases = iter(range(sys.maxsize))
+
+    def database(*writes):
+        path = os.path.join(folder, '{}.sqlite'.format(next(databases)))
+        with store.Writer(path) as w:
+            for write, entries in writes:
+                getattr(w, write)(entries)
+        return path
+
+    def construct():
+        for home, away, date, ko, score in matches:
+            f = Fixture(home, away)
+            f.set_date(date)
+            f.set_time(ko)
+
+    def write(name, entries, *before):
+        def run(path):
+            with store.Writer(path) as w:
+                getattr(w, name)(entries)
+        return _best_of(run, lambda: (database(*before),), repeat)
+
+    timings = {
+        'parser': _best_of(lambda: list(parser.iter_matches(
+            [pages['/fixtures']])), repeat=repeat),
+        'get_odds': _best_of(lambda: retrieve.get_odds(body=pages['/odds']),
+                             repeat=repeat),
+        'fixtures': _best_of(construct, repeat=repeat),
+        'enter_fixtures': write('enter_fixtures', fixtures),
+        'update_odds': write('update_odds', fixtures,
+                             ('enter_fixtures', fixtures)),
+        'update_results': write('update_results', results,
+                                ('enter_fixtures', fixtures))
+        }
+    with standin.StandIn(pages) as server:
+        competitions = [server.competition()]
+        timings['update'] = _best_of(
+            lambda path: main.update(path, competitions=competitions),
+            lambda: (database(),), repeat)
+    return timings
+
+
+def bench_suite(scales=SCALES, repeat=REPEAT):
+    """ Run bench_scale at each scale. Returns the timings, by name and then
+    by scale, with details of the machine they were taken on.
+    """
+    timings = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for scale in scales:
+            for name, seconds in bench_scale(scale, folder, repeat).items():
+                timings.setdefault(name, {})[str(scale)] = seconds
+    return {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'timings': timings
+        }
+
+
+def save(results, path=RESULTS):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare(before, after, tolerance=TOLERANCE):
+    """ Compare two sets of results from bench_suite. Returns a list of
+    (name, scale, before, after) for every timing more than tolerance
+    slower than it was before.
+    """
+    slower = []
+    for name, scales in sorted(after['timings'].items()):
+        for scale, seconds in sorted(scales.items(), key=lambda s: int(s[0])):
+            old = before['timings'].get(name, {}).get(scale)
+            if old is not None and seconds > old * (1 + tolerance):
+                slower.append((name, int(scale), old, seconds))
+    return slower
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--output', default=RESULTS,
+                           help='file to save the timings to, as JSON')
+    arguments.add_argument('--baseline',
+                           help='timings from an earlier run to compare with')
+    arguments.add_argument('--repeat', type=int, default=REPEAT)
+    arguments.add_argument('--scales', type=int, nargs='+', default=SCALES)
+    options = arguments.parse_args()
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+    for name, value in sorted(bench_parser().items()):
+        print('{0:<16} {1:.6f}'.format(name, value))
+    results = bench_suite(options.scales, options.repeat)
+    for name, scales in sorted(results['timings'].items()):
+        print('{0:<16} {1}'.format(name, '  '.join(
+            '{0}x {1:.6f}'.format(scale, scales[str(scale)])
+            for scale in options.scales)))
+    save(results, options.output)
+    if baseline is not None:
+        slower = compare(baseline, results)
+        for name, scale, old, new in slower:
+            print('Slower: {0} at {1}x, {2:.6f} -> {3:.6f}'.format(
+                name, scale, old, new))
+        if slower:
+            sys.exit(1)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3.5
+
+""" cache: an on-disk cache of downloaded pages. Each page is stored with the
+validators sent by the server, so that the next request for it can be
+conditional, and with a hash of its body, so that a page which comes back
+unchanged need not be parsed again.
+"""
+
+# built in modules
+import os
+import os.path
+import json
+import hashlib
+
+# package modules
+from definitions import HTML_SUB_PATH
+
+# CLASSES
+
+
+class PageCache:
+
+    def __init__(self, folder=HTML_SUB_PATH):
+        """ A cache of pages saved under a folder, one body file and one
+        metadata file per URL. New pages are held in memory by check until
+        commit is called, so that a page is only marked as seen once the
+        data read from it has been saved.
+        """
+        self.folder = folder
+        self.pending = {}
+
+    def _path(self, url, extension):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, key + extension)
+
+    def _meta(self, url):
+        try:
+            with open(self._path(url, '.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def headers(self, url):
+        """ Return the headers for a conditional request for a URL.
+        """
+        meta = self._meta(url)
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def load(self, url):
+        """ Return the saved body of a URL, or None if it is not cached.
+        """
+        try:
+            with open(self._path(url, '.html'), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def check(self, url, response):
+        """ Compare a response with the cached page for its URL. Returns True
+        if the page has changed, in which case it is held until commit.
+        """
+        if response.status_code == 304:
+            return False
+        digest = hashlib.sha256(response.content).hexdigest()
+        if digest == self._meta(url).get('hash'):
+            return False
+        meta = {'url': url, 'hash': digest,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')}
+        self.pending[url] = (response.content, meta)
+        return True
+
+    def commit(self):
+        """ Save the pages held by check to disk.
+        """
+        if not self.pending:
+            return
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        for url, (body, meta) in self.pending.items():
+            with open(self._path(url, '.html'), 'wb') as f:
+                f.write(body)
+            with open(self._path(url, '.json'), 'w') as f:
+                json.dump(meta, f)
+        self.pending = {}
+
+    def discard(self, url=None):
+        """ Forget the page held by check for a URL, or every page held, so
+        that it is fetched and parsed again, as for a page which could not
+        be parsed or whose data could not be saved.
+        """
+        if url is None:
+            self.pending = {}
+        else:
+            self.pending.pop(url, None)
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3.5
+
+""" cli: the command line interface, with a subcommand for each task. Each
+subcommand imports only the modules it needs when it runs, so commands
+which only read or copy the database never load the HTTP and HTML
+libraries used for downloading.
+"""
+
+# built in modules
+import sys
+import json
+import argparse
+import datetime
+
+# package modules
+from definitions import DB_SUB_PATH, DB_BACKUP_SUB_PATH, ARCHIVE_SUB_DIR
+
+# CONSTANTS
+UPDATES = {
+    'update-fixtures': 'fixtures',
+    'update-odds': 'odds',
+    'update-results': 'results'
+    }
+
+# FUNCTIONS
+
+
+def _date(text):
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError('Not a date ({})'.format(text))
+
+
+def _month(text):
+    try:
+        return datetime.datetime.strptime(text, '%Y-%m').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError('Not a month ({})'.format(text))
+
+
+def _update(options):
+    """ Download one source for each competition and write it to the
+    database. Odds are matched against the fixtures in the database which
+    have not yet been played.
+    """
+    import main
+    import metrics
+    import competitions
+    from cache import PageCache
+    from journal import Journal
+    from archive import Archive
+    source = UPDATES[options.command]
+    chosen = None
+    if options.competition:
+        chosen = [competitions.get(key) for key in options.competition]
+    known = None
+    if source == 'odds':
+        import query
+        with query.Query(options.database) as q:
+            known = list(q.upcoming(columnar=True))
+    m = metrics.Metrics() if options.metrics else metrics.NULL
+    metrics.use(m)
+    cache = None if options.no_cache else PageCache()
+    archive = None if options.no_archive else Archive()
+    try:
+        summary = main.update(options.database, cache, chosen, [source],
+                              known, Journal(), archive)
+    finally:
+        if archive is not None:
+            archive.close()
+    if options.metrics:
+        m.write(options.metrics)
+    print(json.dumps(summary, sort_keys=True))
+    return 0
+
+
+def _update_bookmakers(options):
+    """ Download the odds of every bookmaker for the fixtures due soon and
+    write them to the database.
+    """
+    import main
+    import metrics
+    import competitions
+    chosen = None
+    if options.competition:
+        chosen = [competitions.get(key) for key in options.competition]
+    m = metrics.Metrics() if options.metrics else metrics.NULL
+    metrics.use(m)
+    days = {} if options.days is None else {'days': options.days}
+    summary = main.update_bookmakers(options.database, chosen, **days)
+    if options.metrics:
+        m.write(options.metrics)
+    print(json.dumps(summary, sort_keys=True))
+    return 0
+
+
+def _export(options):
+    import store
+    n = store.export(options.path, overwrite=options.overwrite,
+                     start=options.start, end=options.end, team=options.team,
+                     columns=options.columns, compress=options.compress,
+                     database=options.database)
+    if options.path != '-':
+        print('Exported {0} fixtures to {1}'.format(n, options.path))
+    return 0
+
+
+def _backup(options):
+    import store
+    keep = {}
+    if options.keep_daily is not None:
+        keep['keep_daily'] = options.keep_daily
+    if options.keep_weekly is not None:
+        keep['keep_weekly'] = options.keep_weekly
+    path = store.backup(options.folder, compress=options.compress,
+                        database=options.database, **keep)
+    print('Backed up to {}'.format(path))
+    return 0
+
+
+def _query(options):
+    """ Write the fixtures found as CSV to standard output.
+    """
+    import csv
+    import store
+    import query
+    with query.Query(options.database) as q:
+        if options.team is not None:
+            rows = q.by_team(options.team)
+        elif options.result is not None:
+            rows = q.by_result(options.result)
+        elif options.unsettled:
+            rows = q.unsettled()
+        elif options.start is not None:
+            rows = q.by_dates(options.start, options.end)
+        else:
+            rows = q.upcoming()
+    writer = csv.writer(sys.stdout)
+    writer.writerow([store.HEADINGS[name] for name in store.COLUMNS])
+    writer.writerows(row[:len(store.COLUMNS)] for row in rows)
+    return 0
+
+
+def _reparse(options):
+    """ Parse the archived pages again and load them into the database.
+    """
+    import archive
+    sources = options.source or archive.SOURCES
+    with archive.Archive(options.archive) as pages:
+        totals = archive.reparse(pages, options.database, sources,
+                                 options.since, options.until,
+                                 options.processes)
+    print(json.dumps(totals, sort_keys=True))
+    return 0
+
+
+def _backfill(options):
+    """ Load past months of fixtures and results into the database.
+    """
+    import backfill
+    import competitions
+    from archive import Archive
+    chosen = None
+    if options.competition:
+        chosen = [competitions.get(key) for key in options.competition]
+    limits = {}
+    if options.rate is not None:
+        limits['rate'] = options.rate
+    if options.batch is not None:
+        limits['batch'] = options.batch
+    archive = None if options.no_archive else Archive()
+    try:
+        totals = backfill.backfill(options.start, options.end, chosen,
+                                   options.database,
+                                   processes=options.processes,
+                                   archive=archive, **limits)
+    finally:
+        if archive is not None:
+            archive.close()
+    print(json.dumps(totals, sort_keys=True))
+    return 0
+
+
+def arguments():
+    """ Build the parser for the command line.
+    """
+    parser = argparse.ArgumentParser(prog='oddscollector',
+                                     description=__doc__)
+    parser.add_argument('--database', default=DB_SUB_PATH,
+                        help='path to the database')
+    parser.add_argument('--verbose', action='store_true',
+                        help='log progress as well as problems')
+    parser.add_argument('--structured', action='store_true',
+                        help='log as lines of JSON')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    for command, source in sorted(UPDATES.items()):
+        p = commands.add_parser(command, help='download and save the '
+                                '{} of each competition'.format(source))
+        p.add_argument('--competition', action='append', metavar='KEY',
+                       help='a competition to update, by its key; may be '
+                       'repeated (default: all)')
+        p.add_argument('--no-cache', action='store_true',
+                       help='download and parse pages even if unchanged')
+        p.add_argument('--no-archive', action='store_true',
+                       help='do not keep the pages downloaded')
+        p.add_argument('--metrics', metavar='PATH',
+                       help='save the metrics of the run, as Prometheus text '
+                       'or, for a .jsonl path, a line of JSON')
+        p.set_defaults(run=_update)
+
+    p = commands.add_parser('update-bookmakers', help='download and save the '
+                            'odds of every bookmaker for the fixtures due '
+                            'soon')
+    p.add_argument('--competition', action='append', metavar='KEY',
+                   help='a competition to update, by its key; may be '
+                   'repeated (default: all)')
+    p.add_argument('--days', type=int,
+                   help='days ahead of the fixtures to update (default: 6)')
+    p.add_argument('--metrics', metavar='PATH',
+                   help='save the metrics of the run, as for the updates')
+    p.set_defaults(run=_update_bookmakers)
+
+    p = commands.add_parser('export', help='save the odds table as CSV')
+    p.add_argument('path', help="file to write, or '-' for standard output")
+    p.add_argument('--overwrite', action='store_true')
+    p.add_argument('--compress', action='store_true',
+                   help='compress with gzip')
+    p.add_argument('--start', type=_date, help='first date, as YYYY-MM-DD')
+    p.add_argument('--end', type=_date, help='last date, as YYYY-MM-DD')
+    p.add_argument('--team', help='only fixtures involving a team')
+    p.add_argument('--columns', nargs='+', metavar='COLUMN',
+                   help='columns of the odds table to export')
+    p.set_defaults(run=_export)
+
+    p = commands.add_parser('backup', help='copy the database to a folder')
+    p.add_argument('--folder', default=DB_BACKUP_SUB_PATH)
+    p.add_argument('--compress', action='store_true',
+                   help='compress with gzip')
+    p.add_argument('--keep-daily', type=int,
+                   help='days for which one backup is kept (default: 7)')
+    p.add_argument('--keep-weekly', type=int,
+                   help='weeks for which one backup is kept (default: 8)')
+    p.set_defaults(run=_backup)
+
+    p = commands.add_parser('query', help='find fixtures and write them as '
+                            'CSV (default: those not yet played)')
+    found = p.add_mutually_exclusive_group()
+    found.add_argument('--team', help='fixtures involving a team')
+    found.add_argument('--result', choices='HDA',
+                       help='fixtures with a result')
+    found.add_argument('--unsettled', action='store_true',
+                       help='past fixtures without a result')
+    found.add_argument('--start', type=_date,
+                       help='fixtures from a date, as YYYY-MM-DD')
+    p.add_argument('--end', type=_date,
+                   help='with --start, fixtures up to a date')
+    p.set_defaults(run=_query)
+
+    p = commands.add_parser('reparse', help='parse the archived pages again '
+                            'and load them into the database')
+    p.add_argument('--archive', default=ARCHIVE_SUB_DIR,
+                   help='folder of the archive')
+    p.add_argument('--source', action='append',
+                   choices=('fixtures', 'odds', 'results'),
+                   help='a source to parse; may be repeated (default: all)')
+    p.add_argument('--since', help='pages fetched from a time, as '
+                   'YYYY-MM-DD or YYYY-MM-DD HH:MM:SS')
+    p.add_argument('--until', help='pages fetched up to a time')
+    p.add_argument('--processes', type=int,
+                   help='worker processes (default: one per CPU)')
+    p.set_defaults(run=_reparse)
+
+    p = commands.add_parser('backfill', help='load the fixtures and results '
+                            'of past months into the database')
+    p.add_argument('start', type=_month, help='first month, as YYYY-MM')
+    p.add_argument('end', type=_month, help='last month, as YYYY-MM')
+    p.add_argument('--competition', action='append', metavar='KEY',
+                   help='a competition to load, by its key; may be '
+                   'repeated (default: all)')
+    p.add_argument('--rate', type=float,
+                   help='pages requested a second (default: 2)')
+    p.add_argument('--processes', type=int,
+                   help='worker processes (default: one per CPU)')
+    p.add_argument('--batch', type=int,
+                   help='months loaded in each transaction (default: 12)')
+    p.add_argument('--no-archive', action='store_true',
+                   help='do not keep the pages downloaded')
+    p.set_defaults(run=_backfill)
+    return parser
+
+
+def run(argv=None):
+    """ Run the command given on the command line, or in argv, and return
+    its exit status.
+    """
+    options = arguments().parse_args(argv)
+    if options.verbose or options.structured:
+        import logging
+        import metrics
+        metrics.setup_logging(logging.INFO if options.verbose else
+                              logging.WARNING, options.structured)
+    return options.run(options)
+
+if __name__ == '__main__':
+    sys.exit(run())
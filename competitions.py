@@ -0,0 +1,150 @@
+#!/usr/bin/env python3.5
+
+""" competitions: the competitions collected, each with its teams, the other
+names its teams go by, the season and the pages its fixtures, odds and
+results come from. Every name of every team is indexed once, at import, so
+that checking a team is a single lookup.
+"""
+
+# CONSTANTS
+BBC = 'http://www.bbc.co.uk/sport/football/{}/{}'
+MONTH = '{0}/{1:04d}-{2:02d}' # a page of fixtures or results for one month
+ODDSCHECKER = 'http://www.oddschecker.com/football/{}'
+MATCH = '{0}/{1}-v-{2}/winner' # every bookmaker's odds for a match
+
+# CLASSES
+
+
+class Competition:
+
+    def __init__(self, key, name, season, teams, aliases=None, bbc=None,
+                 oddschecker=None):
+        """ A competition for one season. teams maps the name of each team,
+        in lower case, to a three letter code; aliases maps other names, in
+        lower case, to those names. bbc and oddschecker are the parts of the
+        addresses of the competition's pages on each website.
+        """
+        self.key = key
+        self.name = name
+        self.season = season
+        self.teams = teams
+        self.aliases = aliases or {}
+        bbc = bbc or key
+        self.fixtures_url = BBC.format(bbc, 'fixtures')
+        self.results_url = BBC.format(bbc, 'results')
+        self.odds_url = ODDSCHECKER.format(oddschecker or 'english/' + key)
+        # every name of each team, in lower case, to its code
+        self.index = dict(teams)
+        for alias, team in self.aliases.items():
+            self.index[alias] = teams[team]
+
+    def urls(self):
+        """ Return the address of each source, by the name of the source.
+        """
+        return {'fixtures': self.fixtures_url, 'odds': self.odds_url,
+                'results': self.results_url}
+
+    def month_url(self, source, year, month):
+        """ Return the address of the fixtures or results of one month.
+        """
+        url = self.fixtures_url if source == 'fixtures' else self.results_url
+        return MONTH.format(url, year, month)
+
+    def match_url(self, home, away):
+        """ Return the address of the odds of every bookmaker for a match.
+        """
+        slug = lambda team: team.lower().replace(' ', '-')
+        return MATCH.format(self.odds_url, slug(home), slug(away))
+
+    def __contains__(self, team):
+        return team.lower() in self.index
+
+    def __repr__(self):
+        return '<class Competition: {0} {1}>'.format(self.name, self.season)
+
+# COMPETITIONS
+
+PREMIER_LEAGUE = Competition(
+    'premier-league', 'Premier League', 2016,
+    teams={
+        'arsenal': 'ARS', 'bournemouth': 'BOU', 'burnley': 'BUR',
+        'chelsea': 'CHE', 'crystal palace': 'CRY', 'everton': 'EVE',
+        'hull': 'HUL', 'leicester': 'LEI', 'liverpool': 'LIV',
+        'man city': 'MCI', 'man utd': 'MUN', 'middlesbrough': 'MID',
+        'southampton': 'SOU', 'stoke': 'STK', 'sunderland': 'SUN',
+        'swansea': 'SWA', 'tottenham': 'TOT', 'watford': 'WAT',
+        'west brom': 'WBA', 'west ham': 'WHU'
+        },
+    aliases={
+        'afc bournemouth': 'bournemouth', 'hull city': 'hull',
+        'leicester city': 'leicester', 'manchester city': 'man city',
+        'manchester united': 'man utd', 'man united': 'man utd',
+        'stoke city': 'stoke', 'swansea city': 'swansea',
+        'tottenham hotspur': 'tottenham', 'spurs': 'tottenham',
+        'west bromwich albion': 'west brom', 'west ham united': 'west ham'
+        })
+
+CHAMPIONSHIP = Competition(
+    'championship', 'Championship', 2016,
+    teams={
+        'aston villa': 'AVL', 'barnsley': 'BAR', 'birmingham': 'BIR',
+        'blackburn': 'BLB', 'brentford': 'BRE', 'brighton': 'BHA',
+        'bristol city': 'BRC', 'burton': 'BRT', 'cardiff': 'CAR',
+        'derby': 'DER', 'fulham': 'FUL', 'huddersfield': 'HUD',
+        'ipswich': 'IPS', 'leeds': 'LEE', 'newcastle': 'NEW',
+        'norwich': 'NOR', 'nottm forest': 'NFO', 'preston': 'PRE',
+        'qpr': 'QPR', 'reading': 'REA', 'rotherham': 'ROT',
+        'sheff wed': 'SHW', 'wigan': 'WIG', 'wolves': 'WOL'
+        },
+    aliases={
+        'birmingham city': 'birmingham', 'blackburn rovers': 'blackburn',
+        'brighton & hove albion': 'brighton',
+        'brighton and hove albion': 'brighton', 'burton albion': 'burton',
+        'cardiff city': 'cardiff', 'derby county': 'derby',
+        'huddersfield town': 'huddersfield', 'ipswich town': 'ipswich',
+        'leeds united': 'leeds', 'newcastle united': 'newcastle',
+        'norwich city': 'norwich', 'nottingham forest': 'nottm forest',
+        "nott'm forest": 'nottm forest', 'preston north end': 'preston',
+        'queens park rangers': 'qpr', 'rotherham united': 'rotherham',
+        'sheffield wednesday': 'sheff wed', 'sheffield weds': 'sheff wed',
+        'wigan athletic': 'wigan', 'wolverhampton wanderers': 'wolves',
+        'wolverhampton': 'wolves'
+        })
+
+REGISTRY = {c.key: c for c in (PREMIER_LEAGUE, CHAMPIONSHIP)}
+
+# FUNCTIONS
+
+
+def _index(registry):
+    """ Join the names of the teams of every competition into one index,
+    checking that no name stands for two different teams.
+    """
+    index = {}
+    for competition in registry.values():
+        for name, code in competition.index.items():
+            if index.setdefault(name, code) != code:
+                error = 'Team name ({0}) is used for {1} and {2}'.format(
+                    name, index[name], code)
+                raise ValueError(error)
+    return index
+
+# every name of every team, in lower case, to its code
+TEAMS = _index(REGISTRY)
+
+
+def team_code(team):
+    """ Return the code of a team from any of its names, or None if the team
+    is in no competition.
+    """
+    return TEAMS.get(team.lower())
+
+
+def get(key):
+    """ Return the competition registered under key. Raises KeyError,
+    naming the keys registered, if there is none.
+    """
+    if key not in REGISTRY:
+        raise KeyError('Unknown competition ({0}). Choose from: {1}'.format(
+            key, ', '.join(sorted(REGISTRY))))
+    return REGISTRY[key]
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3.5
+
+""" convert: conversion of many fractional odds at once, such as all of the
+odds on an Oddschecker page or a grid of prices from several bookmakers.
+"""
+
+# third-party modules
+import numpy as np
+
+# package modules
+from fixture import fraction_value, _ODDS_DP
+
+# FUNCTIONS
+
+
+def odds_array(odds, columns=None, dp=_ODDS_DP):
+    """ Convert a list, or a grid of lists, of fractional odds as text into
+    an array of decimals. Each distinct fraction is only converted once.
+    Returns (values, mask): cells which could not be read are NaN in values
+    and False in mask. If columns is given, a list is reshaped into rows of
+    that many cells, such as 3 for home, draw and away.
+    """
+    cells = np.asarray(odds, dtype=str)
+    if cells.size == 0:
+        values = np.empty(cells.shape, dtype=np.float64)
+    else:
+        distinct, inverse = np.unique(cells, return_inverse=True)
+        converted = np.array([fraction_value(str(c), dp) for c in distinct],
+                             dtype=np.float64)
+        values = converted[inverse].reshape(cells.shape)
+    if columns is not None:
+        values = values.reshape(-1, columns)
+    return values, ~np.isnan(values)
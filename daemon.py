@@ -0,0 +1,198 @@
+#!/usr/bin/env python3.5
+
+""" daemon: keep the collector running, with the session and database
+connections held open between runs, and poll each source only as often as
+the kick-off times in the database call for.
+"""
+
+# built in modules
+import time
+import datetime
+
+# package modules
+import main
+import store
+import query
+import metrics
+from cache import PageCache
+from archive import Archive
+from fixture import NO_SCORE
+from definitions import DB_SUB_PATH, METRICS_SUB_PATH
+
+# CONSTANTS
+HOUR = datetime.timedelta(hours=1)
+MINUTE = datetime.timedelta(minutes=1)
+FIXTURES_INTERVAL = 24*HOUR
+# how often to poll odds, by time until the next kick-off
+ODDS_INTERVALS = (
+    (HOUR, 5*MINUTE),
+    (6*HOUR, 15*MINUTE),
+    (24*HOUR, HOUR),
+    (72*HOUR, 3*HOUR)
+    )
+ODDS_IDLE = 12*HOUR # when no kick-off is within the last band
+FULL_TIME = 2*HOUR # after kick-off, when a result is first expected
+RESULTS_WINDOW = 6*HOUR # after full time, to keep trying for a result
+RESULTS_RETRY = 15*MINUTE
+RESULTS_IDLE = 24*HOUR
+
+# CLASSES
+
+
+class Schedule:
+
+    def __init__(self, kickoffs=()):
+        """ Work out when each source is next due from the kick-off times of
+        fixtures without results, and the time each source was last polled,
+        in last. Odds are polled more often as a kick-off approaches, and
+        results from full time until they arrive. Every method takes the
+        current time, so the schedule runs on any clock.
+        """
+        self.kickoffs = sorted(kickoffs)
+        self.last = {'fixtures': None, 'odds': None, 'results': None}
+
+    def odds_interval(self, now):
+        ahead = [k for k in self.kickoffs if k > now]
+        if ahead:
+            for within, interval in ODDS_INTERVALS:
+                if ahead[0] - now <= within:
+                    return interval
+        return ODDS_IDLE
+
+    def next_fixtures(self, now):
+        last = self.last['fixtures']
+        return now if last is None else last + FIXTURES_INTERVAL
+
+    def next_odds(self, now):
+        last = self.last['odds']
+        if last is None:
+            return now
+        due = last + self.odds_interval(now)
+        ahead = [k for k in self.kickoffs if k > now]
+        if ahead: # poll again as soon as the next kick-off enters a band
+            for within, interval in ODDS_INTERVALS:
+                boundary = ahead[0] - within
+                if now < boundary < due:
+                    due = boundary
+        return due
+
+    def next_results(self, now):
+        last = self.last['results']
+        if last is None:
+            return now
+        due = last + RESULTS_IDLE
+        for kickoff in self.kickoffs:
+            start = kickoff + FULL_TIME
+            if start > last: # not polled since full time
+                due = min(due, start)
+            elif start + RESULTS_WINDOW > now: # polled, but no result yet
+                due = min(due, last + RESULTS_RETRY)
+        return due
+
+    def due(self, now):
+        """ Return the sources due to be polled at a time.
+        """
+        times = {'fixtures': self.next_fixtures(now),
+                 'odds': self.next_odds(now),
+                 'results': self.next_results(now)}
+        return [source for source, due in sorted(times.items())
+                if due <= now]
+
+    def next_wake(self, now):
+        """ Return the time at which the next source is due.
+        """
+        return min(self.next_fixtures(now), self.next_odds(now),
+                   self.next_results(now))
+
+    def polled(self, sources, now):
+        for source in sources:
+            self.last[source] = now
+
+
+class Daemon:
+
+    def __init__(self, path=DB_SUB_PATH, cache=None,
+                 clock=datetime.datetime.now, sleep=time.sleep,
+                 metrics_path=None, archive=None):
+        """ Run updates as the schedule calls for them, keeping one Writer
+        and one Query open throughout. The clock and sleep functions can be
+        replaced, for running on a simulated clock. If metrics_path is
+        given, the metrics of each run are saved there, and if an Archive is
+        given, every page downloaded is kept in it.
+        """
+        self.path = path
+        self.archive = archive
+        self.metrics_path = metrics_path
+        self.cache = cache
+        self.clock = clock
+        self.sleep = sleep
+        self.writer = store.Writer(path)
+        self.query = query.Query(path)
+        self.schedule = Schedule()
+
+    def unsettled(self, now):
+        """ Return the fixtures without results, from yesterday onwards.
+        """
+        return self.query.upcoming(now.date() - datetime.timedelta(days=1),
+                                   columnar=True)
+
+    def kickoffs(self, batch):
+        """ Return the kick-off times of a FixtureBatch, where known.
+        """
+        return [datetime.datetime.fromordinal(date) + minutes*MINUTE
+                for date, minutes in zip(batch.dates, batch.times)
+                if date != NO_SCORE and minutes != NO_SCORE]
+
+    def step(self):
+        """ Poll every source which is due, and return the time at which to
+        wake for the next.
+        """
+        now = self.clock()
+        known = self.unsettled(now)
+        self.schedule.kickoffs = sorted(self.kickoffs(known))
+        due = self.schedule.due(now)
+        if due:
+            m = metrics.Metrics() if self.metrics_path else metrics.NULL
+            previous = metrics.use(m)
+            try:
+                fixtures, odds, results = main.fetch(
+                    self.cache, due, list(known), archive=self.archive)
+                failed = main.write(self.writer, fixtures, odds, results)
+                with m.stage('store'):
+                    m.summary(self.writer.commit())
+                main.settle(self.path, self.cache, failed)
+            finally:
+                metrics.use(previous)
+            if self.metrics_path:
+                m.write(self.metrics_path)
+            self.schedule.polled(due, now)
+            self.schedule.kickoffs = sorted(self.kickoffs(
+                self.unsettled(now)))
+        return self.schedule.next_wake(now)
+
+    def run(self, steps=None):
+        """ Poll and sleep until interrupted, or for a number of steps.
+        """
+        count = 0
+        while steps is None or count < steps:
+            wake = self.step()
+            pause = (wake - self.clock()).total_seconds()
+            if pause > 0:
+                self.sleep(pause)
+            count += 1
+
+    def close(self):
+        self.writer.close()
+        self.query.close()
+
+if __name__ == '__main__':
+    metrics.setup_logging()
+    daemon = Daemon(cache=PageCache(), metrics_path=METRICS_SUB_PATH,
+                    archive=Archive())
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+        daemon.archive.close()
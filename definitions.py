@@ -4,6 +4,9 @@
 teams, month names and paths to sub-directories and folders.
 """
 
+# package modules
+from competitions import PREMIER_LEAGUE
+
 # file path towards directory for saving HTML
 HTML_SUB_PATH = './html'
 
@@ -11,17 +14,15 @@ HTML_SUB_PATH = './html'
 DB_SUB_DIR = './data'
 DB_SUB_PATH = DB_SUB_DIR + '/odds.sqlite'
 DB_BACKUP_SUB_PATH = './data/backup/'
+ARRAYS_SUB_DIR = './data/arrays'
+JOURNAL_SUB_DIR = './data/journal'
+ARCHIVE_SUB_DIR = './data/archive'
+
+# metrics from the last update, as a Prometheus text file
+METRICS_SUB_PATH = './data/metrics.prom'
 
-# names of Premier League teams
-PL = {
-    'arsenal': 'ARS', 'bournemouth': 'BOU', 'burnley': 'BUR',
-    'chelsea': 'CHE', 'crystal palace': 'CRY', 'everton': 'EVE',
-    'hull': 'HUL', 'leicester': 'LEI', 'liverpool': 'LIV',
-    'man city': 'MCI', 'man utd': 'MUN', 'middlesbrough': 'MID',
-    'southampton': 'SOU', 'stoke': 'STK', 'sunderland': 'SUN',
-    'swansea': 'SWA', 'tottenham': 'TOT', 'watford': 'WAT',
-    'west brom': 'WBA', 'west ham': 'WHU'
-    }
+# names of Premier League teams; see competitions for the others
+PL = PREMIER_LEAGUE.teams
 
 RESULTS = tuple(PL.keys()) + ('draw',)
 
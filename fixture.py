@@ -4,32 +4,43 @@
 """
 
 # built-in modules
-import requests
 import datetime
+from array import array
+from functools import lru_cache
 
 # package modules
-from definitions import PL, MONTHS
+from competitions import TEAMS
+from definitions import MONTHS
 
 # CONSTANTS
 _ODDS_DP = 5
+MISSING = None # value of any detail not yet set on a Fixture
+NAN = float('nan') # missing odds in a FixtureBatch
+NO_SCORE = -1 # missing scores, dates and times in a FixtureBatch
+EVENS = ('EVS', 'EVENS') # written instead of 1/1
+FRACTIONS = 2048 # distinct fractions remembered by fraction_value
 
 # CLASSES
 
 
 class Fixture:
 
+    __slots__ = ('home', 'away', 'uid', 'stamp', 'date', 'time', 'home_odds',
+                 'draw_odds', 'away_odds', 'home_score', 'away_score',
+                 'result')
+
     def __init__(self, home, away):
         """ A class to validate and store information about a fixture. Only
         requires the home and away teams; the date, odds and result are all
-        handled in other functions.
+        handled in other functions, and are MISSING until they are set.
         """
-        # check teams in Premier League
-        if home.lower() in PL:
+        # check teams are in a competition, under any of their names
+        if home.lower() in TEAMS:
             self.home = home
         else:
             error = 'Home team ({}) not recognised'.format(home)
             raise ValueError(error)
-        if away.lower() in PL:
+        if away.lower() in TEAMS:
             self.away = away
         else:
             error = 'Away team ({}) not recognised'.format(away)
@@ -38,16 +49,21 @@ class Fixture:
         self.uid = Fixture.create_uid(home, away)
         # time stamp
         self.stamp = str(datetime.date.today())
+        self.date = self.time = MISSING
+        self.home_odds = self.draw_odds = self.away_odds = MISSING
+        self.home_score = self.away_score = self.result = MISSING
 
     # methods for adding new data
 
     def set_odds(self, home, draw, away):
         """ Convert string-based fractional odds to decimals and store as
-        attributes. Assumes odds come from Oddschecker.
+        attributes. Assumes odds come from Oddschecker. Odds which are
+        already floats, such as a row from convert.odds_array, are stored as
+        they are, with NaN as MISSING.
         """
-        self.home_odds = self._frac_to_dec(home)
-        self.draw_odds = self._frac_to_dec(draw)
-        self.away_odds = self._frac_to_dec(away)
+        self.home_odds = self._odds(home)
+        self.draw_odds = self._odds(draw)
+        self.away_odds = self._odds(away)
         return self
 
     def set_date(self, date):
@@ -85,50 +101,64 @@ class Fixture:
     def odds_info(self):
         """ Odds information for database.
         """
-        try:
-            return (self.home_odds, self.draw_odds, self.away_odds)
-        except AttributeError:
-            raise
+        return (self.home_odds, self.draw_odds, self.away_odds)
 
     def time_info(self):
-        try:
-            return (str(self.date), str(self.time))
-        except AttributeError:
-            raise
+        date = str(self.date) if self.date is not MISSING else MISSING
+        time = str(self.time) if self.time is not MISSING else MISSING
+        return (date, time)
 
     def result_info(self):
         """ Score information for database.
         """
-        try:
-            return (self.home_score, self.away_score, self.result)
-        except AttributeError:
-            raise
+        return (self.home_score, self.away_score, self.result)
 
-    # other methods
+    # methods for checking which details have been set
+
+    def has_date(self):
+        return self.date is not MISSING
+
+    def has_odds(self):
+        return MISSING not in self.odds_info()
+
+    def has_result(self):
+        return self.result is not MISSING
+
+    # other methods
     def __repr__(self):
         return '<class Fixture: {0} vs. {1}>'.format(self.home, self.away)
 
     @classmethod
     def create_uid(cls, home, away, year=None):
-        """ Combine two team names into an identifier.
+        """ Combine two team names into an identifier, from the codes of
+        the teams, so every name of a team gives the same identifier.
         """
         sep = '-'
-        f = lambda team: team.lower()
-        uid = PL[f(home)] + sep + PL[f(away)]
+        uid = TEAMS[home.lower()] + sep + TEAMS[away.lower()]
         if year:
             uid += sep + str(year)
         return uid
 
+    @classmethod
+    def _odds(cls, odds):
+        if isinstance(odds, float):
+            return MISSING if _isnan(odds) else float(odds)
+        return cls._frac_to_dec(odds)
+
     @staticmethod
     def _frac_to_dec(fraction, dp=_ODDS_DP):
         """ Convert a string representation of a fraction into a float. Expects
-        fraction in the form 'n/d'.
+        fraction in the form 'n/d', or 'EVS' for evens.
         """
         try:
             fraction = str(fraction)
         except ValueError:
             print('Could not convert {} to string'.format(fraction))
             raise
+        value = fraction_value(fraction, dp)
+        if not _isnan(value):
+            return value
+        # otherwise find the fault, and report it
         fraction = fraction.strip()
         for item in ['(', ')']:
             fraction = fraction.strip(item)
@@ -220,3 +250,198 @@ class Fixture:
             print('Could not convert away ({}) score to int'.format(away))
             raise
         return (home, away)
+
+
+class FixtureBatch:
+
+    __slots__ = ('teams', 'team_index', 'uids', 'stamps', 'home', 'away',
+                 'dates', 'times', 'home_odds', 'draw_odds', 'away_odds',
+                 'home_score', 'away_score')
+
+    def __init__(self):
+        """ A column for each detail of many fixtures, for handling a whole
+        scrape at once. Team names are stored once, in teams, and referred to
+        by their index; dates are ordinals and times are minutes past
+        midnight. Missing odds are NAN, and missing scores, dates and times
+        are NO_SCORE.
+        """
+        self.teams = []
+        self.team_index = {}
+        self.uids = []
+        self.stamps = array('i')
+        self.home = array('h')
+        self.away = array('h')
+        self.dates = array('i')
+        self.times = array('h')
+        self.home_odds = array('d')
+        self.draw_odds = array('d')
+        self.away_odds = array('d')
+        self.home_score = array('h')
+        self.away_score = array('h')
+
+    def __len__(self):
+        return len(self.uids)
+
+    def __iter__(self):
+        for i in range(len(self.uids)):
+            yield self.fixture(i)
+
+    def _team(self, name):
+        try:
+            return self.team_index[name]
+        except KeyError:
+            self.team_index[name] = len(self.teams)
+            self.teams.append(name)
+            return self.team_index[name]
+
+    def append(self, f):
+        """ Add the details of a Fixture to the end of each column.
+        """
+        self._append(f.uid, f.home, f.away, f.stamp, f.date, f.time,
+                     *(f.odds_info() + f.result_info()[:2]))
+        return self
+
+    def _append(self, uid, home, away, stamp, date, time, home_odds,
+                draw_odds, away_odds, home_score, away_score):
+        self.uids.append(uid)
+        self.stamps.append(_ordinal(stamp))
+        self.home.append(self._team(home))
+        self.away.append(self._team(away))
+        self.dates.append(_ordinal(date))
+        self.times.append(_minutes(time))
+        self.home_odds.append(NAN if home_odds is MISSING else home_odds)
+        self.draw_odds.append(NAN if draw_odds is MISSING else draw_odds)
+        self.away_odds.append(NAN if away_odds is MISSING else away_odds)
+        self.home_score.append(NO_SCORE if home_score is MISSING
+                               else int(home_score))
+        self.away_score.append(NO_SCORE if away_score is MISSING
+                               else int(away_score))
+
+    def extend(self, fixtures):
+        for f in fixtures:
+            self.append(f)
+        return self
+
+    @classmethod
+    def from_fixtures(cls, fixtures):
+        """ Create a batch from an iterable of Fixtures, or return it as it
+        is if it is already a batch.
+        """
+        if isinstance(fixtures, cls):
+            return fixtures
+        return cls().extend(fixtures)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """ Create a batch from rows of the odds table, in the order of its
+        columns.
+        """
+        batch = cls()
+        for row in rows:
+            batch._append(*row[1:12])
+        return batch
+
+    def fixture(self, i):
+        """ Return the fixture at position i as a Fixture.
+        """
+        f = Fixture(self.teams[self.home[i]], self.teams[self.away[i]])
+        f.uid = self.uids[i]
+        f.stamp = str(datetime.date.fromordinal(self.stamps[i]))
+        if self.dates[i] != NO_SCORE:
+            f.date = datetime.date.fromordinal(self.dates[i])
+        if self.times[i] != NO_SCORE:
+            f.time = datetime.time(*divmod(self.times[i], 60))
+        if not _isnan(self.home_odds[i]):
+            f.home_odds = self.home_odds[i]
+            f.draw_odds = self.draw_odds[i]
+            f.away_odds = self.away_odds[i]
+        if self.home_score[i] != NO_SCORE:
+            f.set_result('{0}-{1}'.format(self.home_score[i],
+                                          self.away_score[i]))
+        return f
+
+    # methods for returning rows for the database
+
+    def basic_rows(self):
+        """ Rows of basic and time information, for fixtures with a date.
+        """
+        return [(self.uids[i], self.teams[self.home[i]],
+                 self.teams[self.away[i]],
+                 str(datetime.date.fromordinal(self.stamps[i])),
+                 str(datetime.date.fromordinal(self.dates[i])),
+                 _time_text(self.times[i]))
+                for i in range(len(self)) if self.dates[i] != NO_SCORE]
+
+    def odds_rows(self):
+        """ Rows of (home, draw, away, uid), for fixtures with odds.
+        """
+        return [(h, d, a, uid) for h, d, a, uid in
+                zip(self.home_odds, self.draw_odds, self.away_odds,
+                    self.uids)
+                if not (_isnan(h) or _isnan(d) or _isnan(a))]
+
+    def result_rows(self):
+        """ Rows of (home score, away score, result, uid), for fixtures with
+        a result.
+        """
+        return [(h, a, _result(h, a), uid) for h, a, uid in
+                zip(self.home_score, self.away_score, self.uids)
+                if h != NO_SCORE and a != NO_SCORE]
+
+# FUNCTIONS
+
+
+@lru_cache(maxsize=FRACTIONS)
+def fraction_value(fraction, dp=_ODDS_DP):
+    """ Return the value of fractional odds given as text, such as '5/2' or
+    'EVS', or NAN if they cannot be read. Results are remembered, since the
+    same few hundred fractions are seen over and over.
+    """
+    fraction = fraction.strip()
+    for item in ['(', ')']:
+        fraction = fraction.strip(item)
+    if fraction.upper() in EVENS:
+        return 1.0
+    try:
+        n, d = fraction.split('/')
+        return round(int(n)/int(d), dp)
+    except (ValueError, ZeroDivisionError):
+        return NAN
+
+
+def _isnan(value):
+    return value != value
+
+
+def _ordinal(date):
+    """ Convert a date, or its text in the form 'YYYY-MM-DD', to an ordinal.
+    """
+    if date is MISSING:
+        return NO_SCORE
+    if isinstance(date, str):
+        date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+    return date.toordinal()
+
+
+def _minutes(time):
+    """ Convert a time, or its text in the form 'HH:MM:SS', to minutes past
+    midnight.
+    """
+    if time is MISSING or time == 'None':
+        return NO_SCORE
+    if isinstance(time, str):
+        hour, minute = time.split(':')[:2]
+        return int(hour)*60 + int(minute)
+    return time.hour*60 + time.minute
+
+
+def _time_text(minutes):
+    if minutes == NO_SCORE:
+        return MISSING
+    return str(datetime.time(*divmod(minutes, 60)))
+
+
+def _result(home, away):
+    if home == away:
+        return 'D'
+    return 'H' if home > away else 'A'
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3.5
+
+""" journal: what an update has parsed, kept on disk until it has been
+written to the database, so that a write which fails can be retried by a
+later run without downloading and parsing the pages again.
+"""
+
+# built in modules
+import os
+import os.path
+import json
+import time
+import pickle
+import logging
+
+# package modules
+from definitions import JOURNAL_SUB_DIR
+
+# CONSTANTS
+MANIFEST = 'journal.json'
+ATTEMPTS = 3 # tries at a stage before giving up on this run
+BACKOFF = 2.0 # seconds before the first retry, doubling after each
+MAX_RESUMES = 3 # runs which may retry a journal before it is dropped
+
+log = logging.getLogger(__name__)
+
+# CLASSES
+
+
+class Journal:
+
+    def __init__(self, folder=JOURNAL_SUB_DIR):
+        """ Keep what one update parsed under folder, as a pickle by name,
+        with a manifest of the number of runs which have resumed from it.
+        """
+        self.folder = folder
+
+    def _path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _write(self, name, data):
+        """ Replace a file in one step, so a crash never leaves half of it.
+        """
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        part = self._path(name + '.part')
+        with open(part, 'wb') as f:
+            f.write(data)
+        os.replace(part, self._path(name))
+
+    def save(self, name, value):
+        self._write(name + '.pickle',
+                    pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def load(self, name):
+        """ Return the value saved under name, or None.
+        """
+        try:
+            with open(self._path(name + '.pickle'), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def manifest(self):
+        try:
+            with open(self._path(MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'resumes': 0}
+
+    def _save_manifest(self, manifest):
+        self._write(MANIFEST, json.dumps(manifest).encode('utf-8'))
+
+    def pending(self):
+        """ Return True if an earlier update left output behind.
+        """
+        return os.path.isdir(self.folder) and any(
+            name.endswith('.pickle') for name in os.listdir(self.folder))
+
+    def resumed(self):
+        """ Count a run resuming from the journal, and return the number of
+        runs which have.
+        """
+        manifest = self.manifest()
+        manifest['resumes'] += 1
+        self._save_manifest(manifest)
+        return manifest['resumes']
+
+    def clear(self):
+        """ Remove everything in the journal, once it has been committed.
+        """
+        if not os.path.isdir(self.folder):
+            return
+        for name in os.listdir(self.folder):
+            if name == MANIFEST or name.endswith(('.pickle', '.part')):
+                os.remove(self._path(name))
+
+# FUNCTIONS
+
+
+def retry(function, name, errors=(Exception,), attempts=None, backoff=None,
+          sleep=time.sleep):
+    """ Call function until it returns, up to attempts times, waiting
+    backoff seconds after the first failure and twice as long after each
+    one after that. Only errors are retried; the last is raised.
+    """
+    attempts = ATTEMPTS if attempts is None else attempts
+    backoff = BACKOFF if backoff is None else backoff
+    for attempt in range(attempts):
+        try:
+            return function()
+        except errors as e:
+            if attempt == attempts - 1:
+                raise
+            delay = backoff * 2**attempt
+            log.warning('Could not %s, retrying in %.1fs. Error: %s', name,
+                        delay, e, extra={'stage': name, 'attempt': attempt})
+            sleep(delay)
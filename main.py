@@ -4,31 +4,338 @@
 results. Designed to retrieve data from the BBC and Oddschecker.
 """
 
+# built in modules
+import time
+import sqlite3
+import logging
+import datetime
+
+# package modules
 import retrieve
 import store
+import query
+import journal
+import metrics
+import analytics
+from cache import PageCache
+from journal import Journal
+from archive import Archive
+from fixture import FixtureBatch, MISSING
+from competitions import REGISTRY, PREMIER_LEAGUE
+from definitions import METRICS_SUB_PATH
+
+# CONSTANTS
+SOURCES = ('fixtures', 'odds', 'results')
+GAMEWEEK = 6 # days of fixtures whose bookmakers' odds are downloaded
+
+log = logging.getLogger(__name__)
+
+# FUNCTIONS
 
-def update():
-    f = retrieve.get_fixtures()
+
+def _pages(competitions, sources):
+    """ Map the address of each page to fetch to its (competition, source).
+    """
+    pages = {}
+    for competition in competitions:
+        for source, url in competition.urls().items():
+            if source in sources:
+                pages[url] = (competition, source)
+    return pages
+
+
+def _cached_fixtures(cache, competition=PREMIER_LEAGUE):
+    """ Parse the fixtures from the cached BBC Fixtures page, for matching
+    new odds when the fixtures themselves have not changed.
+    """
+    body = cache.load(competition.fixtures_url)
+    if body is None:
+        return None
     try:
-        odds = retrieve.get_odds(fixtures=f)
-    except IndexError as e:
-        print('Could not get odds. Error: {}'.format(e))
+        with metrics.current().stage('parse'):
+            return retrieve.get_fixtures(body=body)
+    except ValueError as e:
+        log.warning('Could not get cached %s fixtures. Error: %s',
+                    competition.name, e,
+                    extra={'competition': competition.key})
+
+
+def fetch(cache=None, sources=None, known=None, competitions=None,
+          archive=None):
+    """ Download the sources, by default all of them, for every competition,
+    by default all of those in the registry, at once, and parse each page as
+    soon as it arrives. The odds page of a competition is matched against
+    its fixtures, so it is parsed once both pages are available; if the
+    fixtures page is not among the sources, the odds are matched against the
+    known Fixtures instead. Returns (fixtures, odds, results) for all of the
+    competitions together; any source which was not fetched, could not be
+    downloaded or parsed, or has not changed since it was cached, for every
+    competition, is None. Every page downloaded is kept in archive, if
+    given.
+    """
+    if sources is None:
+        sources = SOURCES
+    if competitions is None:
+        competitions = REGISTRY.values()
+    pages = _pages(competitions, sources)
+    m = metrics.current()
+    parsed = {source: None for source in SOURCES}
+    odds_pages = {}
+    fixtures = {} # the fixtures of each competition, once parsed
+    unchanged = set()
+    if 'fixtures' not in sources:
+        unchanged.update(competitions)
+
+    def forget(url):
+        """ Keep a page which gave nothing out of the cache, so it is
+        parsed again next time.
+        """
+        if cache is not None:
+            cache.discard(url)
+
+    def add(source, competition, found):
+        m.count('fixtures', len(found), source=source,
+                competition=competition.key)
+        if parsed[source] is None:
+            parsed[source] = []
+        parsed[source].extend(found)
+
+    pending = list(pages)
+    for attempt in range(journal.ATTEMPTS): # retry failed downloads alone
+        failed = []
+        for url, body, error in retrieve.fetch_all(pending, cache=cache):
+            competition, source = pages[url]
+            fields = {'competition': competition.key, 'source': source}
+            if error is not None:
+                failed.append(url)
+                log.warning('Could not download %s %s. Error: %s',
+                            competition.name, source, error, extra=fields)
+                continue
+            if body is not None and archive is not None:
+                try:
+                    archive.add(url, body, source, competition.key)
+                except (OSError, sqlite3.Error) as e:
+                    log.error('Could not archive %s %s. Error: %s',
+                              competition.name, source, e, extra=fields)
+            if body is None:
+                log.info('%s %s unchanged', competition.name, source,
+                         extra=fields)
+                if source == 'fixtures':
+                    unchanged.add(competition)
+            elif source == 'fixtures':
+                try:
+                    with m.stage('parse'):
+                        found = retrieve.get_fixtures(body=body)
+                    fixtures[competition] = found
+                    add(source, competition, fixtures[competition])
+                except ValueError as e:
+                    forget(url)
+                    log.warning('Could not get %s %s. Error: %s',
+                                competition.name, source, e, extra=fields)
+            elif source == 'odds':
+                odds_pages[competition] = (url, body)
+            elif source == 'results':
+                try:
+                    with m.stage('parse'):
+                        found = retrieve.get_results(body=body)
+                    add(source, competition, found)
+                except ValueError as e:
+                    forget(url)
+                    log.warning('Could not get %s %s. Error: %s',
+                                competition.name, source, e, extra=fields)
+            for ready in [c for c in odds_pages
+                          if c in fixtures or c in unchanged]:
+                odds_url, odds_page = odds_pages.pop(ready)
+                matching = fixtures.get(ready)
+                if matching is None and known is not None:
+                    matching = [f for f in known if f.home in ready]
+                elif matching is None and cache is not None:
+                    matching = _cached_fixtures(cache, ready)
+                if not matching:
+                    forget(odds_url)
+                    continue
+                try:
+                    add('odds', ready, retrieve.get_odds(fixtures=matching,
+                                                         body=odds_page,
+                                                         competition=ready))
+                except (IndexError, ValueError) as e:
+                    forget(odds_url)
+                    log.warning('Could not get %s odds. Error: %s', ready.name,
+                                e, extra={'competition': ready.key,
+                                          'source': 'odds'})
+        if not failed or attempt == journal.ATTEMPTS - 1:
+            break
+        delay = journal.BACKOFF * 2**attempt
+        log.warning('Retrying %d downloads in %.1fs', len(failed), delay,
+                    extra={'stage': 'fetch', 'attempt': attempt})
+        time.sleep(delay)
+        pending = failed
+    for url, body in odds_pages.values(): # never matched to fixtures
+        forget(url)
+    return parsed['fixtures'], parsed['odds'], parsed['results']
+
+
+def write(w, fixtures, odds, results):
+    """ Write whatever was fetched through a store.Writer, without
+    committing. Returns True if any of the writes failed.
+    """
+    m = metrics.current()
+    failed = False
+    for name, write, entries in (('fixtures', w.enter_fixtures, fixtures),
+                                 ('odds', w.update_odds, odds),
+                                 ('results', w.update_results, results)):
+        if entries is None:
+            continue
+        try:
+            with m.stage('store'):
+                write(entries)
+        except Exception as e:
+            failed = True
+            log.error('Could not write %s to the database. Error: %s', name,
+                      e, extra={'source': name})
+    return failed
+
+
+def settle(path, cache, failed):
+    """ After a commit, summarise the fixtures which have just changed, and
+    remember the pages they came from unless a write failed.
+    """
     try:
-        store.enter_fixtures(f)
+        with metrics.current().stage('analytics'):
+            analytics.refresh(path)
     except Exception as e:
-        print('Could not create fixtures. Error: {}'.format(e))
+        log.error('Could not refresh analytics. Error: %s', e)
+    if cache is not None: # only remember pages once their data is saved
+        if failed:
+            cache.discard()
+        else:
+            cache.commit()
+
+
+def _store(path, batches):
+    """ Write batches, a dictionary of FixtureBatch or None by source, in
+    one transaction, trying again with backoff if the database fails.
+    Returns the summary of the rows written.
+    """
+    def attempt():
+        with store.Writer(path) as w:
+            with metrics.current().stage('store'):
+                for source, write in (('fixtures', w.enter_fixtures),
+                                      ('odds', w.update_odds),
+                                      ('results', w.update_results)):
+                    if batches.get(source) is not None:
+                        write(batches[source])
+                return w.commit()
+
+    return journal.retry(attempt, 'store', errors=(sqlite3.Error,))
+
+
+def resume(path=store.DB_SUB_PATH, j=None):
+    """ Write what an earlier update parsed but could not store, and clear
+    the journal once it is committed. A journal which has failed MAX_RESUMES
+    runs is dropped. Returns the summary of the rows written, or None.
+    """
+    j = Journal() if j is None else j
+    if not j.pending():
+        return None
+    batches = j.load('parsed')
+    if batches is None or j.resumed() > journal.MAX_RESUMES:
+        if batches is not None:
+            log.error('Dropping a journal which could not be stored in %d '
+                      'runs', journal.MAX_RESUMES)
+        j.clear()
+        return None
     try:
-        store.update_odds(odds)
+        summary = _store(path, batches)
     except Exception as e:
-        print('Could not update database with odds. Error: {}'.format(e))
-    try:
-        results = retrieve.get_results()
-    except ValueError as e:
-        print('Could not get scores. Error: {}'.format(e))
+        log.error('Could not store the journal. Error: %s', e)
+        return None
+    j.clear()
+    metrics.current().summary(summary)
+    log.info('Journal written')
+    settle(path, None, False)
+    return summary
+
+
+def update(path=store.DB_SUB_PATH, cache=None, competitions=None,
+           sources=None, known=None, j=None, archive=None):
+    """ Download and parse the sources, by default all of them, then write
+    everything to the database in a single transaction. Returns a summary of
+    the rows written. If a PageCache is given, sources which have not
+    changed since the last successful update are neither parsed nor
+    written. competitions are those to update, by default every one in the
+    registry; known are Fixtures to match odds against, and archive keeps
+    the pages downloaded, as for fetch.
+
+    If a Journal is given as j, what is parsed is saved to it before it is
+    written, and kept if the write fails, for the next update to resume
+    from without downloading the pages again. The journal is cleared once
+    the write is committed; until it can be, updates go no further.
+    """
+    if j is not None:
+        resume(path, j)
+        if j.pending(): # the database is still failing; keep what is saved
+            return {}
+    parsed = fetch(cache, sources, known, competitions, archive)
+    batches = {source: None if found is None else
+               FixtureBatch.from_fixtures(found)
+               for source, found in zip(SOURCES, parsed)}
+    if j is not None:
+        j.save('parsed', batches)
     try:
-        store.update_results(results)
+        summary = _store(path, batches)
     except Exception as e:
-        print('Could not update database with scores. Error: {}'.format(e))
+        log.error('Could not write the update to the database%s. Error: %s',
+                  '; it is kept in the journal' if j is not None else '', e)
+        settle(path, cache, True)
+        return {}
+    if j is not None:
+        j.clear()
+    metrics.current().summary(summary)
+    log.info('Update written')
+    settle(path, cache, False)
+    return summary
+
+
+def update_bookmakers(path=store.DB_SUB_PATH, competitions=None,
+                      days=GAMEWEEK, today=None, session=None):
+    """ Download the odds of every bookmaker for each fixture in the
+    database which is due from today, by default the current date, to days
+    later, for every competition, by default all of those in the registry,
+    and write them in one transaction. Returns a summary of the rows
+    written.
+    """
+    if competitions is None:
+        competitions = REGISTRY.values()
+    today = datetime.date.today() if today is None else today
+    last = today + datetime.timedelta(days=days)
+    with query.Query(path) as q:
+        due = [f for f in q.by_dates(today, last, columnar=True)
+               if f.result is MISSING]
+    prices = []
+    for competition in competitions:
+        fixtures = [f for f in due if f.home in competition]
+        if fixtures:
+            found, failed = retrieve.get_bookmaker_odds(fixtures, competition,
+                                                        session)
+            prices.extend(found)
+            metrics.current().count('fixtures', len(failed),
+                                    source='bookmakers', status='failed')
+
+    def attempt():
+        with store.Writer(path) as w:
+            with metrics.current().stage('store'):
+                w.update_bookmaker_odds(prices)
+            return w.commit()
+
+    summary = journal.retry(attempt, 'store', errors=(sqlite3.Error,))
+    metrics.current().summary(summary)
+    return summary
 
 if __name__ == '__main__':
-    update()
+    metrics.setup_logging()
+    m = metrics.Metrics()
+    metrics.use(m)
+    with Archive() as archive:
+        update(cache=PageCache(), j=Journal(), archive=archive)
+    m.write(METRICS_SUB_PATH)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3.5
+
+""" metrics: timings for each stage of an update, and counts of what it did,
+saved after each run as a Prometheus text file or as a line of JSON. Until a
+Metrics is put in use, every call goes to NULL, which does nothing, so code
+can be instrumented at no real cost.
+"""
+
+# built in modules
+import os
+import os.path
+import json
+import time
+import logging
+import threading
+
+# CONSTANTS
+PREFIX = 'oddscollector_'
+STANDARD = ('args', 'asctime', 'created', 'exc_info', 'exc_text', 'filename',
+            'funcName', 'levelname', 'levelno', 'lineno', 'message',
+            'module', 'msecs', 'msg', 'name', 'pathname', 'process',
+            'processName', 'relativeCreated', 'stack_info', 'taskName',
+            'thread', 'threadName') # attributes of every log record
+
+# CLASSES
+
+
+class _Stage:
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        if kind is not None:
+            self.metrics.count('errors', stage=self.name)
+
+
+class _NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        pass
+
+
+class Metrics:
+
+    def __init__(self):
+        """ Collect the time spent in each stage, and counters, which may
+        have labels, for one run. Safe to use from several threads.
+        """
+        self.started = time.time()
+        self.stages = {} # name: [seconds, calls]
+        self.counters = {} # (name, ((label, value), ...)): count
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        """ Return a context manager timing a stage. Errors raised inside
+        it are counted under errors, labelled with the stage.
+        """
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        with self.lock:
+            totals = self.stages.setdefault(name, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+
+    def count(self, name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def summary(self, summary):
+        """ Count the rows in a summary returned by a store.Writer.
+        """
+        for kind, rows in summary.items():
+            for action, n in rows.items():
+                self.count('db_rows', n, table=kind, action=action)
+
+    def to_dict(self):
+        return {
+            'started': self.started,
+            'seconds': time.time() - self.started,
+            'stages': {name: {'seconds': seconds, 'calls': calls}
+                       for name, (seconds, calls) in self.stages.items()},
+            'counters': [dict(labels, name=name, value=value)
+                         for (name, labels), value in
+                         sorted(self.counters.items())]
+            }
+
+    def to_prometheus(self):
+        """ Return the metrics in the Prometheus text format.
+        """
+        lines = []
+
+        def add(name, kind, samples):
+            lines.append('# TYPE {0}{1} {2}'.format(PREFIX, name, kind))
+            for labels, value in samples:
+                text = ','.join('{0}="{1}"'.format(k, _escape(v))
+                                for k, v in labels)
+                lines.append('{0}{1}{2} {3}'.format(
+                    PREFIX, name, '{' + text + '}' if text else '', value))
+
+        add('run_started_seconds', 'gauge', [((), self.started)])
+        add('run_duration_seconds', 'gauge',
+            [((), time.time() - self.started)])
+        stages = sorted(self.stages.items())
+        add('stage_seconds_total', 'counter',
+            [((('stage', name),), seconds) for name, (seconds, n) in stages])
+        add('stage_calls_total', 'counter',
+            [((('stage', name),), n) for name, (seconds, n) in stages])
+        names = sorted(set(name for name, labels in self.counters))
+        for name in names:
+            add(name + '_total', 'counter',
+                [(labels, value) for (n, labels), value in
+                 sorted(self.counters.items()) if n == name])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """ Save the metrics: a path ending in .jsonl has a line of JSON
+        added to it for each run, and any other path is replaced by a
+        Prometheus text file, as read by the node exporter's textfile
+        collector.
+        """
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        if path.endswith('.jsonl'):
+            with open(path, 'a') as f:
+                f.write(json.dumps(self.to_dict(), sort_keys=True) + '\n')
+            return
+        part = path + '.part' # so the collector never reads half a file
+        with open(part, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(part, path)
+
+
+class _NullMetrics:
+    """ Stands in for a Metrics when none is in use, doing nothing.
+    """
+
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def record(self, name, seconds):
+        pass
+
+    def count(self, name, n=1, **labels):
+        pass
+
+    def summary(self, summary):
+        pass
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        """ Format a log record as a line of JSON, with any fields given to
+        the logger in extra.
+        """
+        entry = {'time': self.formatTime(record), 'level': record.levelname,
+                 'logger': record.name, 'message': record.getMessage()}
+        for key, value in record.__dict__.items():
+            if key not in STANDARD:
+                entry[key] = value if isinstance(
+                    value, (int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, sort_keys=True)
+
+NULL = _NullMetrics()
+_active = NULL # see current and use
+
+# FUNCTIONS
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+def current():
+    """ Return the Metrics in use, or NULL.
+    """
+    return _active
+
+
+def use(metrics):
+    """ Put a Metrics in use, or NULL to stop collecting, and return the
+    one it replaces.
+    """
+    global _active
+    previous, _active = _active, metrics
+    return previous
+
+
+def setup_logging(level=logging.INFO, structured=False):
+    """ Send log records to standard error, as lines of JSON if structured
+    is set.
+    """
+    handler = logging.StreamHandler()
+    if structured:
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
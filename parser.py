@@ -1,26 +1,71 @@
 #!/usr/bin/env python3.5
 
-""" parser: a class for parsing the BBC Sports website.
+""" parser: classes for parsing the BBC Sports website.
 """
 
 # built in modules
-from html.parser import HTMLParser 
+import codecs
+from collections import deque
+from html.parser import HTMLParser
+
+# third-party modules
+try:
+    from lxml import etree
+except ImportError: # BBCParser is used instead
+    etree = None
+
+# CONSTANTS
+# parser states, combined as bit flags
+_TABLE = 1 # inside the stats-body div
+_DATE = 2 # inside a date heading
+_HOME = 4 # inside the home team span
+_HOME_LINK = 8 # inside the link within it, which holds the name
+_AWAY = 16
+_AWAY_LINK = 32
+_KICKOFF = 64
+_SCORE = 128 # inside the score span
+_SCORE_ABBR = 256 # inside the abbreviation within it, which holds the score
+_SCORED = _SCORE | _SCORE_ABBR
+_CAPTURE = _DATE | _HOME_LINK | _AWAY_LINK | _KICKOFF | _SCORE_ABBR
+
+# state entered by each (tag, class) within the table
+_STARTS = {
+    ('h2', 'table-header'): _DATE,
+    ('span', 'team-home teams'): _HOME,
+    ('span', 'team-away teams'): _AWAY,
+    ('td', 'kickoff'): _KICKOFF,
+    ('span', 'score'): _SCORE
+    }
+_CLASSED = frozenset(tag for tag, cls in _STARTS)
+
+# the parts of each match row read by LxmlBBCParser, compiled once
+if etree is not None:
+    _ROW = (
+        etree.XPath('.//span[@class="team-home teams"]//a/text()'),
+        etree.XPath('.//span[@class="team-away teams"]//a/text()'),
+        etree.XPath('.//td[@class="kickoff"]/text()'),
+        etree.XPath('.//span[@class="score"]/abbr/text()')
+        )
 
 # CLASSES
 
 
 class BBCParser(HTMLParser):
 
-    def __init__(self):
+    def __init__(self, stream=False):
+        """ Parse fixtures and results from BBC Sport pages. Each match is
+        collected as a record of (home, away, date, kick-off, score) when its
+        table row closes, and can be taken with pop_matches while the page is
+        still being fed. Unless stream is set, the teams, dates, kick-offs and
+        scores are also kept in separate lists for the whole page.
+        """
         super(BBCParser, self).__init__()
+        self.stream = stream
+        self.matches = deque()
+        self.row = [None] * 5
+        self.state = 0
+        self.depth = 0 # divs open within the table
         self.current_date = None
-        self.in_table = False
-        self.in_date = False
-        self.in_ko = False
-        self.in_score = [False, False]
-        self.in_home = [False, False]
-        self.in_away = [False, False]
-        self.div_count = 0
         self.home = []
         self.away = []
         self.dates = []
@@ -28,64 +73,92 @@ class BBCParser(HTMLParser):
         self.scores = []
 
     def handle_starttag(self, tag, attrs):
-        if tag == 'div' and ('class', 'stats-body') in attrs:
-            self.in_table = True
-        elif tag == 'div':
-            self.div_count += 1
-        elif tag == 'h2' and ('class', 'table-header') in attrs:
-            self.in_date = True
-        elif tag == 'span' and ('class', 'team-home teams') in attrs:
-            self.in_home[0] = True
-        elif tag == 'a' and self.in_home[0]:
-            self.in_home[1] = True
-        elif tag == 'span' and ('class', 'team-away teams') in attrs:
-            self.in_away[0] = True
-        elif tag == 'a' and self.in_away[0]:
-            self.in_away[1] = True
-        elif tag == 'td' and self.in_table and ('class', 'kickoff') in attrs:
-            self.in_ko = True
-        elif tag == 'span' and ('class', 'score') in attrs:
-            self.in_score[0] = True
+        state = self.state
+        if not state & _TABLE: # only the table is of interest
+            if tag == 'div' and ('class', 'stats-body') in attrs:
+                self.state = _TABLE
+                self.depth = 0
+            return
+        if tag in _CLASSED:
+            for name, value in attrs:
+                if name == 'class':
+                    self.state = state | _STARTS.get((tag, value), 0)
+                    break
+        elif tag == 'a':
+            if state & _HOME:
+                self.state = state | _HOME_LINK
+            elif state & _AWAY:
+                self.state = state | _AWAY_LINK
         elif tag == 'abbr':
-            self.in_score[1] = True
+            self.state = state | _SCORE_ABBR
+        elif tag == 'div':
+            self.depth += 1
 
     def handle_endtag(self, tag):
-        if tag == 'div' and self.div_count == 0:
-            self.in_table = False
-        elif tag == 'div':
-            self.div_count -= 1
+        state = self.state
+        if not state & _TABLE:
+            return
+        if tag == 'span':
+            if state & (_HOME | _HOME_LINK):
+                self.state = state & ~(_HOME | _HOME_LINK)
+            elif state & (_AWAY | _AWAY_LINK):
+                self.state = state & ~(_AWAY | _AWAY_LINK)
+            elif state & _SCORE:
+                self.state = state & ~_SCORED
+        elif tag == 'tr':
+            row = self.row
+            if row[0] is not None and row[1] is not None:
+                self.matches.append(tuple(row))
+            self.row = [None] * 5
+        elif tag == 'td':
+            self.state = state & ~_KICKOFF
+        elif tag == 'abbr':
+            self.state = state & ~_SCORED
         elif tag == 'h2':
-            self.in_date = False
-        elif tag == 'span' and any(self.in_home):
-            self.in_home = [False, False]
-        elif tag == 'span' and any(self.in_away):
-            self.in_away = [False, False]
-        elif tag == 'td' and self.in_ko:
-            self.in_ko = False
-        elif tag == 'abbr' and any(self.in_score):
-            self.in_score = [False, False]
+            self.state = state & ~_DATE
+        elif tag == 'div':
+            if self.depth:
+                self.depth -= 1
+            else:
+                self.state = 0
 
     def handle_data(self, data):
-        data = data.strip().strip('\n').strip()
-        if self.in_table:
-            if self.in_date:
-                self.current_date = data
-                self.in_date = False
-            if all(self.in_home):
+        state = self.state
+        if not state & _CAPTURE:
+            return
+        data = data.strip()
+        if state & _DATE:
+            self.current_date = data
+            state &= ~_DATE
+        if state & _HOME_LINK:
+            self.row[0], self.row[2] = data, self.current_date
+            state &= ~(_HOME | _HOME_LINK)
+            if not self.stream:
                 self.home.append(data)
-                self.in_home = [False, False]
                 self.dates.append(self.current_date)
-            if all(self.in_away):
+        if state & _AWAY_LINK:
+            self.row[1] = data
+            state &= ~(_AWAY | _AWAY_LINK)
+            if not self.stream:
                 self.away.append(data)
-                self.in_away = [False, False]
-            if self.in_ko:
+        if state & _KICKOFF:
+            self.row[3] = data
+            if not self.stream:
                 self.ko.append(data)
-            if all(self.in_score):
+        if state & _SCORED == _SCORED:
+            self.row[4] = data
+            state &= ~_SCORED
+            if not self.stream:
                 self.scores.append(data)
-                self.in_score = [False, False]
+        self.state = state
+
+    def pop_matches(self):
+        """ Yield, and forget, each match completed so far.
+        """
+        while self.matches:
+            yield self.matches.popleft()
 
     def run_checks(self):
-        attrs = [self.dates, self.ko, self.scores]
         if len(self.home) != len(self.away):
             raise ValueError('Mismatch with home ({0}) and away ({1}) '
                              'teams'.format(len(self.home), len(self.away)))
@@ -94,6 +167,95 @@ class BBCParser(HTMLParser):
         if len(self.ko) != len(self.home) and self.ko:
                 raise ValueError('Too few times ({})'.format(len(self.ko)))
         if len(self.scores) != len(self.home) and self.scores:
-                raise ValueError('Too few scores ({})'.format(len(scores)))
-        
-            
+                raise ValueError('Too few scores ({})'.format(
+                    len(self.scores)))
+
+
+class LxmlBBCParser:
+
+    def __init__(self):
+        """ Parse matches from BBC Sport pages as BBCParser does, with the
+        same feed, close and pop_matches, but with lxml's tokeniser, in C,
+        reading each match row as a whole once it has closed. Rows are
+        cleared once read, so only the unparsed page is held.
+        """
+        self.parser = etree.HTMLPullParser(events=('start', 'end'),
+                                           tag=('div', 'h2', 'tr'))
+        self.matches = deque()
+        self.table = None # the stats-body div, while inside it
+        self.current_date = None
+
+    def _read(self):
+        for event, element in self.parser.read_events():
+            if self.table is None:
+                if event == 'start' and element.tag == 'div' and \
+                        element.get('class') == 'stats-body':
+                    self.table = element
+                continue
+            if event == 'start':
+                continue
+            if element is self.table:
+                self.table = None
+            elif element.tag == 'h2':
+                if element.get('class') == 'table-header':
+                    self.current_date = ''.join(element.itertext()).strip()
+            elif element.tag == 'tr':
+                home, away, kickoff, score = [
+                    _first(path(element)) for path in _ROW]
+                if home is not None and away is not None:
+                    self.matches.append((home, away, self.current_date,
+                                         kickoff, score))
+                element.clear(keep_tail=True)
+
+    def feed(self, data):
+        self.parser.feed(data)
+        self._read()
+
+    def close(self):
+        self.parser.close()
+        self._read()
+
+    def pop_matches(self):
+        """ Yield, and forget, each match completed so far.
+        """
+        while self.matches:
+            yield self.matches.popleft()
+
+# the parser used by iter_matches: lxml's where it is installed
+PARSER = BBCParser if etree is None else LxmlBBCParser
+
+# FUNCTIONS
+
+
+def _first(texts):
+    """ Return the first of a list of texts, stripped, or None.
+    """
+    return texts[0].strip() if texts else None
+
+
+def iter_matches(chunks, parser=None):
+    """ Parse a BBC page from an iterable of chunks, as bytes or text, and
+    yield each match as (home, away, date, kick-off, score) as soon as its
+    row is complete. Only the unparsed end of the page is held in memory.
+    parser is the class used, by default PARSER.
+    """
+    if parser is None:
+        parser = PARSER
+    p = parser(stream=True) if parser is BBCParser else parser()
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    tail = ''
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        text = tail + chunk
+        # feed up to the last tag, so that no run of text is split in two
+        cut = text.rfind('<')
+        if cut < 0:
+            tail = text
+            continue
+        p.feed(text[:cut])
+        tail = text[cut:]
+        yield from p.pop_matches()
+    p.feed(tail + decoder.decode(b'', final=True))
+    p.close()
+    yield from p.pop_matches()
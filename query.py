@@ -0,0 +1,86 @@
+#!/usr/bin/env python3.5
+
+""" query: indexed lookups on the odds database, returning rows as tuples or
+as a FixtureBatch.
+"""
+
+# built in modules
+import datetime
+
+# package modules
+import store
+from fixture import FixtureBatch
+from definitions import DB_SUB_PATH
+
+# CONSTANTS
+# each lookup is served by an index created in store
+BY_DATES = ('SELECT * FROM odds WHERE date >= ? AND date <= ? '
+            'ORDER BY date, time')
+BY_TEAM = ('SELECT * FROM odds WHERE home = ? COLLATE NOCASE '
+           'UNION ALL SELECT * FROM odds WHERE away = ? COLLATE NOCASE '
+           'ORDER BY date')
+BY_RESULT = 'SELECT * FROM odds WHERE result = ? ORDER BY date'
+UPCOMING = ('SELECT * FROM odds WHERE result IS NULL AND date >= ? '
+            'ORDER BY date, time')
+UNSETTLED = ('SELECT * FROM odds WHERE result IS NULL AND date < ? '
+             'ORDER BY date, time')
+
+# CLASSES
+
+
+class Query:
+
+    def __init__(self, path=DB_SUB_PATH):
+        """ Keep a connection to the database open for repeated lookups.
+        Each lookup returns a list of rows of the odds table, or a
+        FixtureBatch if columnar is set. Statements are prepared once and
+        cached by the connection.
+        """
+        self.connection, self.c = store._connect(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.close()
+
+    def _rows(self, statement, parameters, columnar):
+        rows = self.connection.execute(statement, parameters).fetchall()
+        if columnar:
+            return FixtureBatch.from_rows(rows)
+        return rows
+
+    def by_dates(self, start, end=None, columnar=False):
+        """ Fixtures from start to end, inclusive, as dates or their text.
+        """
+        if end is None:
+            end = start
+        return self._rows(BY_DATES, (str(start), str(end)), columnar)
+
+    def by_team(self, team, columnar=False):
+        """ Fixtures in which a team, named in any case, plays home or away.
+        """
+        return self._rows(BY_TEAM, (team, team), columnar)
+
+    def by_result(self, result, columnar=False):
+        """ Fixtures with a result of 'H', 'D' or 'A'.
+        """
+        return self._rows(BY_RESULT, (result,), columnar)
+
+    def upcoming(self, today=None, columnar=False):
+        """ Fixtures without a result from today, by default the current
+        date, onwards.
+        """
+        if today is None:
+            today = datetime.date.today()
+        return self._rows(UPCOMING, (str(today),), columnar)
+
+    def unsettled(self, today=None, columnar=False):
+        """ Fixtures before today which are still without a result.
+        """
+        if today is None:
+            today = datetime.date.today()
+        return self._rows(UNSETTLED, (str(today),), columnar)
+
+    def close(self):
+        self.connection.close()
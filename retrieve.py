@@ -7,90 +7,393 @@ dedicated websites.
 # built in modules
 import os
 import os.path
-import requests
+import time
+import logging
 import datetime
+import threading
+from itertools import zip_longest
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # third-party modules
+import requests
+from requests.adapters import HTTPAdapter
 from lxml import html
-from lxml.etree import XPathEvalError
+from lxml.etree import XPath, XPathEvalError
 
 # package modules
-from fixture import Fixture
-from parser import BBCParser
-from definitions import HTML_SUB_PATH, PL
+import metrics
+from fixture import Fixture, MISSING
+from competitions import team_code, PREMIER_LEAGUE
+from convert import odds_array
+from parser import iter_matches
+from definitions import HTML_SUB_PATH
 
 # CONSTANTS
-ODDSCHECKER = 'http://www.oddschecker.com/football/english/premier-league'
-BBC_FIXT = 'http://www.bbc.co.uk/sport/football/premier-league/fixtures'
-BBC_RESU = 'http://www.bbc.co.uk/sport/football/premier-league/results'
-                
+ODDSCHECKER = PREMIER_LEAGUE.odds_url
+BBC_FIXT = PREMIER_LEAGUE.fixtures_url
+BBC_RESU = PREMIER_LEAGUE.results_url
+HOSTS = 10 # number of hosts to keep connection pools for
+POOL_SIZE = 4 # keep-alive connections per host
+HOST_LIMITS = { # downloads at once from hosts which allow fewer than POOL_SIZE
+    'www.oddschecker.com': 2
+    }
+WORKERS = 16 # downloads at once from all hosts
+TIMEOUT = 30 # seconds to wait for a server to respond
+CHUNK_SIZE = 16384 # bytes read at a time when streaming a page
+# the odds grid of a match page, compiled once: a column for each bookmaker,
+# and a row for each outcome with a cell for each bookmaker pricing it
+GRID_BOOKMAKERS = XPath('//tr[contains(@class, "eventTableHeader")]'
+                        '/td[@data-bk]')
+GRID_NAME = XPath('string(.//a/@title)')
+GRID_ROWS = XPath('//tr[contains(@class, "evTabRow")]')
+GRID_CELLS = XPath('td[@data-bk]')
+
+_session = None # shared by all downloads; see get_session
+log = logging.getLogger(__name__)
+
+# CLASSES
+
+
+class RateLimit:
+
+    def __init__(self, rate):
+        """ Space out requests to no more than rate a second, across all of
+        the threads which share the limit.
+        """
+        self.interval = 1.0 / rate
+        self.next = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """ Block until the next request may be made.
+        """
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next, now)
+            self.next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
 # FUNCTIONS
 
 
-def get_fixtures(url=BBC_FIXT):
+def get_session():
+    """ Return the session shared by all downloads, creating it on first use.
+    Connections are kept alive between requests and pooled by host, with no
+    more than POOL_SIZE open to any one host at a time.
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HOSTS, pool_maxsize=POOL_SIZE,
+                              pool_block=True)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def fetch(url, session=None, cache=None):
+    """ Download a page and return its body as bytes. If a PageCache is given,
+    the request is conditional on the cached copy, and None is returned when
+    the page has not changed since it was cached.
+    """
+    if session is None:
+        session = get_session()
+    m = metrics.current()
+    headers = cache.headers(url) if cache is not None else None
+    with m.stage('fetch'):
+        response = session.get(url, headers=headers, timeout=TIMEOUT)
+        if cache is not None and response.status_code == 304:
+            m.count('cache_hits')
+            return None
+        response.raise_for_status()
+        body = response.content
+    m.count('pages')
+    m.count('bytes', len(body))
+    if cache is not None and not cache.check(url, response):
+        m.count('cache_hits')
+        return None
+    return body
+
+
+def _interleave(urls):
+    """ Order urls so that consecutive ones are from different hosts, for
+    the downloads running at any one time to be spread across hosts.
+    """
+    hosts = {}
+    for url in urls:
+        hosts.setdefault(urlsplit(url).netloc, []).append(url)
+    return [url for group in zip_longest(*hosts.values()) for url in group
+            if url is not None]
+
+
+def fetch_all(urls, session=None, cache=None, workers=WORKERS,
+              limit=None):
+    """ Download several pages at the same time over a shared session. Yields
+    (url, body, error) as each download finishes, so that pages can be parsed
+    while the others are still arriving. If a download fails, body is None and
+    error holds the exception. If a PageCache is given, body is also None for
+    pages which have not changed since they were cached. No more than workers
+    pages are downloaded at once, and no more than POOL_SIZE, or the limit in
+    HOST_LIMITS, from any one host. If a RateLimit is given as limit,
+    downloads are also spaced out by it.
+    """
+    urls = _interleave(urls)
+    if not urls:
+        return
+    if session is None:
+        session = get_session()
+    limits = {}
+    for url in urls:
+        host = urlsplit(url).netloc
+        if host not in limits:
+            limits[host] = threading.BoundedSemaphore(
+                min(POOL_SIZE, HOST_LIMITS.get(host, POOL_SIZE)))
+
+    def limited(url):
+        with limits[urlsplit(url).netloc]:
+            if limit is not None:
+                limit.wait()
+            return fetch(url, session, cache)
+
+    with ThreadPoolExecutor(max_workers=min(len(urls), workers)) as pool:
+        futures = {pool.submit(limited, url): url for url in urls}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+def _stream(url, session=None):
+    """ Download a page and yield its body in chunks as they arrive.
+    """
+    if session is None:
+        session = get_session()
+    m = metrics.current()
+    response = session.get(url, stream=True, timeout=TIMEOUT)
+    try:
+        response.raise_for_status()
+        m.count('pages')
+        for chunk in response.iter_content(CHUNK_SIZE):
+            m.count('bytes', len(chunk))
+            yield chunk
+    finally:
+        response.close()
+
+
+def iter_fixtures(url=BBC_FIXT, body=None):
+    """ Yield a Fixture with teams, date and kick-off time for each match on
+    the BBC Fixtures webpage, as soon as it has been parsed. The page is
+    streamed, so matches are parsed while the rest of it downloads. If body
+    is given, it is parsed instead of downloading the page.
+    """
+    chunks = _stream(url) if body is None else [body]
+    for home, away, date, ko, score in iter_matches(chunks):
+        if date is None or ko is None:
+            raise ValueError('No date or time for {0} vs. {1}'.format(home,
+                                                                      away))
+        f = Fixture(home, away) # error checking is done during creation
+        f.set_date(date)
+        f.set_time(ko)
+        yield f
+
+
+def get_fixtures(url=BBC_FIXT, body=None):
     """ Get fixture information (home, away, gameweek date) from a URL.
     Designed to work exclusively with the BBC Fixtures webpage. Return a list
-    of Fixture objects with this information.
-    """
-    p = BBCParser()
-    p.feed(requests.get(url).text)
-    p.run_checks()
-    fixtures = [] # error checking is done during Fixture creation
-    matches = zip(p.home, p.away, p.dates, p.ko)
-    for item in matches:
-        f = Fixture(item[0], item[1])
-        f.set_date(item[2])
-        f.set_time(item[3])
-        fixtures.append(f)
-    return fixtures
+    of Fixture objects with this information. If body is given, it is parsed
+    instead of downloading the page.
+    """
+    return list(iter_fixtures(url, body))
+
+
+def _nearest(fixtures, today):
+    """ Return the fixture to be played soonest on or after today, those
+    without a date last, or the latest of them if all have been played.
+    """
+    upcoming = [f for f in fixtures if f.date is MISSING or f.date >= today]
+    if upcoming:
+        return min(upcoming, key=lambda f: (f.date is MISSING,
+                                            f.date or today))
+    return max(fixtures, key=lambda f: f.date)
+
+
+def match_odds(fixtures, teams, odds, today=None):
+    """ Set the odds of each fixture from the teams and odds read from the
+    Oddschecker page, which come in threes: home, draw, away. Fixtures are
+    looked up by their teams, so the page and the fixtures can be in any
+    order. Where the same teams meet more than once among the fixtures,
+    as across seasons, the odds go to the meeting played soonest on or
+    after today, by default the current date. Odds which cannot be read
+    are left MISSING. Returns a list of (home, away) for odds which match
+    no fixture.
+    """
+    if today is None:
+        today = datetime.date.today()
+    index = {}
+    for f in fixtures:
+        index.setdefault(Fixture.create_uid(f.home, f.away), []).append(f)
+    rows = len(teams) // 3
+    with metrics.current().stage('convert'):
+        values, mask = odds_array(odds[:3*rows], columns=3)
+    unmatched = []
+    for row in range(rows):
+        home, away = teams[3*row], teams[3*row+2]
+        try:
+            meetings = index[Fixture.create_uid(home, away)]
+        except KeyError: # unknown teams, or no such fixture
+            unmatched.append((home, away))
+            continue
+        f = meetings[0] if len(meetings) == 1 else _nearest(meetings, today)
+        f.set_odds(*values[row])
+    return unmatched
+
+
+def read_odds(body):
+    """ Read the teams, in threes of home, draw and away, and the odds for
+    each, from the Oddschecker page.
+    """
+    with metrics.current().stage('parse'):
+        tree = html.fromstring(body)
+        # read teams, in order of the odds given, from webpage
+        teams = tree.xpath('//span[@class="fixtures-bet-name"]/text()')
+        odds = tree.xpath('//span[@class="odds"]/text()') # read odds
+    return teams, odds
 
 
-def get_odds(url=ODDSCHECKER, fixtures=None):
+def get_odds(url=ODDSCHECKER, fixtures=None, body=None,
+             competition=PREMIER_LEAGUE):
     """ Get data from a URL about the teams playing and the corresponding
     odds. Designed to work exlusively with the Oddschecker website. If the
     fixture parameter is given, updates a list of Fixtures and returns.
-    Otherwise, creates a list of Fixtures and returns.
+    Otherwise, creates a list of Fixtures and returns. If body is given, it
+    is parsed instead of downloading the page. The page is expected to have
+    odds for most of the teams in competition.
     """
-    page = requests.get(url)
-    tree = html.fromstring(page.content)
-    # read teams, in order of the odds given, from webpage
-    teams = tree.xpath('//span[@class="fixtures-bet-name"]/text()')
+    if body is None:
+        body = fetch(url)
+    m = metrics.current()
+    teams, odds = read_odds(body)
     # expect three results for every two teams, counting draw_odds
-    if len(teams) < 1.5*len(PL):
+    if len(teams) < 1.5*len(competition.teams):
         raise ValueError('Not enough results found: {}'.format(len(teams)))
-    odds = tree.xpath('//span[@class="odds"]/text()') # read odds
     if len(odds) < len(teams):
         raise ValueError('Not enough odds found: {}'.format(len(teams)))
     if fixtures: # update Fixture objects if they exist
-        for num in range(0, len(teams), 3):
-            home, away = teams[num], teams[num+2]
-            for f in fixtures: # find the right Fixture to update
-                if f.home == home and f.away == away:
-                    f.set_odds(odds[num], odds[num+1], odds[num+2])
-                    fixtures[int(num/3)] = f
+        unmatched = match_odds(fixtures, teams, odds)
+        if unmatched:
+            m.count('odds_unmatched', len(unmatched))
+            rows = '; '.join(['{0} vs. {1}'.format(*r) for r in unmatched])
+            log.warning('No fixture found for the odds of %s', rows,
+                        extra={'unmatched': len(unmatched)})
     else: # otherwise create Fixture objects
         fixtures = []
-        for num in range(0, len(teams), 3):
-            new = Fixture(teams[num], teams[num+2])
-            new.set_odds(odds[num], odds[num+1], odds[num+2])
+        rows = len(teams) // 3
+        with m.stage('convert'):
+            values, mask = odds_array(odds[:3*rows], columns=3)
+        for row in range(rows):
+            new = Fixture(teams[3*row], teams[3*row+2])
+            new.set_odds(*values[row])
             fixtures.append(new)
     return fixtures
 
 
-def get_results(url=BBC_RESU):
+def read_grid(body):
+    """ Read the odds grid from an Oddschecker match page. Returns the name
+    of each bookmaker, the name of each outcome, and a grid of the odds as
+    text with a row for each outcome and a column for each bookmaker, empty
+    where a bookmaker has no price.
+    """
+    with metrics.current().stage('parse'):
+        tree = html.fromstring(body)
+        codes, bookmakers = [], []
+        for cell in GRID_BOOKMAKERS(tree):
+            codes.append(cell.get('data-bk'))
+            bookmakers.append(GRID_NAME(cell) or cell.get('data-bk'))
+        outcomes, grid = [], []
+        for row in GRID_ROWS(tree):
+            prices = {c.get('data-bk'): c.get('data-o') or ''
+                      for c in GRID_CELLS(row)}
+            outcomes.append(row.get('data-bname'))
+            grid.append([prices.get(code, '') for code in codes])
+    return bookmakers, outcomes, grid
+
+
+def grid_prices(fixture, body):
+    """ Return the price of each bookmaker for each outcome of a fixture,
+    from its Oddschecker match page, as a list of (uid, bookmaker, outcome,
+    price), where outcome is H, D or A. Prices which cannot be read, and
+    outcomes which are not the fixture's teams or a draw, are left out.
+    """
+    bookmakers, outcomes, grid = read_grid(body)
+    if not grid or not bookmakers:
+        raise ValueError('No odds found for {0} vs. {1}'.format(
+            fixture.home, fixture.away))
+    with metrics.current().stage('convert'):
+        values, mask = odds_array(grid)
+    sides = {team_code(fixture.home): 'H', team_code(fixture.away): 'A'}
+    prices = []
+    for row, name in enumerate(outcomes):
+        outcome = 'D' if name.lower() == 'draw' else sides.get(
+            team_code(name or ''))
+        if outcome is None:
+            continue
+        for column, bookmaker in enumerate(bookmakers):
+            if mask[row, column]:
+                prices.append((fixture.uid, bookmaker, outcome,
+                               float(values[row, column])))
+    return prices
+
+
+def get_bookmaker_odds(fixtures, competition=PREMIER_LEAGUE, session=None,
+                       limit=None):
+    """ Download the match page of each fixture at the same time, and read
+    the price of every bookmaker from each as it arrives. Returns the prices
+    as for grid_prices, for all of the fixtures, and the fixtures whose
+    pages could not be downloaded or read.
+    """
+    pages = {competition.match_url(f.home, f.away): f for f in fixtures}
+    m = metrics.current()
+    prices, failed = [], []
+    for url, body, error in fetch_all(pages, session, limit=limit):
+        f = pages[url]
+        if error is None:
+            try:
+                found = grid_prices(f, body)
+            except ValueError as e:
+                error = e
+        if error is not None:
+            failed.append(f)
+            log.warning('Could not get the odds of %s vs. %s. Error: %s',
+                        f.home, f.away, error, extra={'uid': f.uid})
+            continue
+        m.count('bookmaker_prices', len(found))
+        prices.extend(found)
+    return prices, failed
+
+
+def iter_results(url=BBC_RESU, body=None):
+    """ Yield a Fixture with teams, date and score for each match on the BBC
+    Results webpage, as soon as it has been parsed. The page is streamed, so
+    matches are parsed while the rest of it downloads. If body is given, it is
+    parsed instead of downloading the page.
+    """
+    chunks = _stream(url) if body is None else [body]
+    for home, away, date, ko, score in iter_matches(chunks):
+        if date is None or score is None:
+            raise ValueError('No date or score for {0} vs. {1}'.format(home,
+                                                                       away))
+        f = Fixture(home, away) # error checking is done during creation
+        f.set_date(date)
+        f.set_result(score)
+        yield f
+
+
+def get_results(url=BBC_RESU, body=None):
     """ Get results data (scores) from the BBC Results page. Designed to work
-    exclusively with the BBC Results page. If the fixture parameter is given,
-    updates a list of Fixtures and returns. Otherwise, creates a list of
-    Fixtures and returns.
-    """
-    p = BBCParser()
-    p.feed(requests.get(url).text)
-    p.run_checks()
-    fixtures = [] # error checking is done during Fixture creation
-    matches = zip(p.home, p.away, p.dates, p.scores)
-    for item in matches:
-        f = Fixture(item[0], item[1])
-        f.set_date(item[2])
-        f.set_result(item[3])
-        fixtures.append(f)
-    return fixtures   
+    exclusively with the BBC Results page. Returns a list of Fixtures. If body
+    is given, it is parsed instead of downloading the page.
+    """
+    return list(iter_results(url, body))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3.5
+
+""" standin: a local HTTP server standing in for the BBC and Oddschecker,
+serving the pages recorded under pages/, for running the tests and
+benchmarks offline. Responses can be slowed down, and a share of them can
+fail, to see how the package copes.
+"""
+
+# built in modules
+import os.path
+import re
+import copy
+import time
+import random
+import threading
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# package modules
+from competitions import PREMIER_LEAGUE
+
+# CONSTANTS
+PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+# the recorded page served at each path
+ROUTES = {
+    '/fixtures': 'bbc-fixtures.html',
+    '/results': 'bbc-results.html',
+    '/odds': 'oddschecker.html'
+    }
+# the repeated part of each kind of page: the tables of matches on the BBC
+# pages, and the rows of odds on Oddschecker
+BLOCKS = (
+    re.compile(r'<h2 class="table-header">.*</table>\s*', re.S),
+    re.compile(r'<tr class="match-on">.*</tr>\s*', re.S)
+    )
+YEAR = re.compile(r'\b20\d\d\b')
+ERROR = 503 # status of the responses which fail
+
+# CLASSES
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandIn:
+
+    def __init__(self, pages=None, latency=0.0, errors=0.0, seed=None):
+        """ Serve pages, a dictionary of paths to bodies as bytes, by default
+        the recorded pages at the paths in ROUTES. Each response is delayed
+        by latency seconds, and a share of them given by errors fails with a
+        503; seed fixes which ones. Use start and stop, or a with block.
+        """
+        self.pages = recorded() if pages is None else pages
+        self.latency = latency
+        self.errors = errors
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = None
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                standin._respond(self)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _respond(self, handler):
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.errors
+        if self.latency:
+            time.sleep(self.latency)
+        body = self.pages.get(handler.path.split('?')[0])
+        if failed or body is None:
+            handler.send_error(ERROR if failed else 404)
+            return
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'text/html; charset=utf-8')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def start(self):
+        self.server = _Server(('127.0.0.1', 0), self._handler())
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, kind, value, traceback):
+        self.stop()
+
+    def url(self, path=''):
+        """ Return the address of a path on the server.
+        """
+        return 'http://127.0.0.1:{0}{1}'.format(self.server.server_address[1],
+                                                path)
+
+    def competition(self, template=PREMIER_LEAGUE):
+        """ Return a copy of a competition whose pages are on the server.
+        """
+        c = copy.copy(template)
+        c.fixtures_url = self.url('/fixtures')
+        c.results_url = self.url('/results')
+        c.odds_url = self.url('/odds')
+        return c
+
+# FUNCTIONS
+
+
+def scale_page(body, factor):
+    """ Return a page with its matches repeated factor times. On the BBC
+    pages, each copy is moved on by a year, so that its fixtures are new.
+    """
+    if factor == 1:
+        return body
+    for block in BLOCKS:
+        found = block.search(body)
+        if found:
+            break
+    else:
+        raise ValueError('No matches found to repeat')
+    part = found.group()
+    shift = lambda n: YEAR.sub(lambda y: str(int(y.group()) + n), part)
+    copies = [shift(n) for n in range(factor)]
+    return body[:found.start()] + ''.join(copies) + body[found.end():]
+
+
+def recorded(scale=1, routes=ROUTES, folder=PAGES):
+    """ Load the recorded pages, as bytes by path, scaled by a factor.
+    """
+    pages = {}
+    for path, name in routes.items():
+        with open(os.path.join(folder, name), encoding='utf-8') as f:
+            pages[path] = scale_page(f.read(), scale).encode('utf-8')
+    return pages
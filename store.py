@@ -4,200 +4,683 @@
 """
 
 # built in modules
+import io
 import os
 import os.path
 import sqlite3
+import re
+import sys
 import csv
+import gzip
+import logging
+import shutil
+import tempfile
 import datetime
 
 # package modules
-from definitions import DB_SUB_DIR, DB_SUB_PATH, \
-                        DB_BACKUP_SUB_PATH, ROW_HEADINGS
+from fixture import FixtureBatch, _ODDS_DP
+from definitions import DB_SUB_PATH, DB_BACKUP_SUB_PATH, ROW_HEADINGS
 
 # CONSTANTS
-FIELDS = ('INSERT INTO odds (id, uid, home, away, timestamp, date, time)'
-          'VALUES (?, ?, ?, ?, ?, ?, ?)')
-MAX_SAVES = 10 # for creating back-ups
+TABLE = ('CREATE TABLE IF NOT EXISTS odds (id INTEGER PRIMARY KEY, '
+         'uid TEXT UNIQUE NOT NULL, home TEXT NOT NULL, '
+         'away TEXT NOT NULL, timestamp TEXT, date TEXT, time TEXT, '
+         'home_odds REAL, draw_odds REAl, away_odds REAL, '
+         'home_score REAL, away_score REAL, result TEXT, '
+         'modified INTEGER DEFAULT 0, best_home_odds REAL, '
+         'best_draw_odds REAL, best_away_odds REAL, consensus_home_odds REAL, '
+         'consensus_draw_odds REAL, consensus_away_odds REAL)')
+# the best price of any bookmaker, and the consensus of them all, for each
+# outcome, from the latest capture of the bookmaker_odds table
+DERIVED = ('best_home_odds', 'best_draw_odds', 'best_away_odds',
+           'consensus_home_odds', 'consensus_draw_odds',
+           'consensus_away_odds')
+# the write which last changed each row, for finding rows changed since
+MODIFIED = 'CREATE INDEX IF NOT EXISTS odds_modified ON odds (modified)'
+# access paths used by the query module
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS odds_date ON odds (date, time)',
+    'CREATE INDEX IF NOT EXISTS odds_home ON odds (home COLLATE NOCASE, date)',
+    'CREATE INDEX IF NOT EXISTS odds_away ON odds (away COLLATE NOCASE, date)',
+    # also serves upcoming and unsettled fixtures, which have a NULL result
+    'CREATE INDEX IF NOT EXISTS odds_result ON odds (result, date, time)'
+    )
+# fixtures changed since the analytics module last summarised them
+DIRTY = ('CREATE TABLE IF NOT EXISTS analytics_dirty (uid TEXT PRIMARY KEY) '
+         'WITHOUT ROWID')
+TRIGGERS = (
+    'CREATE TRIGGER IF NOT EXISTS odds_inserted AFTER INSERT ON odds '
+    'BEGIN INSERT OR IGNORE INTO analytics_dirty VALUES (new.uid); END',
+    'CREATE TRIGGER IF NOT EXISTS odds_updated AFTER UPDATE OF home_odds, '
+    'draw_odds, away_odds, home_score, away_score, result, date ON odds '
+    'BEGIN INSERT OR IGNORE INTO analytics_dirty VALUES (new.uid); END'
+    )
+# the tables kept up to date by analytics.refresh
+ANALYTICS = (
+    'CREATE TABLE IF NOT EXISTS market (uid TEXT PRIMARY KEY, '
+    'season INTEGER, home_prob REAL, draw_prob REAL, away_prob REAL, '
+    'overround REAL, fair_home REAL, fair_draw REAL, fair_away REAL, '
+    'favourite TEXT) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS team_summary (team TEXT, season INTEGER, '
+    'played INTEGER, wins INTEGER, draws INTEGER, losses INTEGER, '
+    'favourite INTEGER, favourite_wins INTEGER, '
+    'PRIMARY KEY (team, season)) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS calibration (season INTEGER, '
+    'bucket INTEGER, predictions INTEGER, expected REAL, observed INTEGER, '
+    'PRIMARY KEY (season, bucket)) WITHOUT ROWID'
+    )
+# every price captured, clustered by fixture so a history is one range scan
+SNAPSHOTS = ('CREATE TABLE IF NOT EXISTS odds_snapshots ('
+             'uid TEXT NOT NULL, captured_at TEXT NOT NULL, '
+             'home_odds REAL, draw_odds REAL, away_odds REAL, '
+             'PRIMARY KEY (uid, captured_at)) WITHOUT ROWID')
+# the price of every bookmaker for each outcome (H, D or A) of a fixture
+BOOKMAKER_ODDS = ('CREATE TABLE IF NOT EXISTS bookmaker_odds ('
+                  'uid TEXT NOT NULL, bookmaker TEXT NOT NULL, '
+                  'outcome TEXT NOT NULL, price REAL, '
+                  'captured_at TEXT NOT NULL, PRIMARY KEY (uid, captured_at, '
+                  'bookmaker, outcome)) WITHOUT ROWID')
+FIELDS = ('INSERT OR IGNORE INTO odds (modified, uid, home, away, timestamp, '
+          'date, time) VALUES (?, ?, ?, ?, ?, ?, ?)')
+ODDS = ('UPDATE odds SET modified = ?, home_odds = ?, draw_odds = ?, '
+        'away_odds = ?, timestamp = ? WHERE uid = ?')
+SNAPSHOT = ('INSERT OR REPLACE INTO odds_snapshots (uid, captured_at, '
+            'home_odds, draw_odds, away_odds) SELECT uid, ?, ?, ?, ? '
+            'FROM odds WHERE uid = ?')
+PRICE = ('INSERT OR REPLACE INTO bookmaker_odds (uid, bookmaker, outcome, '
+         'price, captured_at) VALUES (?, ?, ?, ?, ?)')
+BEST = ('UPDATE odds SET modified = ?, {} WHERE uid = ?'.format(
+    ', '.join(name + ' = ?' for name in DERIVED)))
+PRICES = ('SELECT bookmaker, outcome, price FROM bookmaker_odds WHERE uid = ? '
+          'AND captured_at = (SELECT max(captured_at) FROM bookmaker_odds '
+          'WHERE uid = ?) ORDER BY outcome, bookmaker')
+LATEST = ('SELECT uid, max(captured_at) FROM odds_snapshots '
+          'WHERE uid IN ({}) GROUP BY uid')
+HISTORY = ('SELECT captured_at, home_odds, draw_odds, away_odds '
+           'FROM odds_snapshots WHERE uid = ? AND captured_at >= ? '
+           'AND captured_at <= ? ORDER BY captured_at')
+SCORES = ('UPDATE odds SET modified = ?, home_score = ?, away_score = ?, '
+          'result = ? WHERE uid = ?')
+RESCHEDULE = 'UPDATE odds SET modified = ?, date = ?, time = ? WHERE uid = ?'
+# what is stored of each fixture, for writing only what has changed
+STORED = ('SELECT uid, date, time, home_odds, draw_odds, away_odds, '
+          'home_score, away_score, result FROM odds WHERE uid IN ({})')
+STORED_CHUNK = 500 # fixtures looked up at a time, within SQLite's limit
+SCHEMA = 2 # version of the tables below, kept in PRAGMA user_version
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL', # readers are not blocked by the writer
+    'PRAGMA synchronous = NORMAL', # safe in WAL mode, and fewer fsyncs
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000' # in KiB
+    )
+COLUMNS = ('id', 'uid', 'home', 'away', 'timestamp', 'date', 'time',
+           'home_odds', 'draw_odds', 'away_odds', 'home_score', 'away_score',
+           'result')
+HEADINGS = dict(zip(COLUMNS, ROW_HEADINGS))
+EXPORT_CHUNK = 1000 # rows read from the database at a time by export
+BACKUP_TIME = '%Y-%m-%dT%H%M%S'
+# backups made within the same second are numbered from 1
+BACKUP_NAME = re.compile(
+    r'^odds-(\d{4}-\d\d-\d\dT\d{6})(?:-(\d+))?\.sqlite(\.gz)?$')
+BACKUP_PAGES = 256 # database pages copied in each step of a backup
+BACKUP_SLEEP = 0.005 # seconds between steps, for writers to get in
+KEEP_DAILY = 7 # backups kept by prune: one for each of this many days
+KEEP_WEEKLY = 8 # and one for each of this many weeks
 
-# FUNCTIONS
+log = logging.getLogger(__name__)
+
+# CLASSES
+
+
+class Writer:
+
+    def __init__(self, path=DB_SUB_PATH):
+        """ Hold one connection to the database for a whole update, so that
+        fixtures, odds and results are written in a single transaction. Each
+        write returns a summary of the rows inserted, updated and skipped;
+        the summaries for all writes are kept in the summary attribute.
+        Nothing is saved until commit is called. Every row changed in the
+        transaction is marked with its version, one more than the last.
+        Values are compared with those stored first, and only fixtures
+        whose time, odds or result have changed are written; these are
+        counted as unchanged, and among those skipped, in each summary.
+        """
+        self.connection, self.c = _connect(path)
+        self.connection.isolation_level = None # transactions managed here
+        for pragma in PRAGMAS:
+            self.c.execute(pragma)
+        self.summary = {}
+        self.version = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.commit()
+        else:
+            self.rollback()
+        self.close()
+
+    def _begin(self):
+        if not self.connection.in_transaction:
+            self.c.execute('BEGIN')
+            self.version = self.c.execute(
+                'SELECT coalesce(max(modified), 0) + 1 '
+                'FROM odds').fetchone()[0]
+
+    def _versioned(self, rows):
+        """ Put the version of the transaction in front of each row.
+        """
+        self._begin()
+        version = (self.version,)
+        return [version + row for row in rows]
 
+    def _stored(self, uids):
+        """ Return what is stored of each fixture in uids, as a dictionary
+        of uid to (date, time, home odds, draw odds, away odds, home score,
+        away score, result).
+        """
+        self._begin() # read within the transaction, as the writes will be
+        uids = list(set(uids))
+        stored = {}
+        for start in range(0, len(uids), STORED_CHUNK):
+            chunk = uids[start:start+STORED_CHUNK]
+            query = STORED.format(', '.join('?'*len(chunk)))
+            for row in self.c.execute(query, chunk):
+                stored[row[0]] = row[1:]
+        return stored
 
-def _connect():
-    if not os.path.isdir(DB_SUB_DIR): # create folder for database
-        os.mkdir(DB_SUB_DIR) # if it doesn't exist
-    if os.path.exists(DB_SUB_PATH): # connection to the database, if it exists
-        connection = sqlite3.connect(DB_SUB_PATH)
+    def _apply(self, statement, rows, *more):
+        """ Run a statement once for each row, and then any more pairs of
+        statements and rows, inside a savepoint so that a failure part way
+        through leaves the transaction as it was. Return the number of rows
+        changed by the first statement.
+        """
+        self._begin()
+        self.c.execute('SAVEPOINT apply')
         try:
-            c = connection.cursor()
-        except sqlite3.Error as e:
-            print('Could not open database. More details: {}'.format(e))
-        return connection, c
-    else:
-        # otherwise create new database
-        connection = sqlite3.connect(DB_SUB_PATH)
+            self.c.executemany(statement, rows)
+            changed = self.c.rowcount
+            for num in range(0, len(more), 2):
+                self.c.executemany(more[num], more[num+1])
+        except sqlite3.Error:
+            self.c.execute('ROLLBACK TO apply')
+            self.c.execute('RELEASE apply')
+            raise
+        self.c.execute('RELEASE apply')
+        return max(changed, 0)
+
+    def enter_fixtures(self, entries, reschedule=True):
+        """ Add new fixtures, from a FixtureBatch or an iterable of Fixtures,
+        to the database, and move those which already exist to their new date
+        and time if they have been rescheduled. Fixtures which already exist
+        at the same time, or which have no date, are skipped. If reschedule
+        is False, fixtures which already exist are left as they are, as for
+        results, which have no kick-off time.
+        """
+        batch = FixtureBatch.from_fixtures(entries)
+        rows = batch.basic_rows()
+        stored = self._stored(row[0] for row in rows)
+        new = [row for row in rows if row[0] not in stored]
+        moved = [(row[4], row[5], row[0]) for row in rows if reschedule
+                 and row[0] in stored and stored[row[0]][:2] != row[4:6]]
+        inserted = self._apply(FIELDS, self._versioned(new))
+        rescheduled = self._apply(RESCHEDULE, self._versioned(moved))
+        summary = {'inserted': inserted, 'rescheduled': rescheduled,
+                   'unchanged': len(rows) - len(new) - len(moved),
+                   'skipped': len(batch) - inserted - rescheduled}
+        self.summary['fixtures'] = summary
+        return summary
+
+    def update_odds(self, entries, captured=None):
+        """ Update the odds of fixtures in the database, which always hold
+        the latest prices, and add them to the history of prices in the
+        odds_snapshots table under the time they were captured, by default
+        now. Fixtures without odds, which are not in the database, or whose
+        odds have not changed, are skipped, so the history holds each change
+        of price.
+        """
+        batch = FixtureBatch.from_fixtures(entries)
+        rows = batch.odds_rows()
+        stored = self._stored(row[3] for row in rows)
+        changed = [row for row in rows
+                   if row[3] in stored and stored[row[3]][2:5] != row[:3]]
+        if captured is None:
+            captured = datetime.datetime.now().replace(microsecond=0)
+        captured = str(captured)
+        snapshots = [(captured,) + row for row in changed]
+        updated = self._apply(ODDS, self._versioned(
+            _stamped(changed, captured)), SNAPSHOT, snapshots)
+        summary = {'updated': updated,
+                   'unchanged': len(rows) - len(changed) - sum(
+                       row[3] not in stored for row in rows),
+                   'skipped': len(batch) - updated}
+        self.summary['odds'] = summary
+        return summary
+
+    def record_odds(self, entries, captured):
+        """ Add odds captured at a time in the past, such as from an
+        archived page, to the history of prices. The latest prices in the
+        odds table are only replaced for fixtures with no snapshot newer
+        than captured, so loading old pages never overwrites newer prices.
+        Fixtures without odds, or which are not in the database, are
+        skipped.
+        """
+        batch = FixtureBatch.from_fixtures(entries)
+        rows = batch.odds_rows()
+        stored = self._stored(row[3] for row in rows)
+        rows = [row for row in rows if row[3] in stored]
+        uids = list(set(row[3] for row in rows))
+        latest = {}
+        for start in range(0, len(uids), STORED_CHUNK):
+            chunk = uids[start:start+STORED_CHUNK]
+            query = LATEST.format(', '.join('?'*len(chunk)))
+            latest.update(self.c.execute(query, chunk))
+        captured = str(captured)
+        newer = [row for row in rows if latest.get(row[3], '') < captured
+                 and stored[row[3]][2:5] != row[:3]]
+        snapshots = [(captured,) + row for row in rows]
+        self._apply(SNAPSHOT, snapshots)
+        updated = self._apply(ODDS, self._versioned(
+            _stamped(newer, captured)))
+        summary = {'recorded': len(snapshots), 'updated': updated,
+                   'skipped': len(batch) - len(snapshots)}
+        self.summary['odds'] = summary
+        return summary
+
+    def update_results(self, entries):
+        """ Update the scores of fixtures in the database. Fixtures without
+        scores, which are not in the database, or whose scores have not
+        changed, are skipped.
+        """
+        batch = FixtureBatch.from_fixtures(entries)
+        rows = batch.result_rows()
+        stored = self._stored(row[3] for row in rows)
+        changed = [row for row in rows
+                   if row[3] in stored and stored[row[3]][5:8] != row[:3]]
+        updated = self._apply(SCORES, self._versioned(changed))
+        summary = {'updated': updated,
+                   'unchanged': len(rows) - len(changed) - sum(
+                       row[3] not in stored for row in rows),
+                   'skipped': len(batch) - updated}
+        self.summary['results'] = summary
+        return summary
+
+    def update_bookmaker_odds(self, prices, captured=None):
+        """ Add the price of every bookmaker, as (uid, bookmaker, outcome,
+        price), to the bookmaker_odds table under the time they were
+        captured, by default now, and set the best and consensus prices of
+        each fixture from them. Prices of fixtures which are not in the
+        database are skipped.
+        """
+        prices = list(prices)
+        stored = self._stored(p[0] for p in prices)
+        if captured is None:
+            captured = datetime.datetime.now().replace(microsecond=0)
+        captured = str(captured)
+        rows = [p + (captured,) for p in prices if p[0] in stored]
+        derived = [values + (uid,) for uid, values in
+                   sorted(_derived(rows).items())]
+        inserted = self._apply(PRICE, rows, BEST, self._versioned(derived))
+        summary = {'inserted': inserted, 'updated': len(derived),
+                   'skipped': len(prices) - len(rows)}
+        self.summary['bookmakers'] = summary
+        return summary
+
+    def commit(self):
+        """ Save all writes made so far and return their summary. The
+        connection stays open for the next transaction.
+        """
+        if self.connection.in_transaction:
+            self.c.execute('COMMIT')
+        summary, self.summary = self.summary, {}
+        return summary
+
+    def rollback(self):
+        if self.connection.in_transaction:
+            self.c.execute('ROLLBACK')
+
+    def close(self):
+        self.connection.close()
+
+# FUNCTIONS
+
+
+def _stamped(rows, captured):
+    """ Return odds rows of (home, draw, away, uid) as (home, draw, away,
+    time stamp, uid), stamped with the day the odds were captured.
+    """
+    stamp = captured[:10]
+    return [row[:3] + (stamp, row[3]) for row in rows]
+
+
+def _connect(path=DB_SUB_PATH):
+    folder = os.path.dirname(path)
+    if folder and not os.path.isdir(folder): # create folder for database
+        os.makedirs(folder) # if it doesn't exist
+    connection = sqlite3.connect(path)
+    try:
         c = connection.cursor()
-        # and the main table
-        c.execute(
-            'CREATE TABLE odds (id INTEGER PRIMARY KEY, '
-            'uid TEXT UNIQUE NOT NULL, home TEXT NOT NULL, '
-            'away TEXT NOT NULL, timestamp TEXT, date TEXT, time TEXT, '
-            'home_odds REAL, draw_odds REAl, away_odds REAL, '
-            'home_score REAL, away_score REAL, result TEXT)')
-        return connection, c
-
-
-def _next_key(cursor):
-    """ Return ID of last row entered.
-    """
-    cursor.execute('SELECT max(id) FROM odds')
-    result = cursor.fetchone()[0]
-    if result is None:
-        return 0
-    else:
-        return result+1
-
-
-def enter_fixtures(entries):
-    connection, c = _connect() # initialise connection
-    if not c:
-        raise RuntimeError
-    key = _next_key(c) # next available primary key
-    existent = []
-    for f in entries:
-        data = (key,) + f.basic_info() + f.time_info()
-        key += 1 # increment the key for the next entry
-        try: # create new information, using instruction above
-            c.execute(FIELDS, data)
-        except sqlite3.IntegrityError:
-            existent.append(f) # if a duplicate, keep track but continue
-        except sqlite3.OperationalError as e:
-            print('Operation failed - try again: {}'.format(e))
-            raise # for other errors, abort and display error information
-    if len(existent) and len(existent) <= 10: # print fixtures that already exist
-        f = '\n'.join([e.uid for e in existent])
-        print('The following already exist in the table:\n{}'.format(f))
-        if len(existent) == 10:
-            print('It appears that you have already captured data from'
-                  ' this week.\n')
-    elif len(existent) > 10:
-        print('There were {} fixtures which could not be added to the '
-              'database because they already exist.'.format(len(existent)))
-    connection.commit() # close database
-    connection.close()
+    except sqlite3.Error as e:
+        log.error('Could not open database. More details: %s', e)
+        raise
+    # set up the schema once, for a new database or one made by an earlier
+    # version, so that opening a database to read it never writes to it
+    if c.execute('PRAGMA user_version').fetchone()[0] < SCHEMA:
+        _create(c)
+        connection.commit()
     return connection, c
 
 
-def update_odds(entries):
-    """ Create entries in the database with the fixture information and the
-    odds. If a fixture has no odds, add it to the database anyway.
-    """
-    connection, c = _connect() # initialise connection
-    if not c:
-        raise RuntimeError
-    no_odds = []
-    for f in entries:
-        try: # get information from fixture
-            timestamp = str(datetime.date.today())
-            update = f.odds_info() + (timestamp, f.uid) 
-        except AttributeError: # if there are no odds, continue but keep track
-            no_odds.append(f)
-        # try and update odds for the fixture
-        try:
-            c.execute('UPDATE odds SET home_odds = ?, draw_odds = ?, '
-                      'away_odds = ?, timestamp = ? WHERE uid = ?', update)
-        except sqlite3.OperationalError:
-            if f not in no_odds:
-                no_odds.append(f)
-        except sqlite3.OperationalError as e:
-            print('Operation failed - try again: {}'.format(e))
-            raise # for other errors, abort and display error information
-    if len(no_odds) and len(no_odds) <= 10: # print fixture without odds
-        f = '\n'.join([e.uid for e in no_odds])
-        print('No odds were present for the following:\n{}'.format(f))
-        print('These fixtures were still added to the database.\n')
-    elif len(no_odds) > 10:
-        print('There were {} fixtures without odds. These fixtures were '
-              'processed anyway.'.format(len(no_odds)))
-    connection.commit() # close database
-    connection.close()
-    return connection, c
+def _create(c):
+    """ Create the tables, indexes and triggers, adding any columns missing
+    from an earlier version, and record the version of the schema.
+    """
+    c.execute(TABLE)
+    _migrate(c)
+    c.execute(MODIFIED)
+    for index in INDEXES:
+        c.execute(index)
+    c.execute(SNAPSHOTS)
+    c.execute(BOOKMAKER_ODDS)
+    c.execute(DIRTY)
+    for trigger in TRIGGERS:
+        c.execute(trigger)
+    for table in ANALYTICS:
+        c.execute(table)
+    c.execute('PRAGMA user_version = {:d}'.format(SCHEMA))
+
+
+def _derived(rows):
+    """ Return the best price and the consensus price of each outcome, as
+    (best H, D, A, consensus H, D, A) by uid, from rows of (uid, bookmaker,
+    outcome, price, ...). The consensus is the price at the mean of the
+    probabilities implied by the bookmakers' prices. Outcomes without a
+    price are None.
+    """
+    found = {}
+    for row in rows:
+        found.setdefault(row[0], {}).setdefault(row[2], []).append(row[3])
+    derived = {}
+    for uid, outcomes in found.items():
+        best, consensus = [], []
+        for outcome in 'HDA':
+            values = outcomes.get(outcome)
+            if not values:
+                best.append(None)
+                consensus.append(None)
+                continue
+            implied = sum(1 / (1 + v) for v in values) / len(values)
+            best.append(max(values))
+            consensus.append(round(1 / implied - 1, _ODDS_DP))
+        derived[uid] = tuple(best + consensus)
+    return derived
 
 
-def update_results(entries):
+def _migrate(c):
+    """ Add any columns missing from a database made by an earlier version.
+    """
+    names = [row[1] for row in c.execute('PRAGMA table_info(odds)')]
+    if 'modified' not in names:
+        c.execute('ALTER TABLE odds ADD COLUMN modified INTEGER DEFAULT 0')
+    for name in DERIVED:
+        if name not in names:
+            c.execute('ALTER TABLE odds ADD COLUMN {} REAL'.format(name))
+
+
+def enter_fixtures(entries, path=DB_SUB_PATH):
+    """ Add new fixtures to the database and return a summary of the rows
+    inserted and skipped.
+    """
+    with Writer(path) as w:
+        return w.enter_fixtures(entries)
+
+
+def update_odds(entries, path=DB_SUB_PATH):
+    """ Update the odds of fixtures already in the database and return a
+    summary of the rows updated and skipped.
+    """
+    with Writer(path) as w:
+        return w.update_odds(entries)
+
+
+def update_results(entries, path=DB_SUB_PATH):
     """ For any fixture that exists in the database, update the results from
     a container. If the a fixture in the container does not match a result in
-    the database, no change is made.
-    """
-    connection, c = _connect() # initialise connection to database
-    if not c:
-        raise RuntimeError
-    errors, db_error = [], [] # lists to hold cases where errors occur
-    for f in entries:
-        try: # get information from fixture
-            data = f.result_info() + (f.uid,)
-        except AttributeError: # keep track of problems in retrieving results
-            errors.append(f)
-            continue # don't update the database where results were found
-        try: # update database with result
-            c.execute('UPDATE odds SET home_score = ?, away_score = ?, '
-                      'result = ? WHERE uid = ?', data)
-        except (sqlite3.IntegrityError, sqlite3.OperationalError):
-            db_error.append(f) # keep track of database problems
-    if len(errors): # print fixtures without scores
-        f = '\n'.join([e.uid for e in errors])
-        print('No scores were present for the following:\n{}'.format(f))
-        print('These fixtures were not added to the database.\n')
-    if len(db_error): # print other errors
-        f = '\n'.join([e.uid for e in errors])
-        print('The following could not be added to the database:\n{}'.format(f)
-              )
-        print('These fixtures were not added to the database.\n')
-    connection.commit() # close database
-    connection.close()
-    return connection, c
+    the database, no change is made. Returns a summary of the rows updated and
+    skipped.
+    """
+    with Writer(path) as w:
+        return w.update_results(entries)
 
 
-def export(path, overwrite=False):
-    """ Download entire database and save as CSV at the specified location.
+def odds_history(uid, since='', until='9999', path=DB_SUB_PATH):
+    """ Return every price captured for a fixture, optionally between two
+    times given as text such as '2016-09-10 12:00', as a list of
+    (captured_at, home, draw, away) in time order.
     """
-    if not overwrite and os.path.isfile(path): # open file if it exists
+    connection, c = _connect(path)
+    try:
+        return c.execute(HISTORY, (uid, since, until)).fetchall()
+    finally:
+        connection.close()
+
+
+def bookmaker_odds(uid, path=DB_SUB_PATH):
+    """ Return the latest price of every bookmaker for a fixture, as a list
+    of (bookmaker, outcome, price) by outcome and bookmaker.
+    """
+    connection, c = _connect(path)
+    try:
+        return c.execute(PRICES, (uid, uid)).fetchall()
+    finally:
+        connection.close()
+
+
+def _export_query(start, end, team, columns):
+    """ Build the query for an export, with its filters and parameters.
+    """
+    if columns is None:
+        columns = COLUMNS
+    unknown = [name for name in columns if name not in COLUMNS]
+    if unknown:
+        raise ValueError('Unknown columns: {}'.format(', '.join(unknown)))
+    conditions, parameters = [], []
+    if start is not None:
+        conditions.append('date >= ?')
+        parameters.append(str(start))
+    if end is not None:
+        conditions.append('date <= ?')
+        parameters.append(str(end))
+    if team is not None:
+        conditions.append('(home = ? COLLATE NOCASE OR '
+                          'away = ? COLLATE NOCASE)')
+        parameters.extend([team, team])
+    query = 'SELECT {} FROM odds'.format(', '.join(columns))
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return query + ' ORDER BY id', parameters, columns
+
+
+def export(path, overwrite=False, start=None, end=None, team=None,
+           columns=None, compress=False, chunk=EXPORT_CHUNK,
+           database=DB_SUB_PATH):
+    """ Save the database as CSV at the specified location, which may be a
+    path, '-' for standard output, or an open file. Rows are streamed from
+    the database a chunk at a time, so memory use does not grow with the
+    table. Only fixtures dated between start and end, and involving team,
+    are exported, if given; columns is a list of column names of the odds
+    table. The file is compressed with gzip if compress is set or the path
+    ends in '.gz'; a compressed open file must be binary, or a text file
+    with a binary buffer, such as standard output. Returns the number of
+    rows written.
+    """
+    query, parameters, columns = _export_query(start, end, team, columns)
+    close = isinstance(path, str) and path != '-'
+    if not close and compress: # compress a stream as it is written
+        stream = sys.stdout if path == '-' else path
+        if isinstance(stream, io.TextIOBase):
+            stream.flush()
+            stream = getattr(stream, 'buffer', None)
+            if stream is None:
+                raise ValueError('Cannot compress to a text file')
+        f = io.TextIOWrapper(gzip.GzipFile(fileobj=stream, mode='wb'),
+                             encoding='utf-8', newline='')
+        close = True # ends the gzip stream, but leaves the file open
+    elif path == '-':
+        f = sys.stdout
+    elif not close:
+        f = path # an open file
+    elif not overwrite and os.path.isfile(path): # open file if it exists
         raise FileExistsError('File already exists: {}'.format(path))
     else: # otherwise create a file
         try:
-            f = open(path, 'w')
+            if compress or path.endswith('.gz'):
+                f = gzip.open(path, 'wt', newline='')
+            else:
+                f = open(path, 'w', newline='')
         except Exception as e:
-            print('Could not create CSV file. More details: {}'.format(e))
-    connection, c = _connect()
-    if not c:
-        raise RuntimeError
-    data = c.execute('SELECT * FROM odds').fetchall() # download all records
-    n = sum([len(row) for row in data]) # get number or records
-    writer = csv.writer(f)
-    writer.writerow(ROW_HEADINGS)
-    for line in data: # write data to csv file
-        writer.writerow(line)
-    f.close()
+            log.error('Could not create CSV file. More details: %s', e)
+            raise
+    connection, c = _connect(database)
+    n = 0
+    try:
+        writer = csv.writer(f)
+        writer.writerow([HEADINGS[name] for name in columns])
+        c.execute(query, parameters)
+        rows = c.fetchmany(chunk)
+        while rows: # write data to csv file
+            writer.writerows(rows)
+            n += len(rows)
+            rows = c.fetchmany(chunk)
+    finally:
+        connection.close()
+        if close:
+            f.close()
     return n
 
 
-def backup():
-    """ Create a dated copy of the database.
-    """
-    today = str(datetime.date.today())
-    # file path with date
-    trial_path = DB_BACKUP_SUB_PATH + 'odds-{}.sqlite'
-    addition = today
-    path = trial_path.format(addition) # path containing the date
-    c = 0 # counter for modifying file name
-    while os.path.isfile(path):
-        c += 1 # increment file name
-        addition = today + '-' + str(c) # new addition to path
-        path = trial_path.format(addition) # path with date and number
-        if c >= MAX_SAVES:
-            raise RuntimeError('too many backup attempts')
-    dest = open(path, 'wb')
-    source = open(DB_SUB_PATH, 'rb')
-    dest.write(source.read())
-    source.close()
-    dest.close()
+def _backups(folder):
+    """ Return (time, path) for each backup in a folder, oldest first.
+    """
+    found = []
+    for name in os.listdir(folder):
+        match = BACKUP_NAME.match(name)
+        if match:
+            stamp = datetime.datetime.strptime(match.group(1), BACKUP_TIME)
+            found.append((stamp, int(match.group(2) or 0),
+                          os.path.join(folder, name)))
+    return [(stamp, path) for stamp, num, path in sorted(found)]
+
+
+def _backup_path(folder, stamp):
+    """ Return the path, without .gz, for a backup made at stamp which no
+    other backup has. Backups made within the same second are numbered
+    after the latest, so they still sort in the order they were made.
+    """
+    taken = [int(match.group(2) or 0) for match in
+             map(BACKUP_NAME.match, os.listdir(folder))
+             if match and match.group(1) == stamp]
+    if not taken:
+        return os.path.join(folder, 'odds-{}.sqlite'.format(stamp))
+    return os.path.join(folder, 'odds-{0}-{1}.sqlite'.format(
+        stamp, max(taken) + 1))
+
+
+def _integrity(path):
+    """ Return the result of SQLite's integrity check on a database.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        connection.close()
+
+
+def backup(folder=DB_BACKUP_SUB_PATH, compress=False, keep_daily=KEEP_DAILY,
+           keep_weekly=KEEP_WEEKLY, database=DB_SUB_PATH):
+    """ Create a timed copy of the database, and then prune old copies with
+    prune. Pages are copied a few at a time with SQLite's backup API, so the
+    database is never read into memory and writers are only held up briefly;
+    a write made part way through is copied too. The copy is compressed
+    with gzip if compress is set. An existing backup is never replaced.
+    Returns the path of the copy.
+    """
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    stamp = datetime.datetime.now().strftime(BACKUP_TIME)
+    path = _backup_path(folder, stamp)
+    partial = path + '.part'
+    source = sqlite3.connect(database)
+    dest = sqlite3.connect(partial)
+    try:
+        source.backup(dest, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP)
+    finally:
+        dest.close()
+        source.close()
+    try:
+        if compress:
+            path += '.gz'
+            with open(partial, 'rb') as f, gzip.open(path, 'xb') as target:
+                shutil.copyfileobj(f, target)
+        else:
+            os.link(partial, path) # fails, unlike a rename, if path exists
+    finally:
+        os.remove(partial)
+    prune(folder, keep_daily, keep_weekly)
     return path
+
+
+def prune(folder=DB_BACKUP_SUB_PATH, keep_daily=KEEP_DAILY,
+          keep_weekly=KEEP_WEEKLY):
+    """ Delete old backups, keeping the latest backup of each of the last
+    keep_daily days and of each of the last keep_weekly weeks on which
+    backups were made. Returns the paths deleted.
+    """
+    found = _backups(folder)
+    days, weeks, kept = [], [], set()
+    for stamp, path in reversed(found): # newest first
+        day, week = stamp.date(), stamp.isocalendar()[:2]
+        if day not in days and len(days) < keep_daily:
+            days.append(day)
+            kept.add(path)
+        if week not in weeks and len(weeks) < keep_weekly:
+            weeks.append(week)
+            kept.add(path)
+    removed = [path for stamp, path in found if path not in kept]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def restore(path, database=DB_SUB_PATH):
+    """ Replace the contents of the database with a backup, which may be
+    compressed. The backup is checked for integrity first, and the restored
+    database afterwards; RuntimeError is raised if either check fails.
+    """
+    source = path
+    if path.endswith('.gz'): # decompress to a temporary copy
+        handle, source = tempfile.mkstemp(suffix='.sqlite')
+        with os.fdopen(handle, 'wb') as target, gzip.open(path, 'rb') as f:
+            shutil.copyfileobj(f, target)
+    try:
+        result = _integrity(source)
+        if result != 'ok':
+            raise RuntimeError('Backup failed integrity check: '
+                               '{}'.format(result))
+        connection = sqlite3.connect(source)
+        dest = sqlite3.connect(database)
+        try:
+            connection.backup(dest, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP)
+        finally:
+            dest.close()
+            connection.close()
+    finally:
+        if source != path:
+            os.remove(source)
+    result = _integrity(database)
+    if result != 'ok':
+        raise RuntimeError('Restored database failed integrity check: '
+                           '{}'.format(result))
+    return database
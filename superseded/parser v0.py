@@ -0,0 +1,154 @@
+#!/usr/bin/env python3.5
+
+""" parser: a class for parsing the BBC Sports website.
+"""
+
+# built in modules
+import codecs
+from collections import deque
+from html.parser import HTMLParser 
+
+# CLASSES
+
+
+class BBCParser(HTMLParser):
+
+    def __init__(self, stream=False):
+        """ Parse fixtures and results from BBC Sport pages. Each match is
+        collected as a record of (home, away, date, kick-off, score) when its
+        table row closes, and can be taken with pop_matches while the page is
+        still being fed. Unless stream is set, the teams, dates, kick-offs and
+        scores are also kept in separate lists for the whole page.
+        """
+        super(BBCParser, self).__init__()
+        self.stream = stream
+        self.matches = deque()
+        self.row = [None] * 5
+        self.current_date = None
+        self.in_table = False
+        self.in_date = False
+        self.in_ko = False
+        self.in_score = [False, False]
+        self.in_home = [False, False]
+        self.in_away = [False, False]
+        self.div_count = 0
+        self.home = []
+        self.away = []
+        self.dates = []
+        self.ko = []
+        self.scores = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'div' and ('class', 'stats-body') in attrs:
+            self.in_table = True
+        elif tag == 'div':
+            self.div_count += 1
+        elif tag == 'h2' and ('class', 'table-header') in attrs:
+            self.in_date = True
+        elif tag == 'span' and ('class', 'team-home teams') in attrs:
+            self.in_home[0] = True
+        elif tag == 'a' and self.in_home[0]:
+            self.in_home[1] = True
+        elif tag == 'span' and ('class', 'team-away teams') in attrs:
+            self.in_away[0] = True
+        elif tag == 'a' and self.in_away[0]:
+            self.in_away[1] = True
+        elif tag == 'td' and self.in_table and ('class', 'kickoff') in attrs:
+            self.in_ko = True
+        elif tag == 'span' and ('class', 'score') in attrs:
+            self.in_score[0] = True
+        elif tag == 'abbr':
+            self.in_score[1] = True
+
+    def handle_endtag(self, tag):
+        if tag == 'div' and self.div_count == 0:
+            self.in_table = False
+        elif tag == 'div':
+            self.div_count -= 1
+        elif tag == 'h2':
+            self.in_date = False
+        elif tag == 'span' and any(self.in_home):
+            self.in_home = [False, False]
+        elif tag == 'span' and any(self.in_away):
+            self.in_away = [False, False]
+        elif tag == 'td' and self.in_ko:
+            self.in_ko = False
+        elif tag == 'abbr' and any(self.in_score):
+            self.in_score = [False, False]
+        elif tag == 'tr' and self.in_table:
+            if self.row[0] is not None and self.row[1] is not None:
+                self.matches.append(tuple(self.row))
+            self.row = [None] * 5
+
+    def handle_data(self, data):
+        data = data.strip().strip('\n').strip()
+        if self.in_table:
+            if self.in_date:
+                self.current_date = data
+                self.in_date = False
+            if all(self.in_home):
+                self.row[0], self.row[2] = data, self.current_date
+                self.in_home = [False, False]
+                if not self.stream:
+                    self.home.append(data)
+                    self.dates.append(self.current_date)
+            if all(self.in_away):
+                self.row[1] = data
+                self.in_away = [False, False]
+                if not self.stream:
+                    self.away.append(data)
+            if self.in_ko:
+                self.row[3] = data
+                if not self.stream:
+                    self.ko.append(data)
+            if all(self.in_score):
+                self.row[4] = data
+                self.in_score = [False, False]
+                if not self.stream:
+                    self.scores.append(data)
+
+    def pop_matches(self):
+        """ Yield, and forget, each match completed so far.
+        """
+        while self.matches:
+            yield self.matches.popleft()
+
+    def run_checks(self):
+        attrs = [self.dates, self.ko, self.scores]
+        if len(self.home) != len(self.away):
+            raise ValueError('Mismatch with home ({0}) and away ({1}) '
+                             'teams'.format(len(self.home), len(self.away)))
+        if len(self.dates) != len(self.home) and self.dates:
+                raise ValueError('Too few dates ({})'.format(len(self.dates)))
+        if len(self.ko) != len(self.home) and self.ko:
+                raise ValueError('Too few times ({})'.format(len(self.ko)))
+        if len(self.scores) != len(self.home) and self.scores:
+                raise ValueError('Too few scores ({})'.format(len(scores)))
+
+
+# FUNCTIONS
+
+
+def iter_matches(chunks):
+    """ Parse a BBC page from an iterable of chunks, as bytes or text, and
+    yield each match as (home, away, date, kick-off, score) as soon as its
+    row is complete. Only the unparsed end of the page is held in memory.
+    """
+    p = BBCParser(stream=True)
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    tail = ''
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        text = tail + chunk
+        # feed up to the last tag, so that no run of text is split in two
+        cut = text.rfind('<')
+        if cut < 0:
+            tail = text
+            continue
+        p.feed(text[:cut])
+        tail = text[cut:]
+        yield from p.pop_matches()
+    p.feed(tail + decoder.decode(b'', final=True))
+    p.close()
+    yield from p.pop_matches()
@@ -4,14 +4,95 @@
 """
 
 # built-in modules
+import io
+import gzip
+import sys
+import json
+import logging
+import sqlite3
+import subprocess
 import datetime
+import os.path
+import tempfile
+import threading
+import time
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# third-party modules
+import numpy as np
 
 # package modules
+import analytics
+import archive
+import backfill
+import arrays
+import backtest
+import cache
+import cli
+import competitions
+import convert
+import daemon
 import fixture
+import journal
+import main
+import metrics
+import parser
+import query
 import retrieve
+import standin
 import store
 import definitions
 
+# CONSTANTS
+BBC_PAGE = (
+    '<html><body><div class="stats-body">'
+    '<h2 class="table-header">Saturday 10th September 2016</h2>'
+    '<table><tbody><tr><td class="match-details"><p>'
+    '<span class="team-home teams"><a href="#">Man Utd</a></span>'
+    '<span class="score"><abbr title="Score">1-2</abbr></span>'
+    '<span class="team-away teams"><a href="#">Man City</a></span>'
+    '</p></td><td class="kickoff">12:30</td></tr>'
+    '<tr><td class="match-details"><p>'
+    '<span class="team-home teams"><a href="#">Arsenal</a></span>'
+    '<span class="score"><abbr title="Score">2-1</abbr></span>'
+    '<span class="team-away teams"><a href="#">Southampton</a></span>'
+    '</p></td><td class="kickoff">15:00</td></tr>'
+    '</tbody></table></div></body></html>'
+    )
+
+
+class _PageHandler(BaseHTTPRequestHandler):
+    """ Serve BBC_PAGE at every path, standing in for the live websites.
+    """
+
+    etag = '"bbc-page"' # sent with each page, unless set to None
+
+    def do_GET(self):
+        body = BBC_PAGE.encode('utf-8')
+        if self.etag and self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if self.etag:
+            self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve():
+    """ Start a local server in the background and return it.
+    """
+    server = HTTPServer(('127.0.0.1', 0), _PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
 
 def test_fixture():
     """ Test the Fixture class.
@@ -40,9 +121,62 @@ def test_fixture():
     return
 
 
+def test_fixture_batch():
+    print('Testing FixtureBatch class')
+    fixtures = retrieve.get_fixtures(body=BBC_PAGE)
+    fixtures[0].set_odds('8/11', '5/2', '4/1')
+    fixtures[1].set_result('2-1')
+    batch = fixture.FixtureBatch.from_fixtures(fixtures)
+    try:
+        assert not hasattr(fixtures[1], '__dict__')
+        assert fixtures[1].odds_info() == (None, None, None)
+        assert not fixtures[1].has_odds() and fixtures[1].has_result()
+        assert len(batch) == 2 and batch.teams[batch.home[1]] == 'Arsenal'
+        assert batch.odds_rows() == [(0.72727, 2.5, 4.0, 'MUN-MCI-2016')]
+        assert batch.result_rows() == [(2, 1, 'H', 'ARS-SOU-2016')]
+        assert batch.basic_rows()[1] == fixtures[1].basic_info() + \
+            fixtures[1].time_info()
+    except AssertionError:
+        print(batch.odds_rows(), batch.result_rows(), batch.basic_rows())
+        raise
+    row = (0, 'ARS-SOU-2016', 'Arsenal', 'Southampton', '2016-09-10',
+           '2016-09-10', '15:00:00', None, None, None, 2.0, 1.0, 'H')
+    f = next(iter(fixture.FixtureBatch.from_rows([row])))
+    try:
+        assert f.basic_info() + f.time_info() == row[1:7]
+        assert f.result_info() == (2, 1, 'H') and not f.has_odds()
+    except AssertionError:
+        print(f.basic_info(), f.time_info(), f.result_info())
+        raise
+    return
+
+
+def test_odds_array():
+    print('Testing batch odds conversion')
+    odds = ['8/11', 'EVS', '(5/2)', '4/1', 'N/A', '8/11']
+    values, mask = convert.odds_array(odds, columns=3)
+    try:
+        assert values.shape == mask.shape == (2, 3)
+        assert mask.tolist() == [[True, True, True], [True, False, True]]
+        assert values[0].tolist() == [0.72727, 1.0, 2.5]
+        assert values[1, 0] == 4.0 and values[1, 2] == 0.72727
+    except AssertionError:
+        print(values, mask)
+        raise
+    f = fixture.Fixture('Arsenal', 'Tottenham')
+    try:
+        assert f.set_odds(*values[0]).odds_info() == (0.72727, 1.0, 2.5)
+        assert not f.set_odds(*values[1]).has_odds()
+    except AssertionError:
+        print(f.odds_info())
+        raise
+    return
+
+
 def test_retrieve_odds():
     print('Testing odds retrieval')
-    r = retrieve.get_odds()
+    with standin.StandIn() as server:
+        r = retrieve.get_odds(url=server.url('/odds'))
     try:
         assert all([type(f) == fixture.Fixture for f in r])
         assert r != []
@@ -59,7 +193,8 @@ def test_retrieve_odds():
 
 def test_retrieve_results():
     print('Testing results retrieval')
-    r = retrieve.get_results()
+    with standin.StandIn() as server:
+        r = retrieve.get_results(url=server.url('/results'))
     try:
         assert all([type(f) == fixture.Fixture for f in r])
         assert r != []
@@ -74,18 +209,896 @@ def test_retrieve_results():
     return
 
 
+def test_standin():
+    print('Testing stand-in server')
+    pages = standin.recorded(scale=10)
+    fixtures = retrieve.get_fixtures(body=pages['/fixtures'])
+    try:
+        assert len(fixtures) == 10*len(retrieve.get_fixtures(
+            body=standin.recorded()['/fixtures']))
+        assert fixtures[-1].date.year == fixtures[0].date.year + 9
+        assert len(retrieve.get_odds(body=pages['/odds'])) == 200
+    except AssertionError:
+        print(len(fixtures), fixtures[0].date, fixtures[-1].date)
+        raise
+    with standin.StandIn(errors=1.0, latency=0.05) as server:
+        start = time.time()
+        url, body, error = next(retrieve.fetch_all([server.url('/odds')]))
+        elapsed = time.time() - start
+    try:
+        assert body is None and error.response.status_code == standin.ERROR
+        assert elapsed >= 0.05 and server.requests == 1
+    except AssertionError:
+        print(body, error, elapsed)
+        raise
+    return
+
+
+def test_iter_matches():
+    print('Testing streamed parsing')
+    page = BBC_PAGE.encode('utf-8')
+    fed = []
+    def chunks(size=7):
+        for i in range(0, len(page), size):
+            fed.append(i)
+            yield page[i:i+size]
+    matches = parser.iter_matches(chunks())
+    first = next(matches)
+    try:
+        assert first == ('Man Utd', 'Man City',
+                         'Saturday 10th September 2016', '12:30', '1-2')
+        assert len(fed) < len(page) / 7 # yielded before the page ended
+        assert list(matches) == [('Arsenal', 'Southampton',
+                                  'Saturday 10th September 2016', '15:00',
+                                  '2-1')]
+    except AssertionError:
+        print(first, len(fed))
+        raise
+    # both parsers read the recorded pages alike
+    for path, body in standin.recorded().items():
+        if path == '/odds':
+            continue
+        found = [list(parser.iter_matches([body], cls))
+                 for cls in (parser.BBCParser, parser.LxmlBBCParser)]
+        try:
+            assert len(found[0]) == 80 and found[0] == found[1]
+        except AssertionError:
+            print(path, found)
+            raise
+    return
+
+
+def test_fetch_all():
+    print('Testing concurrent fetching')
+    server = _serve()
+    base = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    urls = [base + 'fixtures', base + 'results']
+    try:
+        pages = {url: body for url, body, error in retrieve.fetch_all(urls)}
+    finally:
+        server.shutdown()
+    try:
+        assert sorted(pages) == sorted(urls)
+        assert all(body == BBC_PAGE.encode('utf-8') for body in pages.values())
+    except AssertionError:
+        print('Pages not downloaded: {}'.format(pages))
+        raise
+    r = retrieve.get_fixtures(body=pages[urls[0]])
+    try:
+        assert [f.uid for f in r] == ['MUN-MCI-2016', 'ARS-SOU-2016']
+        assert r[0].time_info() == ('2016-09-10', '12:30:00')
+    except AssertionError:
+        print('Fixtures not parsed: {}'.format(r))
+        raise
+    return
+
+
+def test_competitions():
+    print('Testing competition registry')
+    championship = competitions.get('championship')
+    try:
+        competitions.get('serie-a')
+        unknown = None
+    except KeyError as e:
+        unknown = str(e)
+    f = fixture.Fixture('Nottingham Forest', 'Sheff Wed')
+    alias = fixture.Fixture('nottm forest', 'Sheffield Wednesday')
+    try:
+        assert f.uid == alias.uid
+        assert f.uid == 'NFO-SHW' and f.home == 'Nottingham Forest'
+        assert 'Wolverhampton Wanderers' in championship
+        assert 'Arsenal' not in championship
+        assert 'serie-a' in unknown and 'championship' in unknown
+        assert competitions.team_code('Spurs') == 'TOT'
+        assert competitions.team_code('Celtic') is None
+        assert retrieve.BBC_FIXT == competitions.PREMIER_LEAGUE.fixtures_url
+        assert championship.urls()['odds'].endswith('english/championship')
+    except AssertionError:
+        print(f.uid, championship.urls(), unknown)
+        raise
+    try:
+        fixture.Fixture('Celtic', 'Rangers')
+    except ValueError:
+        pass
+    else:
+        print('Unknown teams accepted')
+        raise AssertionError
+    return
+
+
+class _SlowHandler(_PageHandler):
+    """ Serve BBC_PAGE slowly, counting the requests served at once.
+    """
+
+    lock = threading.Lock()
+    running = peak = 0
+
+    def do_GET(self):
+        cls = _SlowHandler
+        with cls.lock:
+            cls.running += 1
+            cls.peak = max(cls.peak, cls.running)
+        time.sleep(0.05)
+        with cls.lock:
+            cls.running -= 1
+        _PageHandler.do_GET(self)
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def test_host_limits():
+    print('Testing downloads at once from one host')
+    server = _ThreadingServer(('127.0.0.1', 0), _SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = '127.0.0.1:{}'.format(server.server_address[1])
+    urls = ['http://{0}/page{1}'.format(host, n) for n in range(6)]
+    retrieve.HOST_LIMITS[host] = 2
+    try:
+        pages = list(retrieve.fetch_all(urls))
+    finally:
+        del retrieve.HOST_LIMITS[host]
+        server.shutdown()
+    try:
+        assert len(pages) == 6 and all(e is None for u, b, e in pages)
+        assert _SlowHandler.peak == 2
+    except AssertionError:
+        print(pages, _SlowHandler.peak)
+        raise
+    return
+
+
+def test_metrics():
+    print('Testing update metrics')
+    m = metrics.Metrics()
+    previous = metrics.use(m)
+    try:
+        with standin.StandIn() as server, \
+                tempfile.TemporaryDirectory() as folder:
+            main.update(os.path.join(folder, 'odds.sqlite'),
+                        competitions=[server.competition()])
+            m.write(os.path.join(folder, 'metrics.prom'))
+            m.write(os.path.join(folder, 'metrics.jsonl'))
+            with open(os.path.join(folder, 'metrics.prom')) as f:
+                text = f.read()
+            with open(os.path.join(folder, 'metrics.jsonl')) as f:
+                line = json.loads(f.readline())
+    finally:
+        metrics.use(previous)
+    counters = {(c['name'], c.get('table'), c.get('action')): c['value']
+                for c in line['counters'] if 'source' not in c}
+    try:
+        assert metrics.current() is metrics.NULL
+        assert set(line['stages']) >= {'fetch', 'parse', 'convert', 'store'}
+        assert line['stages']['fetch']['calls'] == 3
+        assert counters[('pages', None, None)] == 3
+        assert counters[('db_rows', 'fixtures', 'inserted')] == 71
+        assert 'oddscollector_stage_calls_total{stage="fetch"} 3' in text
+        assert 'oddscollector_fixtures_total{competition="premier-league",' \
+            'source="results"} 80' in text
+    except AssertionError:
+        print(text, line)
+        raise
+    record = logging.LogRecord('main', logging.WARNING, __file__, 1,
+                               'Could not get %s', ('odds',), None)
+    record.competition = 'premier-league'
+    entry = json.loads(metrics.JsonFormatter().format(record))
+    try:
+        assert entry['message'] == 'Could not get odds'
+        assert entry['competition'] == 'premier-league'
+        assert entry['level'] == 'WARNING'
+    except AssertionError:
+        print(entry)
+        raise
+    return
+
+
+def test_page_cache():
+    print('Testing conditional requests')
+    server = _serve()
+    url = 'http://127.0.0.1:{}/fixtures'.format(server.server_address[1])
+    bodies = []
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            pages = cache.PageCache(folder)
+            bodies.append(retrieve.fetch(url, cache=pages))
+            bodies.append(retrieve.fetch(url, cache=pages)) # not committed
+            pages.commit()
+            bodies.append(retrieve.fetch(url, cache=pages)) # 304
+            _PageHandler.etag = None
+            bodies.append(retrieve.fetch(url, cache=pages)) # same hash
+            cached = pages.load(url)
+    finally:
+        _PageHandler.etag = '"bbc-page"'
+        server.shutdown()
+    # a page which cannot be parsed is not cached, so it is parsed again
+    recorded = standin.recorded()
+    recorded['/results'] = recorded['/results'].replace(b'Chelsea',
+                                                        b'Real Madrid')
+    with standin.StandIn(recorded) as server, \
+            tempfile.TemporaryDirectory() as folder:
+        pages = cache.PageCache(os.path.join(folder, 'html'))
+        competition = server.competition()
+        main.update(os.path.join(folder, 'odds.sqlite'), pages,
+                    [competition], ['fixtures', 'results'])
+        kept = [pages.load(competition.fixtures_url) is not None,
+                pages.load(competition.results_url) is not None]
+    page = BBC_PAGE.encode('utf-8')
+    try:
+        assert bodies == [page, page, None, None]
+        assert cached == page
+        assert kept == [True, False]
+    except AssertionError:
+        print(bodies, cached, kept)
+        raise
+    return
+
+
+def test_match_odds():
+    print('Testing odds matching')
+    fixtures = retrieve.get_fixtures(body=BBC_PAGE)
+    teams = ['Arsenal', 'Draw', 'Southampton', 'Celtic', 'Draw', 'Rangers',
+             'Man Utd', 'Draw', 'Man City']
+    odds = ['4/9', '10/3', '6/1', '1/2', '3/1', '5/1', '8/11', '5/2', '4/1']
+    unmatched = retrieve.match_odds(fixtures, teams, odds)
+    try:
+        assert unmatched == [('Celtic', 'Rangers')]
+        assert fixtures[0].odds_info() == (0.72727, 2.5, 4.0)
+        assert fixtures[1].odds_info() == (0.44444, 3.33333, 6.0)
+    except AssertionError:
+        print(unmatched, fixtures[0].odds_info(), fixtures[1].odds_info())
+        raise
+    # with two seasons of fixtures, odds go to the next meeting
+    seasons = retrieve.get_fixtures(body=standin.scale_page(BBC_PAGE, 2))
+    retrieve.match_odds(seasons, teams, odds, datetime.date(2016, 9, 1))
+    later = retrieve.get_fixtures(body=standin.scale_page(BBC_PAGE, 2))
+    retrieve.match_odds(later, teams, odds, datetime.date(2017, 1, 1))
+    found = [[f.uid for f in batch if f.home_odds is not None]
+             for batch in (seasons, later)]
+    try:
+        assert found == [['MUN-MCI-2016', 'ARS-SOU-2016'],
+                         ['MUN-MCI-2017', 'ARS-SOU-2017']]
+    except AssertionError:
+        print(found)
+        raise
+    return
+
+
+def test_writer():
+    print('Testing batched database writes')
+    fixtures = retrieve.get_fixtures(body=BBC_PAGE)
+    fixtures[0].set_odds('8/11', '5/2', '4/1')
+    results = retrieve.get_results(body=BBC_PAGE)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'odds.sqlite')
+        with store.Writer(path) as w:
+            first = w.enter_fixtures(fixtures)
+            again = w.enter_fixtures(fixtures)
+            odds = w.update_odds(fixtures)
+            scores = w.update_results(results)
+        connection, c = store._connect(path)
+        rows = c.execute('SELECT uid, home_odds, result FROM odds '
+                         'ORDER BY id').fetchall()
+        connection.close()
+    try:
+        assert first == {'inserted': 2, 'rescheduled': 0, 'unchanged': 0,
+                         'skipped': 0}
+        assert again == {'inserted': 0, 'rescheduled': 0, 'unchanged': 2,
+                         'skipped': 2}
+        assert odds == {'updated': 1, 'unchanged': 0, 'skipped': 1}
+        assert scores == {'updated': 2, 'unchanged': 0, 'skipped': 0}
+        assert rows == [('MUN-MCI-2016', 0.72727, 'A'),
+                        ('ARS-SOU-2016', None, 'H')]
+    except AssertionError:
+        print(first, again, odds, scores, rows)
+        raise
+    return
+
+
+def test_unchanged():
+    print('Testing writes of unchanged fixtures')
+    fixtures = retrieve.get_fixtures(body=BBC_PAGE)
+    fixtures[0].set_odds('8/11', '5/2', '4/1')
+    results = retrieve.get_results(body=BBC_PAGE)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'odds.sqlite')
+        with store.Writer(path) as w:
+            w.enter_fixtures(fixtures)
+            w.update_odds(fixtures, '2016-09-08 09:00:00')
+            w.update_results(results)
+        with store.Writer(path) as w:
+            fixtures[1].set_time('17:30')
+            moved = w.enter_fixtures(fixtures)
+            odds = w.update_odds(fixtures, '2016-09-09 09:00:00')
+            scores = w.update_results(results)
+            version = w.version
+        connection, c = store._connect(path)
+        rows = c.execute('SELECT uid, time FROM odds WHERE modified = ?',
+                         (version,)).fetchall()
+        stored = list(fixture.FixtureBatch.from_rows(
+            c.execute('SELECT * FROM odds ORDER BY uid')))
+        connection.close()
+        stored[1].set_odds('4/5', '5/2', '7/2')
+        with store.Writer(path) as w:
+            w.update_odds(stored, '2016-09-20 09:00:00')
+        history = store.odds_history('MUN-MCI-2016', path=path)
+        connection, c = store._connect(path)
+        stamp = c.execute('SELECT timestamp FROM odds WHERE uid = ?',
+                          ('MUN-MCI-2016',)).fetchone()[0]
+        connection.close()
+    try:
+        assert moved == {'inserted': 0, 'rescheduled': 1, 'unchanged': 1,
+                         'skipped': 1}
+        assert odds == {'updated': 0, 'unchanged': 1, 'skipped': 2}
+        assert scores == {'updated': 0, 'unchanged': 2, 'skipped': 2}
+        assert rows == [('ARS-SOU-2016', '17:30:00')]
+        assert stored[1].uid == 'MUN-MCI-2016' and stamp == '2016-09-20'
+        assert len(history) == 2
+    except AssertionError:
+        print(moved, odds, scores, rows, stamp, history)
+        raise
+    return
+
+
+def test_journal():
+    print('Testing resuming from the journal')
+    calls = []
+
+    def locked(self, entries, captured=None):
+        calls.append(len(entries))
+        raise sqlite3.OperationalError('database is locked')
+
+    update_odds, backoff = store.Writer.update_odds, journal.BACKOFF
+    store.Writer.update_odds, journal.BACKOFF = locked, 0
+    try:
+        with standin.StandIn() as server, \
+                tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'odds.sqlite')
+            j = journal.Journal(os.path.join(folder, 'journal'))
+            failed = main.update(path, competitions=[server.competition()],
+                                 j=j)
+            pending = j.pending() and j.load('parsed') is not None
+            store.Writer.update_odds = update_odds
+            requests = server.requests
+            server.stop() # the journal is stored without downloading
+            resumed = main.resume(path, j)
+            connection, c = store._connect(path)
+            priced = c.execute('SELECT count(*) FROM odds WHERE home_odds '
+                               'IS NOT NULL').fetchone()[0]
+            connection.close()
+    finally:
+        store.Writer.update_odds, journal.BACKOFF = update_odds, backoff
+    try:
+        assert failed == {} and pending and len(calls) == journal.ATTEMPTS
+        assert requests == 3
+        assert resumed['fixtures']['inserted'] == 71
+        assert resumed['odds']['updated'] == priced == 20
+        assert not j.pending()
+    except AssertionError:
+        print(failed, pending, calls, resumed, priced)
+        raise
+    return
+
+
+def test_archive():
+    print('Testing page archive and reparsing')
+    pages = standin.recorded()
+    with standin.StandIn(pages) as server, \
+            tempfile.TemporaryDirectory() as folder:
+        with archive.Archive(os.path.join(folder, 'archive')) as a:
+            for num in range(2):
+                main.update(os.path.join(folder, 'live.sqlite'),
+                            competitions=[server.competition()], archive=a)
+            stats = a.stats()
+            for source in ('fixtures', 'odds', 'results'):
+                a.add('http://example.com/' + source, pages['/' + source],
+                      source, 'premier-league', '2016-09-12 09:00:00')
+            entries = a.entries(['odds'], until='2016-12-31')
+            with a.open(entries[0][1]) as f:
+                start = f.read(15)
+            path = os.path.join(folder, 'odds.sqlite')
+            totals = archive.reparse(a, path, since='2016-01-01',
+                                     until='2016-12-31', processes=2)
+            # an older page, reparsed once the results are in, only adds
+            # to the history of prices
+            a.add('http://example.com/odds', pages['/odds'].replace(
+                b'(4/5)', b'(5/6)'), 'odds', 'premier-league',
+                '2016-09-10 09:00:00')
+            older = archive.reparse(a, path, ['odds'], since='2016-09-10',
+                                    until='2016-09-11', processes=1)
+        history = store.odds_history('CHE-SWA-2016', path=path)
+        connection, c = store._connect(path)
+        latest = c.execute('SELECT home_odds, result FROM odds WHERE uid = ?',
+                           ('CHE-SWA-2016',)).fetchone()
+        connection.close()
+    try:
+        assert stats['pages'] == 6 and stats['objects'] == 3
+        assert stats['stored'] < stats['bytes'] / 3
+        assert len(entries) == 1 and start == b'<!DOCTYPE html>'
+        assert totals['pages'] == {'parsed': 3, 'failed': 0}
+        assert totals['fixtures']['inserted'] == 71
+        assert totals['odds']['updated'] == 20
+        assert totals['results']['updated'] == 80
+        assert older['odds'] == {'recorded': 20, 'updated': 0,
+                                 'skipped': 0}
+        assert [h[:2] for h in history] == [('2016-09-10 09:00:00', 0.83333),
+                                            ('2016-09-12 09:00:00', 0.8)]
+        assert latest[0] == 0.8 and latest[1] is not None
+    except AssertionError:
+        print(stats, entries, start, totals, older, history, latest)
+        raise
+    return
+
+
+class _Interrupt:
+    """ An archive which stops a backfill at its October pages.
+    """
+
+    def add(self, url, body, source, competition=None):
+        if url.endswith('2016-10'):
+            raise RuntimeError('Stopped')
+
+
+def test_backfill():
+    print('Testing backfill of past months')
+    pages = {'/results/2016-09': standin.recorded()['/results']}
+    with standin.StandIn(pages) as server, \
+            tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'odds.sqlite')
+        chosen = [server.competition()]
+        start = time.time()
+        first = backfill.backfill('2016-08', '2016-09', chosen, path,
+                                  rate=20, processes=2)
+        elapsed = time.time() - start
+        requests = server.requests
+        # the missing month is now there, and the month loaded is kept
+        pages['/results/2016-08'] = pages['/results/2016-09']
+        second = backfill.backfill('2016-08', '2016-09', chosen, path,
+                                   processes=1)
+        requests = (requests, server.requests)
+        done = sorted(backfill.completed(path))
+        connection, c = store._connect(path)
+        rows = c.execute('SELECT count(*), count(result), count(time) '
+                         'FROM odds').fetchone()
+        connection.close()
+        # a run stopped part way keeps the windows already loaded
+        pages['/results/2016-10'] = pages['/results/2016-09']
+        stopped = os.path.join(folder, 'stopped.sqlite')
+        try:
+            backfill.backfill('2016-09', '2016-10', chosen, stopped,
+                              processes=1, batch=1, archive=_Interrupt())
+        except RuntimeError:
+            pass
+        kept = sorted(backfill.completed(stopped))
+        # only months before this one are done, later ones are loaded again
+        pages['/fixtures/2016-09'] = standin.recorded()['/fixtures']
+        pages['/fixtures/2016-10'] = pages['/fixtures/2016-09']
+        current = os.path.join(folder, 'current.sqlite')
+        runs = [backfill.backfill('2016-08', '2016-10', chosen, current,
+                                  processes=1,
+                                  today=datetime.date(2016, 9, 15))
+                for _ in range(2)]
+        finished = sorted(backfill.completed(current))
+    try:
+        assert requests == (2, 3)
+        assert elapsed >= 0.05
+        assert first['months'] == {'loaded': 1, 'failed': 1, 'skipped': 0}
+        assert first['fixtures']['inserted'] == rows[0]
+        assert second['months'] == {'loaded': 1, 'failed': 0, 'skipped': 1}
+        assert second['fixtures']['inserted'] == 0
+        assert done == [('premier-league', '2016-08'),
+                        ('premier-league', '2016-09')]
+        assert rows[0] == rows[1] and rows[2] == 0
+        assert list(backfill.months('2016-11', '2017-02'))[1:3] == [
+            (2016, 12), (2017, 1)]
+        assert kept == [('premier-league', '2016-09')]
+        assert finished == [('premier-league', '2016-08')]
+        assert runs[1]['months'] == {'loaded': 2, 'failed': 0,
+                                     'skipped': 1}
+    except AssertionError:
+        print(requests, elapsed, first, second, done, rows, kept, finished,
+              runs)
+        raise
+    return
+
+
+def test_bookmaker_odds():
+    print('Testing odds of every bookmaker')
+    grid = standin.recorded(routes={'/grid': 'oddschecker-match.html'})
+    body = grid['/grid']
+    pages = {'/odds/chelsea-v-swansea/winner': body,
+             '/odds/arsenal-v-everton/winner': body.replace(
+                 b'Chelsea', b'Arsenal').replace(b'Swansea', b'Everton')}
+    fixtures = retrieve.get_fixtures(body=standin.recorded()['/fixtures'])
+    bookmakers, outcomes, cells = retrieve.read_grid(body)
+    with standin.StandIn(pages) as server, \
+            tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'odds.sqlite')
+        store.enter_fixtures(fixtures, path)
+        summary = main.update_bookmakers(path, [server.competition()],
+                                         days=0,
+                                         today=datetime.date(2016, 9, 17))
+        requests = server.requests
+        prices = store.bookmaker_odds('CHE-SWA-2016', path)
+        connection, c = store._connect(path)
+        derived = c.execute('SELECT {} FROM odds WHERE uid = ?'.format(
+            ', '.join(store.DERIVED)), ('CHE-SWA-2016',)).fetchone()
+        connection.close()
+    try:
+        assert len(bookmakers) == 8 and bookmakers[0] == 'bet365'
+        assert outcomes == ['Chelsea', 'Draw', 'Swansea']
+        assert cells[0][:2] == ['4/5', '8/11'] and cells[0][-1] == ''
+        assert requests == 10 # one for each fixture on the day
+        assert summary['bookmakers'] == {'inserted': 42, 'updated': 2,
+                                         'skipped': 0}
+        assert len(prices) == 21
+        assert prices[0] == ('Betfred', 'A', 3.0)
+        assert derived[:3] == (0.8, 2.75, 3.5)
+        assert 0.72727 < derived[3] < 0.8 and 3.0 < derived[5] < 3.5
+    except AssertionError:
+        print(bookmakers, outcomes, cells, requests, summary, prices,
+              derived)
+        raise
+    return
+
+
+def test_odds_history():
+    print('Testing odds history')
+    fixtures = retrieve.get_fixtures(body=BBC_PAGE)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'odds.sqlite')
+        with store.Writer(path) as w:
+            w.enter_fixtures(fixtures)
+            fixtures[0].set_odds('8/11', '5/2', '4/1')
+            w.update_odds(fixtures, '2016-09-08 09:00:00')
+            fixtures[0].set_odds('4/5', '9/4', '7/2')
+            w.update_odds(fixtures, '2016-09-09 09:00:00')
+        history = store.odds_history('MUN-MCI-2016', path=path)
+        later = store.odds_history('MUN-MCI-2016', since='2016-09-09',
+                                   path=path)
+        connection, c = store._connect(path)
+        latest = c.execute('SELECT home_odds FROM odds WHERE uid = ?',
+                           ('MUN-MCI-2016',)).fetchone()
+        connection.close()
+    try:
+        assert history == [('2016-09-08 09:00:00', 0.72727, 2.5, 4.0),
+                           ('2016-09-09 09:00:00', 0.8, 2.25, 3.5)]
+        assert later == history[1:]
+        assert latest == (0.8,)
+    except AssertionError:
+        print(history, later, latest)
+        raise
+    return
+
+
+def test_export():
+    print('Testing export')
+    fixtures = retrieve.get_fixtures(body=BBC_PAGE)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'odds.sqlite')
+        store.enter_fixtures(fixtures, path=path)
+        out = io.StringIO()
+        n = store.export(out, team='arsenal', columns=['uid', 'date'],
+                         database=path)
+        gz = os.path.join(folder, 'odds.csv.gz')
+        total = store.export(gz, chunk=1, database=path)
+        with gzip.open(gz, 'rt') as f:
+            lines = f.read().splitlines()
+        none = store.export(io.StringIO(), start='2016-09-11', database=path)
+        # an open binary file is compressed too, and a text one refused
+        binary = io.BytesIO()
+        store.export(binary, compress=True, database=path)
+        unzipped = gzip.decompress(binary.getvalue()).decode('utf-8')
+        try:
+            store.export(io.StringIO(), compress=True, database=path)
+            refused = False
+        except ValueError:
+            refused = True
+    try:
+        assert n == 1
+        assert out.getvalue().splitlines() == ['ID,DATE',
+                                               'ARS-SOU-2016,2016-09-10']
+        assert total == 2 and len(lines) == 3
+        assert lines[0].split(',') == list(definitions.ROW_HEADINGS)
+        assert none == 0
+        assert unzipped.splitlines() == lines and not binary.closed
+        assert refused
+    except AssertionError:
+        print(n, out.getvalue(), total, lines, none, unzipped, refused)
+        raise
+    return
+
+
+def test_arrays():
+    print('Testing columnar export')
+    fixtures = retrieve.get_fixtures(body=BBC_PAGE)
+    results = retrieve.get_results(body=BBC_PAGE)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'odds.sqlite')
+        parts = os.path.join(folder, 'arrays')
+        store.enter_fixtures(fixtures, path=path)
+        counts = [arrays.export_arrays(parts, path)]
+        store.update_results(results[1:], path=path)
+        counts.append(arrays.export_arrays(parts, path))
+        counts.append(arrays.export_arrays(parts, path))
+        a = arrays.load_arrays(parts)
+    try:
+        assert counts == [2, 1, 0]
+        assert a['uid'].tolist() == ['MUN-MCI-2016', 'ARS-SOU-2016']
+        assert a['teams'][a['home']].tolist() == ['Man Utd', 'Arsenal']
+        assert a['result'].tolist() == [-1, 0]
+        assert a['date'].tolist() == [17054, 17054] # days since 1970
+        assert a['time'].tolist() == [750, 900]
+    except AssertionError:
+        print(counts, a)
+        raise
+    return
+
+
+def test_backup():
+    print('Testing backups')
+    fixtures = retrieve.get_fixtures(body=BBC_PAGE)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'odds.sqlite')
+        saves = os.path.join(folder, 'backup')
+        store.enter_fixtures(fixtures, path=path)
+        copy = store.backup(saves, compress=True, database=path)
+        restored = store.restore(copy, os.path.join(folder, 'new.sqlite'))
+        connection, c = store._connect(restored)
+        rows = c.execute('SELECT uid FROM odds ORDER BY id').fetchall()
+        connection.close()
+        # a backup made within a second of another is numbered, not put in
+        # its place, before prune keeps the latest of the day
+        twice = [store.backup(saves, database=path)]
+        both = [os.path.isfile(twice[0])]
+        twice.append(store.backup(saves, database=path))
+        both.append(os.path.isfile(twice[1]))
+        for name in os.listdir(saves):
+            os.remove(os.path.join(saves, name))
+        # one backup a day for three weeks, plus two on the last day
+        for day in range(1, 22):
+            name = 'odds-2016-09-{:02d}T120000.sqlite'.format(day)
+            open(os.path.join(saves, name), 'w').close()
+        open(os.path.join(saves, 'odds-2016-09-21T080000.sqlite'), 'w').close()
+        removed = store.prune(saves, keep_daily=2, keep_weekly=3)
+        kept = sorted(os.listdir(saves))
+    try:
+        assert copy.endswith('.sqlite.gz')
+        assert twice[0] != twice[1] and both == [True, True]
+        assert rows == [('MUN-MCI-2016',), ('ARS-SOU-2016',)]
+        assert kept == ['odds-2016-09-11T120000.sqlite', # weeks
+                        'odds-2016-09-18T120000.sqlite',
+                        'odds-2016-09-20T120000.sqlite', # days
+                        'odds-2016-09-21T120000.sqlite']
+        assert len(removed) == 22 - len(kept)
+    except AssertionError:
+        print(copy, twice, rows, kept)
+        raise
+    return
+
+
+def test_query():
+    print('Testing indexed queries')
+    fixtures = retrieve.get_fixtures(body=BBC_PAGE)
+    results = retrieve.get_results(body=BBC_PAGE)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'odds.sqlite')
+        with store.Writer(path) as w:
+            w.enter_fixtures(fixtures)
+            w.update_results(results[:1])
+        with query.Query(path) as q:
+            team = [row[1] for row in q.by_team('man city')]
+            dates = q.by_dates('2016-09-10', columnar=True)
+            away = [row[1] for row in q.by_result('A')]
+            upcoming = [row[1] for row in q.upcoming('2016-09-10')]
+            unsettled = [row[1] for row in q.unsettled('2016-09-11')]
+            plan = q.c.execute('EXPLAIN QUERY PLAN ' + query.BY_DATES,
+                               ('a', 'b')).fetchall()
+    try:
+        assert team == ['MUN-MCI-2016']
+        assert dates.uids == ['MUN-MCI-2016', 'ARS-SOU-2016']
+        assert away == ['MUN-MCI-2016']
+        assert upcoming == unsettled == ['ARS-SOU-2016']
+        assert 'odds_date' in plan[0][-1]
+    except AssertionError:
+        print(team, dates.uids, away, upcoming, unsettled, plan)
+        raise
+    return
+
+
+def test_analytics():
+    print('Testing market analytics')
+    fixtures = retrieve.get_fixtures(body=BBC_PAGE)
+    fixtures[0].set_odds('1/1', '3/1', '3/1')
+    fixtures[1].set_odds('1/3', '4/1', '9/1')
+    results = retrieve.get_results(body=BBC_PAGE)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'odds.sqlite')
+        with store.Writer(path) as w:
+            w.enter_fixtures(fixtures)
+            w.update_odds(fixtures)
+            w.update_results(results)
+        counts = [analytics.refresh(path), analytics.refresh(path)]
+        market = analytics.load_market(path, season=2016)
+        connection, c = store._connect(path)
+        teams = c.execute('SELECT team, played, wins, favourite, '
+                          'favourite_wins FROM team_summary '
+                          'ORDER BY team').fetchall()
+        connection.close()
+    try:
+        assert counts == [2, 0]
+        assert market['uid'] == ['ARS-SOU-2016', 'MUN-MCI-2016']
+        assert market['probabilities'][1].tolist() == [0.5, 0.25, 0.25]
+        assert abs(market['overround'][0] - (0.75 + 0.2 + 0.1 - 1)) < 1e-4
+        assert market['favourite'].tolist() == [0, 0]
+        assert teams == [('Arsenal', 1, 1, 1, 1), ('Man City', 1, 1, 0, 0),
+                         ('Man Utd', 1, 0, 1, 0), ('Southampton', 1, 0, 0, 0)]
+    except AssertionError:
+        print(counts, market, teams)
+        raise
+    return
+
+
+def test_backtest():
+    print('Testing backtests')
+    odds = [[0.5, 3.0, 5.0], [2.0, 2.5, 1.0], [0.8, 2.0, 3.0],
+            [4.0, 2.5, 0.7]]
+    fixtures = {'odds': np.array(odds),
+                'result': np.array([0, 2, 1, 0], dtype='int8')}
+    results = backtest.evaluate(fixtures, backtest.favourites(fixtures))
+    configurations = backtest.grid(max_odds=[0.6, 0.75, 1.0])
+    swept = backtest.sweep(backtest.favourites, configurations, fixtures,
+                           processes=2)
+    serial = backtest.sweep(backtest.favourites, configurations, fixtures,
+                            processes=1)
+    try:
+        # won at 0.5 and 1.0, lost 1 and then 1 again
+        assert results['bets'] == 4 and results['pnl'] == -0.5
+        assert results['hit_rate'] == 0.5 and results['roi'] == -0.125
+        assert results['max_drawdown'] == 2.0
+        assert [r['bets'] for p, r in swept] == [1, 2, 4]
+        assert swept == serial
+    except AssertionError:
+        print(results, swept, serial)
+        raise
+    return
+
+
+def test_schedule():
+    print('Testing polling schedule')
+    kickoff = datetime.datetime(2016, 9, 10, 15, 0)
+    s = daemon.Schedule([kickoff])
+    start = datetime.datetime(2016, 9, 8, 9, 0)
+    first = s.due(start)
+    s.polled(first, start)
+    # two days out, odds every three hours
+    two_days = s.next_wake(start)
+    # on the day, odds every fifteen minutes
+    morning = datetime.datetime(2016, 9, 10, 10, 0)
+    s.polled(['odds', 'results'], morning)
+    on_the_day = s.next_odds(morning)
+    # results from full time, then every fifteen minutes until settled
+    full_time = s.next_results(morning)
+    s.polled(['results'], full_time)
+    retry = s.next_results(full_time)
+    s.kickoffs = [] # settled
+    idle = s.next_odds(full_time)
+    try:
+        assert first == ['fixtures', 'odds', 'results']
+        assert two_days == start + 3*daemon.HOUR
+        assert on_the_day == morning + 15*daemon.MINUTE
+        assert full_time == kickoff + daemon.FULL_TIME
+        assert retry == full_time + daemon.RESULTS_RETRY
+        assert idle == s.last['odds'] + daemon.ODDS_IDLE
+    except AssertionError:
+        print(first, two_days, on_the_day, full_time, retry, idle)
+        raise
+    return
+
+
+def test_cli():
+    print('Testing command line')
+    fixtures = retrieve.get_fixtures(body=BBC_PAGE)
+    results = retrieve.get_results(body=BBC_PAGE)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'odds.sqlite')
+        store.enter_fixtures(fixtures, path)
+        store.update_results(results, path)
+        output = io.StringIO()
+        stdout, sys.stdout = sys.stdout, output
+        try:
+            status = cli.run(['--database', path, 'query', '--result', 'H'])
+        finally:
+            sys.stdout = stdout
+        # a store-only command loads neither requests nor lxml
+        loaded = subprocess.check_output(
+            [sys.executable, '-c', 'import sys, cli; cli.run(["--database", '
+             '{!r}, "export", "-"]); print(sorted(m for m in sys.modules if '
+             'm in ("requests", "lxml", "numpy")))'.format(path)],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    lines = output.getvalue().splitlines()
+    try:
+        assert status == 0 and len(lines) == 2
+        assert lines[1].split(',')[1:4] == ['ARS-SOU-2016', 'Arsenal',
+                                            'Southampton']
+        assert loaded.splitlines()[-1] == b'[]'
+    except AssertionError:
+        print(status, lines, loaded)
+        raise
+    return
+
+
 def test_connection():
     print('Testing connection to database')
-    connection, c = store._connect()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'odds.sqlite')
+        connection, c = store._connect(path)
+        version = c.execute('PRAGMA user_version').fetchone()[0]
+        connection.close()
+        with open(path, 'rb') as f:
+            before = f.read()
+        connection, c = store._connect(path) # the schema is not written again
+        connection.close()
+        market = analytics.load_market(path) # nor by reading the analytics
+        with open(path, 'rb') as f:
+            after = f.read()
     try:
-        assert c
+        assert c and version == store.SCHEMA
+        assert before == after and market['uid'] == []
     except AssertionError:
-        print('Cannot open database')
+        print('Cannot open database', version)
         raise
+    return
 
 if __name__ == '__main__':
     test_fixture()
+    test_fixture_batch()
+    test_odds_array()
     test_retrieve_odds()
     test_retrieve_results()
+    test_standin()
+    test_iter_matches()
+    test_fetch_all()
+    test_competitions()
+    test_host_limits()
+    test_metrics()
+    test_page_cache()
+    test_match_odds()
+    test_writer()
+    test_unchanged()
+    test_journal()
+    test_archive()
+    test_backfill()
+    test_bookmaker_odds()
+    test_odds_history()
+    test_export()
+    test_arrays()
+    test_backup()
+    test_query()
+    test_analytics()
+    test_backtest()
+    test_schedule()
+    test_cli()
     test_connection()
     print('Tests completed')